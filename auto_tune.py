@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+自动选择处理方式
+在加载任何工作簿之前估算每个输入文件的处理开销：
+    .xlsx读取压缩包中工作表XML的解压后大小和<dimension>记录的行列范围（只读取XML开头的一小段），
+    .xls读取xlrd工作表头部的行数和列数，患者库数据库读取导入时记录的行数，
+然后选择B表的读取方式和索引类型、日报表的预读文件数和结果文件的压缩级别，并打印选择的原因。
+
+日报表需要复制样式和合并单元格，始终使用openpyxl完整加载；B表只需要比较列和补充列的值，
+可以按大小选择完整加载或只读流式读取。
+"""
+
+import os
+import zipfile
+
+from openpyxl.utils.cell import range_boundaries
+
+from library_store import is_library_store, LibraryStore
+from xlsx_append import find_sheet_part, DIMENSION_PATTERN
+
+try:
+    import xlrd
+except ImportError:
+    xlrd = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# 查找<dimension>时读取的工作表XML开头字节数
+DIMENSION_SCAN_BYTES = 64 * 1024
+
+# 没有<dimension>时按工作表XML大小估算单元格数，每个单元格约占的XML字节数
+XML_BYTES_PER_CELL = 40
+
+# 没有行列信息的.xls按文件大小估算单元格数，每个单元格约占的文件字节数
+XLS_BYTES_PER_CELL = 12
+
+# 只知道单元格数时假定的列数
+DEFAULT_COLUMN_COUNT = 10
+
+# openpyxl完整加载时每个单元格约占的内存（单元格对象、值和样式数组）
+OPENPYXL_BYTES_PER_CELL = 300
+
+# set索引每个B表键约占的内存（字典槽位和字符串对象）
+SET_INDEX_BYTES_PER_KEY = 100
+
+# 可用内存中允许本次处理使用的比例，无法获取可用内存时假定的大小
+MEMORY_BUDGET_RATIO = 0.5
+DEFAULT_AVAILABLE_MEMORY = 2 * 1024 ** 3
+
+# B表单元格数超过此值时只读流式读取
+B_READ_ONLY_MIN_CELLS = 200_000
+
+# B表行数超过此值时使用hashed索引
+B_HASHED_MIN_ROWS = 1_000_000
+
+# 预读文件数上限，日报表的加载受GIL限制，更多的预读线程只会增加内存占用
+MAX_PREFETCH = 2
+
+# 结果单元格数超过此值时使用快速压缩保存
+FAST_COMPRESSION_MIN_CELLS = 1_000_000
+FAST_COMPRESSION_LEVEL = 1
+
+class InputEstimate:
+    """
+    一个输入文件的大小估算
+
+    rows、columns为工作表的行数和列数，cells为单元格数；
+    source说明估算依据（如"dimension"、"xlrd"、"XML大小"），用于打印选择原因。
+    """
+
+    __slots__ = ("path", "file_size", "xml_size", "rows", "columns", "cells", "source")
+
+    def __init__(self, path, file_size, rows, columns, source, xml_size=None):
+        self.path = path
+        self.file_size = file_size
+        self.xml_size = xml_size
+        self.rows = rows
+        self.columns = columns
+        self.cells = rows * columns
+        self.source = source
+
+    def describe(self):
+        """简短的估算说明"""
+        name = os.path.basename(self.path)
+        return f"{name} 约{self.rows}行×{self.columns}列（{self.source}）"
+
+def _from_cells(path, file_size, cells, source, xml_size=None):
+    columns = DEFAULT_COLUMN_COUNT
+    return InputEstimate(path, file_size, max(1, cells // columns), columns, source, xml_size)
+
+def estimate_xlsx(path, sheet=None):
+    """按压缩包中工作表XML的解压后大小和<dimension>估算xlsx文件，不解析单元格"""
+    file_size = os.path.getsize(path)
+    with zipfile.ZipFile(path) as archive:
+        part = find_sheet_part(archive, sheet) if sheet else None
+        # 与处理时一致，找不到指定的工作表时使用活动表
+        part = part or find_sheet_part(archive, None)
+        if part is None:
+            return _from_cells(path, file_size, file_size // XML_BYTES_PER_CELL, "文件大小")
+        xml_size = archive.getinfo(part).file_size
+        with archive.open(part) as source:
+            match = DIMENSION_PATTERN.search(source.read(DIMENSION_SCAN_BYTES))
+
+    if match:
+        corners = match.group(1).decode("ascii").split(":")
+        try:
+            min_col, min_row, max_col, max_row = range_boundaries(f"{corners[0]}:{corners[-1]}")
+        except ValueError:
+            min_row = None
+        # 有些程序写出的dimension只有"A1"，与XML大小明显不符时不采用
+        if min_row is not None and (max_row - min_row + 1) * (max_col - min_col + 1) * XML_BYTES_PER_CELL * 10 >= xml_size:
+            return InputEstimate(path, file_size, max_row, max_col, "dimension", xml_size)
+    return _from_cells(path, file_size, xml_size // XML_BYTES_PER_CELL, "XML大小", xml_size)
+
+def estimate_xls(path, sheet=None):
+    """按xlrd读取的工作表行列数估算xls文件，没有xlrd时按文件大小估算"""
+    file_size = os.path.getsize(path)
+    if xlrd is not None:
+        try:
+            # on_demand只加载需要的工作表
+            book = xlrd.open_workbook(path, on_demand=True)
+            try:
+                xls_sheet = book.sheet_by_name(sheet) if sheet in book.sheet_names() else book.sheet_by_index(0)
+                return InputEstimate(path, file_size, xls_sheet.nrows, xls_sheet.ncols, "xlrd")
+            finally:
+                book.release_resources()
+        except Exception as e:
+            print(f"读取 {os.path.basename(path)} 的工作表信息失败，按文件大小估算: {str(e)}")
+    return _from_cells(path, file_size, file_size // XLS_BYTES_PER_CELL, "文件大小")
+
+def estimate_input(path, sheet=None):
+    """
+    估算一个输入文件的大小
+
+    参数:
+        path: xlsx、xls文件或患者库数据库的路径
+        sheet: 工作表名称，默认为活动表
+
+    返回:
+        InputEstimate对象
+    """
+    if is_library_store(path):
+        meta = LibraryStore(path).meta()
+        return InputEstimate(path, os.path.getsize(path), meta.get("row_count", 0), len(meta.get("header", [])) or 1,
+                             "患者库数据库")
+    if os.path.splitext(path)[1].lower() == ".xls":
+        return estimate_xls(path, sheet)
+    try:
+        return estimate_xlsx(path, sheet)
+    except (zipfile.BadZipFile, KeyError) as e:
+        print(f"无法读取 {os.path.basename(path)} 的压缩包信息，按文件大小估算: {str(e)}")
+        file_size = os.path.getsize(path)
+        return _from_cells(path, file_size, file_size // XML_BYTES_PER_CELL, "文件大小")
+
+def available_memory_bytes():
+    """当前可用的物理内存（字节），无法获取时返回None"""
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def format_bytes(size):
+    """以MB为单位显示字节数"""
+    return f"{size / 1024 ** 2:.0f}MB"
+
+def choose_settings(file_a_paths, file_b_paths, sheet_a=None, sheet_a_map=None, sheet_b=None, sheet_b_map=None,
+                    b_columns=None, b_index=None, save_options=None):
+    """
+    估算输入大小并选择处理方式
+
+    参数含义与process_excel_files相同，file_b_paths为患者库路径列表。
+    save_options中已经指定的压缩级别保持不变。
+
+    返回:
+        设置字典: "prefetch"（预读文件数）、"b_index_backend"（B表索引类型）、
+        "b_read_only"（是否只读流式读取B表）、"compression"（压缩级别，None为默认）、
+        "compression_specified"（压缩级别是否由save_options指定）以及"reasons"（选择原因的列表）
+    """
+    sheet_a_map = sheet_a_map or {}
+    sheet_b_map = sheet_b_map or {}
+    # 不存在的文件在处理时报告，这里跳过
+    a_estimates = [estimate_input(path, sheet_a_map.get(path, sheet_a)) for path in file_a_paths if os.path.exists(path)]
+    b_estimates = [estimate_input(path, sheet_b_map.get(path, sheet_b)) for path in file_b_paths if os.path.exists(path)]
+    reasons = []
+
+    # B表读取方式和索引类型
+    b_rows = sum(estimate.rows for estimate in b_estimates)
+    b_cells = max((estimate.cells for estimate in b_estimates), default=0)
+    b_read_only = b_cells >= B_READ_ONLY_MIN_CELLS
+    b_description = "、".join(estimate.describe() for estimate in b_estimates)
+    if b_index is not None:
+        b_read_only = False
+        b_index_backend = "set"
+        reasons.append("使用预先建立的B表索引，不读取B表")
+    else:
+        if b_read_only:
+            reasons.append(f"患者库 {b_description}，超过{B_READ_ONLY_MIN_CELLS}个单元格，只读流式读取B表以减少内存占用")
+        else:
+            reasons.append(f"患者库 {b_description}，完整加载B表")
+        if b_rows < B_HASHED_MIN_ROWS:
+            b_index_backend = "set"
+            reasons.append(f"患者库共约{b_rows}行，使用set索引")
+        elif b_columns:
+            b_index_backend = "set"
+            reasons.append(f"患者库共约{b_rows}行，但需要补充B表列，只能使用set索引")
+        else:
+            b_index_backend = "hashed"
+            reasons.append(f"患者库共约{b_rows}行，超过{B_HASHED_MIN_ROWS}行，使用hashed索引节省内存")
+
+    # 预读文件数：按最大的日报表估算完整加载占用的内存
+    largest = max(a_estimates, key=lambda estimate: estimate.cells, default=None)
+    if largest is None or len(a_estimates) <= 1:
+        prefetch = 0
+        reasons.append("只有一个日报表，不预读")
+    else:
+        available = available_memory_bytes()
+        memory_note = "" if available is not None else "（无法获取可用内存，按2GB估算）"
+        if available is None:
+            available = DEFAULT_AVAILABLE_MEMORY
+        budget = available * MEMORY_BUDGET_RATIO
+        if b_index_backend == "set":
+            budget -= b_rows * SET_INDEX_BYTES_PER_KEY
+        workbook_memory = max(1, largest.cells * OPENPYXL_BYTES_PER_CELL)
+        # 预算中还要留出正在处理的一个工作簿
+        prefetch = max(0, min(MAX_PREFETCH, len(a_estimates) - 1, int(budget // workbook_memory) - 1))
+        reasons.append(
+            f"最大的日报表 {largest.describe()}，完整加载约需{format_bytes(workbook_memory)}，"
+            f"可用内存{format_bytes(available)}{memory_note}，预读{prefetch}个文件"
+        )
+
+    # 压缩级别：结果很大时快速压缩，缩短保存时间
+    compression = (save_options or {}).get("compression")
+    if compression is not None:
+        reasons.append(f"使用指定的压缩级别{compression}")
+    else:
+        a_cells = sum(estimate.cells for estimate in a_estimates)
+        if a_cells >= FAST_COMPRESSION_MIN_CELLS:
+            compression = FAST_COMPRESSION_LEVEL
+            reasons.append(f"日报表共约{a_cells}个单元格，结果可能很大，使用快速压缩保存")
+        else:
+            reasons.append(f"日报表共约{a_cells}个单元格，使用默认压缩保存")
+
+    return {
+        "prefetch": prefetch,
+        "b_index_backend": b_index_backend,
+        "b_read_only": b_read_only,
+        "compression": compression,
+        "compression_specified": (save_options or {}).get("compression") is not None,
+        "reasons": reasons,
+    }
@@ -98,6 +98,14 @@ def main():
     required_files = [
         "excel_ui.py",
         "excel_processor.py",
+        "job_queue.py",
+        "pipeline.py",
+        "run_history.py",
+        "key_index.py",
+        "library_store.py",
+        "xlsx_append.py",
+        "auto_tune.py",
+        "checkpoint.py",
         "excel_icon.ico",
         "requirements.txt",
         "excel-app.spec",
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+批量处理的断点续传
+任务目录中保存:
+    progress.json  任务指纹、每个日报表的状态（完成或失败）、匹配行数和错误信息
+    file_0001.pkl  每个处理完成的日报表的匹配结果（匹配行记录、样式、合并区域和统计信息）
+    errors.txt     处理失败的日报表及错误原因
+
+再次用同一个任务目录运行相同的任务（相同的日报表列表、患者库和处理参数）时，
+已完成且文件未被修改的日报表直接读取保存的结果，只重新处理失败和未处理的日报表；
+保存结果文件失败（如磁盘已满）后重新运行，所有日报表都从任务目录读取，只需重新保存。
+任务指纹不同时清空任务目录中的进度，从头开始。
+"""
+
+import os
+import json
+import time
+import pickle
+import hashlib
+import threading
+
+# 只影响耗时、不影响匹配结果的参数，不计入任务指纹。
+# 追加模式改变结果写入的位置和方式（追加到已有文件而不是新建文件），计入指纹，切换时从头开始
+TIMING_PARAMS = ("compression", "prefetch", "b_index_backend", "b_read_only", "auto")
+
+PROGRESS_FILE = "progress.json"
+ERROR_REPORT_FILE = "errors.txt"
+
+def file_signature(path):
+    """文件的修改时间和大小，文件不存在时返回None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+def job_fingerprint(file_a_paths, file_b_paths, params):
+    """
+    任务指纹：日报表列表、患者库（含修改时间和大小）和影响匹配结果的参数都相同时视为同一个任务
+    """
+    params = {name: value for name, value in params.items() if name not in TIMING_PARAMS}
+    source = json.dumps([
+        [os.path.abspath(path) for path in file_a_paths],
+        [[os.path.abspath(path), file_signature(path)] for path in file_b_paths],
+        params,
+    ], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(source.encode("utf-8"), digest_size=8).hexdigest()
+
+class JobCheckpoint:
+    """一个任务目录中的进度和各日报表的匹配结果"""
+
+    def __init__(self, job_dir, fingerprint):
+        self.job_dir = job_dir
+        self.fingerprint = fingerprint
+        # 加载失败在预读线程中记录，与主线程的保存互斥
+        self._lock = threading.Lock()
+        os.makedirs(job_dir, exist_ok=True)
+        self.progress = self._load_progress()
+        if self.progress.get("fingerprint") != fingerprint:
+            if self.progress.get("files"):
+                print(f"任务目录 {job_dir} 中的进度属于其他任务（日报表、患者库或参数不同），从头开始处理")
+            self._clear()
+            self.progress = {"fingerprint": fingerprint, "files": {}, "saved_path": None}
+            self._write_progress()
+
+    def _load_progress(self):
+        try:
+            with open(os.path.join(self.job_dir, PROGRESS_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_progress(self):
+        # 先写临时文件再替换，中途出错时保留上一次的进度
+        path = os.path.join(self.job_dir, PROGRESS_FILE)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.progress, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, path)
+
+    def _clear(self):
+        for name in os.listdir(self.job_dir):
+            if name.startswith("file_") and name.endswith(".pkl") or name in (PROGRESS_FILE, ERROR_REPORT_FILE):
+                os.remove(os.path.join(self.job_dir, name))
+
+    def _payload_path(self, file_index):
+        return os.path.join(self.job_dir, f"file_{file_index + 1:04d}.pkl")
+
+    def completed_files(self, file_a_paths):
+        """已完成且文件未被修改的日报表序号集合"""
+        completed = set()
+        for file_index, path in enumerate(file_a_paths):
+            entry = self.progress["files"].get(str(file_index))
+            if (entry and entry["status"] == "done" and entry["signature"] == file_signature(path)
+                    and os.path.exists(self._payload_path(file_index))):
+                completed.add(file_index)
+        return completed
+
+    def load_file(self, file_index):
+        """读取一个已完成日报表保存的匹配结果"""
+        with open(self._payload_path(file_index), "rb") as f:
+            return pickle.load(f)
+
+    def save_file(self, file_index, path, payload, matches):
+        """保存一个日报表的匹配结果并标记为完成"""
+        payload_path = self._payload_path(file_index)
+        temp_path = payload_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, payload_path)
+        with self._lock:
+            previous = self.progress["files"].get(str(file_index))
+            self.progress["files"][str(file_index)] = {
+                "path": os.path.abspath(path),
+                "status": "done",
+                "signature": file_signature(path),
+                "matches": matches,
+                "finished_at": time.time(),
+            }
+            self._write_progress()
+            # 上次失败的文件这次处理成功，从错误报告中移除
+            if previous and previous["status"] == "failed":
+                self._write_error_report()
+
+    def record_error(self, file_index, path, stage, message):
+        """标记一个日报表处理失败，下次运行时重新处理"""
+        with self._lock:
+            self.progress["files"][str(file_index)] = {
+                "path": os.path.abspath(path),
+                "status": "failed",
+                "signature": file_signature(path),
+                "stage": stage,
+                "error": message,
+                "finished_at": time.time(),
+            }
+            self._write_progress()
+            self._write_error_report()
+
+    def finish(self, saved_path):
+        """记录保存的结果文件"""
+        with self._lock:
+            self.progress["saved_path"] = saved_path
+            self._write_progress()
+
+    def _write_error_report(self):
+        """将失败的日报表写入errors.txt，没有失败时删除该文件"""
+        failed = [entry for entry in self.progress["files"].values() if entry["status"] == "failed"]
+        report_path = os.path.join(self.job_dir, ERROR_REPORT_FILE)
+        if not failed:
+            if os.path.exists(report_path):
+                os.remove(report_path)
+            return
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write("文件\t阶段\t错误\n")
+            for entry in failed:
+                f.write(f"{entry['path']}\t{entry['stage']}\t{entry['error']}\n")
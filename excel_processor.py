@@ -8,6 +8,19 @@ import re
 import pandas as pd
 import numpy as np
 import tempfile
+import hashlib
+import operator
+import threading
+import zipfile
+from array import array
+from openpyxl.writer.excel import ExcelWriter
+
+from key_index import HashedKeyIndex
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:
+    lazy_pinyin = None
 
 def process_excel_file(file_a_path, file_b_path, output_path, col_x, col_y, sheet_a=None, sheet_b=None, output_sheet=None):
     """
@@ -23,341 +36,54 @@ def process_excel_file(file_a_path, file_b_path, output_path, col_x, col_y, shee
         sheet_b: b表中的工作表名称，默认为活动表
         output_sheet: 输出工作表名称，默认为"匹配结果"
     """
-    # 检查文件类型并转换
-    converted_files = []
-    
-    # 检查A表文件类型
-    _, file_a_ext = os.path.splitext(file_a_path)
-    if file_a_ext.lower() == '.xls':
-        print(f"检测到A表是.xls格式，将转换为.xlsx格式处理...")
-        temp_a_path = convert_xls_to_xlsx(file_a_path)
-        if temp_a_path:
-            converted_files.append(temp_a_path)
-            file_a_path = temp_a_path
-        else:
-            print("A表转换失败，将尝试直接处理...")
-    
-    # 检查B表文件类型
-    _, file_b_ext = os.path.splitext(file_b_path)
-    if file_b_ext.lower() == '.xls':
-        print(f"检测到B表是.xls格式，将转换为.xlsx格式处理...")
-        temp_b_path = convert_xls_to_xlsx(file_b_path)
-        if temp_b_path:
-            converted_files.append(temp_b_path)
-            file_b_path = temp_b_path
-        else:
-            print("B表转换失败，将尝试直接处理...")
-            
-    try:
-        # 转换列名为列号
-        if isinstance(col_x, str) and not col_x.isdigit():
-            col_x_index = openpyxl.utils.column_index_from_string(col_x)
-        else:
-            col_x_index = int(col_x)
-        
-        if isinstance(col_y, str) and not col_y.isdigit():
-            col_y_index = openpyxl.utils.column_index_from_string(col_y)
-        else:
-            col_y_index = int(col_y)
-        
-        # 加载工作簿
-        wb_a = openpyxl.load_workbook(file_a_path, data_only=True)  # data_only=True 使公式只返回结果值
-        wb_b = openpyxl.load_workbook(file_b_path)
-        
-        # 选择工作表
-        if sheet_a and sheet_a in wb_a.sheetnames:
-            ws_a = wb_a[sheet_a]
-        else:
-            ws_a = wb_a.active
-            
-        if sheet_b and sheet_b in wb_b.sheetnames:
-            ws_b = wb_b[sheet_b]
-        else:
-            ws_b = wb_b.active
-        
-        # 创建新的工作簿用于保存结果
-        wb_result = openpyxl.Workbook()
-        ws_result = wb_result.active
-        
-        # 设置输出工作表名称
-        if output_sheet:
-            ws_result.title = output_sheet
-        else:
-            ws_result.title = "匹配结果"
-        
-        # 获取B表中y列的所有值
-        b_values = set()
-        for row in ws_b.iter_rows(min_row=1, max_row=ws_b.max_row):
-            if len(row) >= col_y_index:
-                cell_value = row[col_y_index-1].value
-                if cell_value is not None:  # 只添加非空值
-                    b_values.add(str(cell_value))
-        
-        # 初始化合并单元格映射
-        merged_cells_map = {}
-        
-        # 收集所有A表中的合并单元格信息
-        merged_ranges = {}
-        for merged_range in ws_a.merged_cells.ranges:
-            min_col, min_row, max_col, max_row = merged_range.min_col, merged_range.min_row, merged_range.max_col, merged_range.max_row
-            
-            # 记录合并单元格范围
-            for row_idx in range(min_row, max_row + 1):
-                for col_idx in range(min_col, max_col + 1):
-                    merged_ranges[(row_idx, col_idx)] = (min_row, min_col, max_row, max_col)
-            
-            # 只关注X列的合并单元格 (用于匹配)
-            if min_col <= col_x_index <= max_col:
-                cell_value = ws_a.cell(row=min_row, column=min_col).value
-                
-                # 将所有在这个合并范围内的行映射到该值
-                for row_idx in range(min_row, max_row + 1):
-                    merged_cells_map[row_idx] = cell_value
-        
-        # 查找表头中包含"日期"的列
-        date_columns = set()
-        if ws_a.max_row > 0:
-            header_row = ws_a[2]
-            for col_idx, cell in enumerate(header_row, 1):
-                header_text = str(cell.value).lower() if cell.value else ""
-                if "日期" in header_text or "时间" in header_text or "date" in header_text.lower() or "time" in header_text.lower():
-                    date_columns.add(col_idx)
-        
-        # 找到匹配的行
-        matching_rows = []
-        matching_row_indices = []  # 存储原始行索引，用于后续复制合并单元格
-        
-        for row_idx in range(1, ws_a.max_row + 1):
-            # 检查这个行是否是合并单元格的一部分
-            if row_idx in merged_cells_map:
-                cell_value = merged_cells_map[row_idx]
-            else:
-                # 如果不是合并单元格，直接获取值
-                cell_value = ws_a.cell(row=row_idx, column=col_x_index).value
-            
-            # 跳过空值
-            if cell_value is None:
-                continue
-            
-            # 将值转换为字符串进行比较
-            cell_value_str = str(cell_value)
-            
-            # 检查是否在B表的值中
-            if cell_value_str in b_values:
-                # 添加整行到结果
-                row_data = []
-                cell_formats = []  # 存储单元格格式
-                cell_objects = []  # 存储原始单元格对象
-                
-                for cell in ws_a[row_idx]:
-                    # 这里直接使用cell.value，因为wb_a已用data_only=True打开，会自动计算函数结果
-                    row_data.append(cell.value)
-                    # 保存单元格的数字格式
-                    cell_formats.append(cell.number_format)
-                    # 保存原始单元格对象引用
-                    cell_objects.append(cell)
-                
-                matching_rows.append((row_data, cell_formats, cell_objects))
-                matching_row_indices.append(row_idx)
-        
-        # 如果找到了表头，也复制表头
-        if ws_a.max_row > 0 and len(matching_rows) > 0:
-            # 复制第一行作为表头
-            header_row = []
-            header_formats = []
-            header_objects = []
-            
-            for cell in ws_a[1]:
-                header_row.append(cell.value)
-                header_formats.append(cell.number_format)
-                header_objects.append(cell)
-            
-            # 将表头添加到结果第一行
-            for j, (value, cell_format, orig_cell) in enumerate(zip(header_row, header_formats, header_objects)):
-                result_cell = ws_result.cell(row=1, column=j+1, value=value)
-                copy_cell_format_and_style(orig_cell, result_cell, False)  # 表头不处理为日期格式
-        
-        # 复制匹配的数据到结果表
-        start_row = 2  # 从第二行开始写入数据（第一行是表头）
-        
-        # 用于记录需要在结果表中合并的单元格
-        cells_to_merge = {}
-        
-        # 复制数据
-        for i, ((row_data, cell_formats, orig_cells), original_row_idx) in enumerate(zip(matching_rows, matching_row_indices)):
-            target_row = start_row + i
-            
-            for j, (value, cell_format, orig_cell) in enumerate(zip(row_data, cell_formats, orig_cells)):
-                col_idx = j + 1
-                result_cell = ws_result.cell(row=target_row, column=col_idx)
-                
-                # 判断是否为日期列
-                is_date_column = col_idx in date_columns
-                
-                # 使用增强的复制函数，处理所有格式和样式
-                copy_cell_format_and_style(orig_cell, result_cell, is_date_column)
-                
-                # 检查该单元格在A表中是否是合并单元格的一部分
-                original_cell_key = (original_row_idx, col_idx)
-                if original_cell_key in merged_ranges:
-                    # 获取原始合并范围
-                    o_min_row, o_min_col, o_max_row, o_max_col = merged_ranges[original_cell_key]
-                    
-                    # 创建原始行到结果表行的映射
-                    orig_to_result_row_map = {}
-                    
-                    # 记录当前行映射到结果表的位置
-                    orig_to_result_row_map[original_row_idx] = target_row
-                    
-                    # 计算新的合并范围
-                    # 对于表头之前的行不进行合并操作
-                    if o_min_row > 1:  # 跳过第一行（表头）
-                        # 检查是否所有需要合并的行都找到了匹配
-                        merge_rows_matched = True
-                        
-                        # 查找原始表中所有需要合并的行是否都在匹配行中
-                        rows_to_merge = set(range(o_min_row, o_max_row + 1))
-                        matched_merge_rows = set(matching_row_indices) & rows_to_merge
-                        
-                        if len(matched_merge_rows) == len(rows_to_merge):
-                            # 所有合并行都匹配上了，计算结果表中的合并范围
-                            
-                            # 找出合并范围内每一行在结果表中的位置
-                            for row_index, matching_idx in enumerate(matching_row_indices):
-                                if o_min_row <= matching_idx <= o_max_row:
-                                    orig_to_result_row_map[matching_idx] = start_row + row_index
-                            
-                            # 获取合并范围内最小和最大行在结果表中的位置
-                            result_rows = [orig_to_result_row_map[matching_idx] for matching_idx in matched_merge_rows]
-                            new_min_row = min(result_rows)
-                            new_max_row = max(result_rows)
-                            
-                            # 存储合并信息，使用列索引相同但行索引映射后的值
-                            merge_key = (o_min_row, o_min_col, o_max_row, o_max_col)
-                            if merge_key not in cells_to_merge:
-                                cells_to_merge[merge_key] = (new_min_row, o_min_col, new_max_row, o_max_col)
-                                print(f"将合并单元格: 原始范围=({o_min_row},{o_min_col})-({o_max_row},{o_max_col}) -> 结果表范围=({new_min_row},{o_min_col})-({new_max_row},{o_max_col})")
-                        else:
-                            # 不是所有合并行都匹配上了，跳过此合并
-                            print(f"跳过合并单元格: 原始范围=({o_min_row},{o_min_col})-({o_max_row},{o_max_col})，因为不是所有行都匹配")
-        
-        # 在结果表中合并单元格
-        for _, (min_row, min_col, max_row, max_col) in cells_to_merge.items():
-            # 只有当范围至少包含2个单元格时才合并
-            if min_row != max_row or min_col != max_col:
-                # 获取合并单元格的范围字符串
-                start_cell = f"{get_column_letter(min_col)}{min_row}"
-                end_cell = f"{get_column_letter(max_col)}{max_row}"
-                merge_range = f"{start_cell}:{end_cell}"
-                
-                try:
-                    # 执行合并
-                    ws_result.merge_cells(merge_range)
-                    
-                    # 设置合并后单元格的对齐方式为居中
-                    merged_cell = ws_result.cell(row=min_row, column=min_col)
-                    merged_cell.alignment = Alignment(horizontal='center', vertical='center')
-                except Exception as e:
-                    print(f"合并单元格 {merge_range} 时出错: {str(e)}")
-        
-        # 修复可能出现的文件名问题
-        if ".." in output_path:
-            output_path = output_path.replace("..", ".")
-        
-        # 为结果表中的所有已使用单元格添加边框
-        for row in ws_result.iter_rows(min_row=1, max_row=ws_result.max_row):
-            for cell in row:
-                set_cell_borders(cell)
-        
-        # 添加时间戳到文件名
-        file_name, file_ext = os.path.splitext(output_path)
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        safe_output_path = f"{file_name}_{timestamp}{file_ext}"
-        
-        try:
-            # 保存结果
-            wb_result.save(safe_output_path)
-            result = (len(matching_rows), safe_output_path)
-        except Exception as e:
-            print(f"保存文件时出错: {str(e)}")
-            # 尝试保存到桌面
-            desktop = os.path.join(os.path.expanduser("~"), "Desktop")
-            desktop_path = os.path.join(desktop, os.path.basename(safe_output_path))
-            try:
-                wb_result.save(desktop_path)
-                result = (len(matching_rows), desktop_path)
-            except:
-                result = (0, None)
-    finally:
-        # 清理转换过程中创建的临时文件
-        for temp_file in converted_files:
-            try:
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-                    print(f"已删除临时文件: {temp_file}")
-            except Exception as e:
-                print(f"删除临时文件失败: {temp_file}, 错误: {str(e)}")
-    
-    return result
+    return process_excel_files([file_a_path], file_b_path, output_path, col_x, col_y, sheet_a, sheet_b, output_sheet)
 
 def copy_cell_format_and_style(source_cell, target_cell, is_date_column=False):
-    """复制单元格的格式和样式"""
-    # 复制值
-    value = source_cell.value
-    
-    # 如果该列被标记为日期列，尝试将值转换为日期格式
+    """复制单元格的格式和样式，is_date_column见write_cell_value_and_style"""
+    write_cell_value_and_style(target_cell, source_cell.value, source_cell.number_format,
+                               copy_alignment(source_cell.alignment), is_date_column)
+
+def copy_alignment(alignment):
+    """创建对齐方式的独立副本，避免使用原始StyleProxy对象；没有对齐方式时返回None"""
+    if not alignment:
+        return None
+    try:
+        return Alignment(
+            horizontal=alignment.horizontal,
+            vertical=alignment.vertical,
+            textRotation=getattr(alignment, 'textRotation', 0),
+            wrapText=getattr(alignment, 'wrapText', False),
+            shrinkToFit=getattr(alignment, 'shrinkToFit', False),
+            indent=getattr(alignment, 'indent', 0)
+        )
+    except:
+        # 如果无法获取对齐属性，忽略错误
+        return None
+
+def write_cell_value_and_style(target_cell, value, cell_format, alignment=None, is_date_column=False):
+    """
+    将值、数字格式和对齐方式写入目标单元格
+
+    参数:
+        target_cell: 目标单元格
+        value: 单元格的值
+        cell_format: 数字格式字符串
+        alignment: Alignment对象，None表示不设置
+        is_date_column: 是否按日期列处理，也可以传入该列的DateColumnConverter
+    """
+    # 如果该列被标记为日期列，尝试将值（日期对象、Excel日期序号或日期文本）转换为日期格式
     if is_date_column:
-        if isinstance(value, (int, float)) and value > 40000:
-            try:
-                # Excel中的日期是从1900-01-01开始的天数（有些特殊情况）
-                date_value = datetime.datetime(1899, 12, 30) + datetime.timedelta(days=value)
-                value = date_value
-                # 设置中文日期格式
-                target_cell.value = value
-                target_cell.number_format = 'm"月"d"日"'
-                return
-            except:
-                # 如果转换失败，按普通值处理
-                pass
-        # 额外检查：如果值是已经格式化的日期对象
-        elif isinstance(value, datetime.datetime):
-            # 直接应用中文日期格式
-            target_cell.value = value
+        converter = is_date_column if isinstance(is_date_column, DateColumnConverter) else DEFAULT_DATE_CONVERTER
+        date_value = converter.convert(value)
+        if date_value is not None:
+            # 设置中文日期格式
+            target_cell.value = date_value
             target_cell.number_format = 'm"月"d"日"'
             return
-        # 处理字符串形式的日期
-        elif isinstance(value, str):
-            try:
-                # 尝试匹配多种日期格式
-                date_patterns = [
-                    r"(\d{4})[/-](\d{1,2})[/-](\d{1,2})",  # YYYY/MM/DD 或 YYYY-MM-DD
-                    r"(\d{1,2})[/-](\d{1,2})[/-](\d{4})",  # DD/MM/YYYY 或 DD-MM-YYYY
-                    r"(\d{1,2})月(\d{1,2})日"               # MM月DD日
-                ]
-                
-                for pattern in date_patterns:
-                    match = re.search(pattern, value)
-                    if match:
-                        if pattern == date_patterns[0]:  # YYYY/MM/DD
-                            year, month, day = int(match.group(1)), int(match.group(2)), int(match.group(3))
-                        elif pattern == date_patterns[1]:  # DD/MM/YYYY
-                            day, month, year = int(match.group(1)), int(match.group(2)), int(match.group(3))
-                        elif pattern == date_patterns[2]:  # MM月DD日
-                            month, day = int(match.group(1)), int(match.group(2))
-                            year = datetime.datetime.now().year  # 使用当前年份
-                        
-                        date_obj = datetime.datetime(year, month, day)
-                        target_cell.value = date_obj
-                        target_cell.number_format = 'm"月"d"日"'
-                        return
-            except:
-                # 如果解析失败，保持原始值
-                pass
     
     # 非日期列或转换失败，使用原始处理方式
     
     # 检查是否有日期格式标记
-    cell_format = source_cell.number_format
     is_date_format = ("y" in cell_format.lower() or "m" in cell_format.lower() or "d" in cell_format.lower())
     
     # 如果单元格有日期格式但不在日期列中，尝试保留其原始格式
@@ -371,73 +97,621 @@ def copy_cell_format_and_style(source_cell, target_cell, is_date_column=False):
         target_cell.number_format = cell_format
         
     # 复制对齐方式（如果有）
-    if source_cell.alignment:
+    if alignment is not None:
+        target_cell.alignment = alignment
+
+def column_to_index(col):
+    """将列名（如"C"）或列号（如3、"3"）转换为从1开始的列号"""
+    if isinstance(col, str) and not col.isdigit():
+        return openpyxl.utils.column_index_from_string(col)
+    return int(col)
+
+# 列名为1到3个英文字母（A到XFD）；"ID"、"Age"等表头名称也符合该格式，因此先按表头查找，找不到时才按列名处理
+COLUMN_LETTERS_PATTERN = re.compile(r"^[A-Za-z]{1,3}$")
+
+# 按表头指纹缓存的表头名称 -> 列号映射，同一模板的文件只建立一次
+HEADER_MAP_CACHE_SIZE = 256
+_header_maps = {}
+_header_maps_lock = threading.Lock()
+
+def is_column_number(col):
+    """判断是列号（如3、"3"），列号不需要表头就能确定；列名和表头名称要先在表头中查找"""
+    if isinstance(col, int):
+        return True
+    return str(col).strip().isdigit()
+
+def header_map(header_values):
+    """
+    表头名称 -> 列号（从1开始）的映射，按表头行的指纹缓存
+
+    名称去掉首尾空白后比较，同名的列取第一列。
+    """
+    fingerprint = row_fingerprint(header_values)
+    with _header_maps_lock:
+        mapping = _header_maps.get(fingerprint)
+    if mapping is not None:
+        return mapping
+
+    mapping = {}
+    for col_idx, value in enumerate(header_values, 1):
+        if value is not None:
+            mapping.setdefault(str(value).strip(), col_idx)
+    with _header_maps_lock:
+        if len(_header_maps) >= HEADER_MAP_CACHE_SIZE:
+            _header_maps.clear()
+        _header_maps[fingerprint] = mapping
+    return mapping
+
+def resolve_column(col, header_values=None):
+    """
+    将列名、列号或表头名称（如"患者姓名"）转换为从1开始的列号
+
+    列号直接使用；其余的先在表头中查找，表头中没有该名称且是1到3个英文字母时按列名处理，
+    因此表头为"ID"、"SEX"等的列按表头确定，而不会被当作ID列、SEX列。
+
+    参数:
+        col: 列名、列号或表头名称
+        header_values: 表头行的值，col为表头名称时必须提供
+
+    返回:
+        列号；既不是表头名称也不是列名时抛出ValueError
+    """
+    col_text = str(col).strip()
+    if is_column_number(col):
+        return int(col_text)
+    col_idx = header_map(header_values or ()).get(col_text)
+    if col_idx is not None:
+        return col_idx
+    if COLUMN_LETTERS_PATTERN.match(col_text):
+        return column_to_index(col_text)
+    raise ValueError(f"表头中找不到列: {col}")
+
+def resolve_columns(columns, header_values=None):
+    """将多个列转换为列号列表，见resolve_column"""
+    return [resolve_column(col, header_values) for col in columns]
+
+def row_fingerprint(values, column_indices=None):
+    """
+    计算一行取值的64位指纹，用于在集合中紧凑地记录已出现的行
+    
+    参数:
+        values: 行中各单元格的值
+        column_indices: 参与计算的列下标（从0开始），默认使用整行
+    """
+    if column_indices is not None:
+        values = [values[i] if i < len(values) else None for i in column_indices]
+    digest = hashlib.blake2b(repr(tuple(values)).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+class StyleTable:
+    """
+    单元格样式驻留表
+
+    相同的(数字格式, 对齐方式)组合只保存一份，匹配行中只记录样式编号；
+    写入结果表时同一编号复用同一个Alignment对象。
+    """
+
+    def __init__(self):
+        self.styles = []  # 样式编号 -> (数字格式, Alignment或None)
+        self._ids = {}
+
+    def intern(self, cell):
+        """返回单元格样式的编号，首次出现时登记"""
+        return self.intern_style(cell.number_format, cell.alignment)
+
+    def intern_style(self, cell_format, alignment):
+        """返回(数字格式, 对齐方式)组合的编号，首次出现时登记"""
+        if alignment:
+            key = (cell_format, alignment.horizontal, alignment.vertical, alignment.textRotation,
+                   alignment.wrapText, alignment.shrinkToFit, alignment.indent)
+        else:
+            key = (cell_format,)
+        style_id = self._ids.get(key)
+        if style_id is None:
+            style_id = len(self.styles)
+            self.styles.append((cell_format, copy_alignment(alignment)))
+            self._ids[key] = style_id
+        return style_id
+
+    def __len__(self):
+        return len(self.styles)
+
+class MatchedRow:
+    """
+    一条匹配行的紧凑记录
+
+    只保存原始行号、各单元格的值和样式编号，不引用A表的单元格对象，
+    A表工作簿在扫描完成后即可释放。
+    """
+
+    __slots__ = ("row_idx", "values", "style_ids", "match_info")
+
+    def __init__(self, row_idx, values, style_ids, match_info=None):
+        """
+        参数:
+            row_idx: 在A表中的原始行号
+            values: 各单元格值的元组
+            style_ids: 各单元格样式编号的array('I')
+            match_info: 模糊匹配时为(匹配到的B表值, 得分)
+        """
+        self.row_idx = row_idx
+        self.values = values
+        self.style_ids = style_ids
+        self.match_info = match_info
+
+    @classmethod
+    def from_cells(cls, row_idx, cells, style_table, match_info=None):
+        """根据A表的一行单元格创建记录"""
+        cells = tuple(cells)
+        return cls(
+            row_idx,
+            tuple(cell.value for cell in cells),
+            array("I", [style_table.intern(cell) for cell in cells]),
+            match_info
+        )
+
+def write_record_to_sheet(record, style_table, target_ws, target_row, date_columns=None):
+    """
+    将MatchedRow记录写入目标工作表的指定行
+
+    参数:
+        record: MatchedRow对象
+        style_table: 记录所用的StyleTable
+        target_ws: 目标工作表
+        target_row: 目标行号
+        date_columns: 需要按日期处理的列，列号 -> DateColumnConverter（也可以是列号集合）
+    """
+    styles = style_table.styles
+    for col_idx, (value, style_id) in enumerate(zip(record.values, record.style_ids), 1):
+        cell_format, alignment = styles[style_id]
+        is_date_column = date_converter_for(date_columns, col_idx) or False
+        write_cell_value_and_style(target_ws.cell(row=target_row, column=col_idx),
+                                   value, cell_format, alignment, is_date_column)
+
+def select_file_matches(file_state, positions):
+    """从单个文件的匹配结果中只保留positions指定位置的行"""
+    file_index, header_record, records, merged_ranges, date_columns = file_state
+    return (file_index, header_record, [records[pos] for pos in positions], merged_ranges, date_columns)
+
+def copy_row_to_sheet(source_row, target_ws, target_row, date_columns=None):
+    """
+    将一整行单元格（值、格式和样式）复制到目标工作表的指定行
+    
+    参数:
+        source_row: 源单元格序列，例如ws[row_idx]
+        target_ws: 目标工作表
+        target_row: 目标行号
+        date_columns: 需要按日期处理的列，列号 -> DateColumnConverter（也可以是列号集合）
+    """
+    for col_idx, source_cell in enumerate(source_row, 1):
+        target_cell = target_ws.cell(row=target_row, column=col_idx)
+        is_date_column = date_converter_for(date_columns, col_idx) or False
+        copy_cell_format_and_style(source_cell, target_cell, is_date_column)
+
+def edit_distance(a, b, max_distance=None):
+    """
+    计算两个字符串（或序列）之间的编辑距离
+
+    参数:
+        a, b: 要比较的字符串或序列
+        max_distance: 距离上限，超过上限时提前返回max_distance+1
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if max_distance is not None and len(a) - len(b) > max_distance:
+        return max_distance + 1
+
+    previous = list(range(len(b) + 1))
+    for i, ch_a in enumerate(a, 1):
+        current = [i]
+        for j, ch_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,                      # 删除
+                current[j - 1] + 1,                   # 插入
+                previous[j - 1] + (ch_a != ch_b)      # 替换
+            ))
+        # 整行都已超过上限，不可能再变小
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+# 文本日期的格式。数字两侧不能再有数字、"年"前面不能是月日格式，一个文本最多与其中一种格式匹配，
+# 因此各列可以按样本调整尝试的顺序而不改变结果
+DATE_PATTERNS = [
+    (re.compile(r"(?<!\d)(\d{4})年(\d{1,2})月(\d{1,2})日"), ("year", "month", "day")),          # YYYY年MM月DD日
+    (re.compile(r"(?<!\d)(\d{4})[/-](\d{1,2})[/-](\d{1,2})(?!\d)"), ("year", "month", "day")),  # YYYY/MM/DD 或 YYYY-MM-DD
+    (re.compile(r"(?<!\d)(\d{1,2})[/-](\d{1,2})[/-](\d{4})(?!\d)"), ("day", "month", "year")),  # DD/MM/YYYY 或 DD-MM-YYYY
+    (re.compile(r"(?<![\d年])(\d{1,2})月(\d{1,2})日"), ("month", "day")),                         # MM月DD日，使用当前年份
+]
+
+# 大于该值的数字按Excel日期序号处理
+EXCEL_SERIAL_DATE_MIN = 40000
+EXCEL_EPOCH = datetime.datetime(1899, 12, 30)
+
+# 表头中包含这些文字的列按日期列处理
+DATE_HEADER_KEYWORDS = ("日期", "时间", "date", "time")
+
+# 推断日期列格式时读取的样本行数
+DATE_SAMPLE_ROWS = 50
+
+# 每个日期列缓存的转换结果数量上限（日报表中同一个日期通常重复很多次）
+DATE_CACHE_SIZE = 4096
+
+class DateColumnConverter:
+    """
+    一个日期列的值转换器
+
+    建立时根据该列的样本统计各文本格式出现的次数，转换时按出现次数从多到少尝试预编译的格式；
+    没有年份的格式使用指定的年份，未指定时使用转换时的当前年份（长时间运行的服务跨年后不会沿用上一年）。
+    转换结果按值缓存，相同的日期文本或序号只解析一次。
+    """
+
+    def __init__(self, sample=(), year=None):
+        """
+        参数:
+            sample: 该列的样本值
+            year: 没有年份的日期使用的年份，默认为转换时的当前年份
+        """
+        self.year = year
+        # 未指定年份时缓存中的结果对应的年份，年份变化后清空缓存
+        self._cache_year = None
+        counts = [0] * len(DATE_PATTERNS)
+        for value in sample:
+            if isinstance(value, str):
+                for pattern_index, (pattern, _) in enumerate(DATE_PATTERNS):
+                    if pattern.search(value):
+                        counts[pattern_index] += 1
+                        break
+        order = sorted(range(len(DATE_PATTERNS)), key=lambda pattern_index: -counts[pattern_index])
+        self.patterns = [DATE_PATTERNS[pattern_index] for pattern_index in order]
+        self._cache = {}
+
+    def convert(self, value):
+        """
+        将单元格的值转换为datetime：datetime/date对象、Excel日期序号或文本日期
+
+        返回:
+            datetime对象，无法识别时返回None
+        """
+        if isinstance(value, datetime.datetime):
+            return value
+        if isinstance(value, bool) or not isinstance(value, (str, int, float, datetime.date)):
+            return None
+        if self.year is None:
+            current_year = datetime.date.today().year
+            if current_year != self._cache_year:
+                self._cache.clear()
+                self._cache_year = current_year
         try:
-            # 创建新的对齐方式对象，避免使用原始StyleProxy对象
-            target_cell.alignment = Alignment(
-                horizontal=source_cell.alignment.horizontal,
-                vertical=source_cell.alignment.vertical,
-                textRotation=getattr(source_cell.alignment, 'textRotation', 0),
-                wrapText=getattr(source_cell.alignment, 'wrapText', False),
-                shrinkToFit=getattr(source_cell.alignment, 'shrinkToFit', False),
-                indent=getattr(source_cell.alignment, 'indent', 0)
-            )
-        except:
-            # 如果无法获取对齐属性，忽略错误
+            return self._cache[value]
+        except KeyError:
             pass
+        result = self._convert(value)
+        if len(self._cache) < DATE_CACHE_SIZE:
+            self._cache[value] = result
+        return result
+
+    def _convert(self, value):
+        if isinstance(value, datetime.date):
+            return datetime.datetime(value.year, value.month, value.day)
+        if isinstance(value, (int, float)):
+            if value > EXCEL_SERIAL_DATE_MIN:
+                try:
+                    return EXCEL_EPOCH + datetime.timedelta(days=value)
+                except OverflowError:
+                    return None
+            return None
+        for pattern, fields in self.patterns:
+            match = pattern.search(value)
+            if match:
+                parts = dict(zip(fields, map(int, match.groups())))
+                try:
+                    year = parts.get("year", self.year or self._cache_year)
+                    return datetime.datetime(year, parts["month"], parts["day"])
+                except ValueError:
+                    return None
+        return None
+
+# 没有样本时使用的转换器（筛选条件、未指定转换器的日期列）
+DEFAULT_DATE_CONVERTER = DateColumnConverter()
 
-def process_excel_files(file_a_paths, file_b_path, output_path, col_x, col_y, sheet_a=None, sheet_b=None, output_sheet=None, sheet_a_map=None):
+def parse_date_value(value):
     """
-    处理多个A表文件，查找它们中与B表有重合的行并输出到新文件
+    将单元格的值转换为datetime：datetime/date对象、Excel日期序号或DATE_PATTERNS中的文本日期
+
+    返回:
+        datetime对象，无法识别时返回None
+    """
+    return DEFAULT_DATE_CONVERTER.convert(value)
+
+def is_title_row(values):
+    """第一行只有一个非空单元格（标题）或为空时视为标题行，表头在第二行"""
+    return sum(value is not None for value in values) < 2
+
+def find_header_row(ws, max_column=None):
+    """
+    确定表头所在的行：表头一般在第一行，第一行为标题行时在第二行（与find_date_columns的规则相同）
+
+    参数:
+        ws: 工作表
+        max_column: 读取的最大列号，默认为工作表的最大列
+
+    返回:
+        (表头行号, 表头行的值)
+    """
+    # 不超过工作表的最大行，否则openpyxl会创建空单元格并增大ws.max_row
+    rows = list(ws.iter_rows(min_row=1, max_row=min(2, ws.max_row), max_col=max_column, values_only=True))
+    if len(rows) == 2 and is_title_row(rows[0]):
+        return 2, rows[1]
+    return 1, rows[0] if rows else ()
+
+def find_date_columns(ws, max_column=None):
+    """
+    查找表头中包含日期关键字的列，并按各列的样本建立DateColumnConverter
+
+    表头一般在第一行；第一行只有一个非空单元格（标题行）或没有日期列时检查第二行。
+
+    参数:
+        ws: 工作表
+        max_column: 读取的最大列号，默认为工作表的最大列
+
+    返回:
+        列号 -> DateColumnConverter
+    """
+    for header_row in (1, 2):
+        if ws.max_row <= header_row:
+            return {}
+        header = next(ws.iter_rows(min_row=header_row, max_row=header_row, max_col=max_column, values_only=True), ())
+        if header_row == 1 and is_title_row(header):
+            continue
+        columns = [
+            col_idx for col_idx, value in enumerate(header, 1)
+            if value and any(keyword in str(value).lower() for keyword in DATE_HEADER_KEYWORDS)
+        ]
+        if columns:
+            break
+    else:
+        return {}
+
+    min_col, max_col = min(columns), max(columns)
+    samples = {col_idx: [] for col_idx in columns}
+    # 不超过工作表的最大行，否则openpyxl会创建空单元格并增大ws.max_row
+    sample_last_row = min(header_row + DATE_SAMPLE_ROWS, ws.max_row)
+    for row in ws.iter_rows(min_row=header_row + 1, max_row=sample_last_row,
+                            min_col=min_col, max_col=max_col, values_only=True):
+        for col_idx in columns:
+            samples[col_idx].append(row[col_idx - min_col])
+    return {col_idx: DateColumnConverter(sample) for col_idx, sample in samples.items()}
+
+def date_converter_for(date_columns, col_idx):
+    """
+    日期列中某列的转换器
+
+    参数:
+        date_columns: 列号 -> DateColumnConverter，也可以是列号集合（使用默认转换器）
+
+    返回:
+        DateColumnConverter，不是日期列时返回None
+    """
+    if not date_columns or col_idx not in date_columns:
+        return None
+    if isinstance(date_columns, dict):
+        return date_columns[col_idx]
+    return DEFAULT_DATE_CONVERTER
+
+def parse_number_value(value):
+    """将单元格的值转换为数值，文本去掉千分位逗号后转换，无法转换时返回None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value.strip().replace(",", ""))
+        except ValueError:
+            return None
+    return None
+
+ROW_FILTER_COMPARISONS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+class RowFilter:
+    """
+    匹配行的筛选条件，只根据一个单元格的值判断，在复制整行和样式之前执行
+
+    条件写作(列, 运算, 值)，列可以是列名、列号或表头名称:
+        ("金额", ">", 0)                                  数值比较，运算还可以是"=="、"!="、">="、"<"、"<="
+        ("日期", ">=", "2025-05-01")                      与日期比较（值为日期或日期文本时）
+        ("日期", "between", ("2025-05-01", "2025-05-31"))  日期范围，包含两端，None表示不限
+        ("医生", "==", "刘")                              文本相等（值不是数字或日期时）
+        ("备注", "regex", "复诊|初诊")                     正则查找文本（re.search）
+    单元格的值无法转换为数值或日期时不满足比较条件；空单元格按空文本参与正则查找。
+    """
+
+    def __init__(self, column, op, value):
+        if op not in ROW_FILTER_COMPARISONS and op not in ("between", "regex"):
+            raise ValueError(f"不支持的筛选运算: {op}")
+        self.column = column
+        self.op = op
+        self.value = value
+
+        # 条件值只在这里解析一次，判断每行时直接比较
+        if op == "regex":
+            self.kind = "regex"
+            self.pattern = re.compile(value)
+        elif op == "between":
+            start, end = value
+            self.kind = "between"
+            self.bounds = (self._parse_date(start), self._parse_date(end))
+        else:
+            self.compare = ROW_FILTER_COMPARISONS[op]
+            if isinstance(value, (datetime.date, datetime.datetime)):
+                self.kind, self.target = "date", parse_date_value(value).date()
+            elif parse_number_value(value) is not None:
+                self.kind, self.target = "number", parse_number_value(value)
+            elif op not in ("==", "!="):
+                self.kind, self.target = "date", self._parse_date(value)
+            elif parse_date_value(value) is not None:
+                # 日期文本按日期相等比较，单元格中的日期对象、序号和各种格式的日期文本都能匹配
+                self.kind, self.target = "date", parse_date_value(value).date()
+            else:
+                self.kind, self.target = "text", str(value).strip()
+
+    @staticmethod
+    def _parse_date(value):
+        if value is None:
+            return None
+        parsed = parse_date_value(value)
+        if parsed is None:
+            raise ValueError(f"无法识别的日期: {value}")
+        return parsed.date()
+
+    @classmethod
+    def from_spec(cls, spec):
+        """由(列, 运算, 值)创建，已经是RowFilter时原样返回"""
+        if isinstance(spec, RowFilter):
+            return spec
+        return cls(*spec)
+
+    def spec(self):
+        return (self.column, self.op, self.value)
+
+    def test(self, value):
+        """单元格的值是否满足条件"""
+        if self.kind == "regex":
+            return self.pattern.search("" if value is None else str(value)) is not None
+        if self.kind == "text":
+            return self.compare("" if value is None else str(value).strip(), self.target)
+        if self.kind == "number":
+            number = parse_number_value(value)
+            return number is not None and self.compare(number, self.target)
+
+        parsed = parse_date_value(value)
+        if parsed is None:
+            return False
+        date_value = parsed.date()
+        if self.kind == "date":
+            return self.compare(date_value, self.target)
+        start, end = self.bounds
+        return (start is None or date_value >= start) and (end is None or date_value <= end)
+
+class FuzzyKeyIndex:
+    """
+    B表键值的模糊匹配索引
+
+    对B表的所有键值只建立一次n-gram倒排索引（安装了pypinyin时同时建立拼音索引），
+    查询时先通过共有n-gram数量筛选候选，再对少量候选计算编辑距离，
+    避免将每个A表值与所有B表值逐一比较。
+    """
+
+    def __init__(self, keys, max_distance=1, ngram=2, use_pinyin=True):
+        """
+        参数:
+            keys: B表中的键值集合
+            max_distance: 允许的最大编辑距离
+            ngram: n-gram长度
+            use_pinyin: 是否启用拼音索引（需要pypinyin库）
+        """
+        self.keys = [str(key) for key in keys]
+        self.max_distance = max_distance
+        self.ngram = ngram
+        self.gram_index = {}
+        self.pinyin_index = {}
+        self.use_pinyin = use_pinyin and lazy_pinyin is not None
+        self._cache = {}
+
+        for key_id, key in enumerate(self.keys):
+            for gram in self._grams(key):
+                self.gram_index.setdefault(gram, []).append(key_id)
+            if self.use_pinyin:
+                self.pinyin_index.setdefault(self._pinyin(key), []).append(key_id)
+
+    def _grams(self, text):
+        """生成带首尾标记的n-gram集合"""
+        padded = f"^{text}$"
+        return {padded[i:i + self.ngram] for i in range(len(padded) - self.ngram + 1)}
+
+    def _pinyin(self, text):
+        """将文本转换为拼音字符串，用于识别同音字录入错误"""
+        return " ".join(lazy_pinyin(text))
+
+    def lookup(self, value):
+        """
+        查找与value最相近的B表键值
+
+        返回:
+            (匹配到的键值, 相似度得分) 或 None，得分为1 - 编辑距离/较长字符串长度
+        """
+        value = str(value)
+        if value in self._cache:
+            return self._cache[value]
+
+        value_grams = self._grams(value)
+        # 每次编辑最多破坏ngram个n-gram，据此得到候选需要的最少共有n-gram数
+        min_common = max(1, len(value_grams) - self.ngram * self.max_distance)
+
+        common_counts = {}
+        for gram in value_grams:
+            for key_id in self.gram_index.get(gram, ()):
+                common_counts[key_id] = common_counts.get(key_id, 0) + 1
+        candidates = {key_id for key_id, count in common_counts.items() if count >= min_common}
+
+        homophones = set()
+        if self.use_pinyin:
+            homophones = set(self.pinyin_index.get(self._pinyin(value), ()))
+            candidates |= homophones
+
+        best = None
+        for key_id in candidates:
+            key = self.keys[key_id]
+            # 同音字不受距离上限限制，计算完整的编辑距离，得分才能反映实际差异
+            if key_id in homophones:
+                distance = edit_distance(value, key)
+            else:
+                distance = edit_distance(value, key, self.max_distance)
+                if distance > self.max_distance:
+                    continue
+            longest = max(len(value), len(key)) or 1
+            score = round(max(0.0, 1 - distance / longest), 3)
+            if best is None or score > best[1]:
+                best = (key, score)
+
+        self._cache[value] = best
+        return best
+
+def load_b_values(file_b_path, sheet_b=None, col_y="A", read_only=False):
+    """
+    读取B表比较列中的所有非空值
     
     参数:
-        file_a_paths: a表文件路径列表
         file_b_path: b表文件路径
-        output_path: 输出文件路径
-        col_x: a表中的列名或列号
-        col_y: b表中的列名或列号
-        sheet_a: 所有a表默认的工作表名称，默认为活动表
         sheet_b: b表中的工作表名称，默认为活动表
-        output_sheet: 输出工作表名称，默认为"匹配结果"
-        sheet_a_map: 文件路径到工作表名称的映射，用于单独设置每个文件的工作表名
+        col_y: b表中的列名或列号
+        read_only: 以只读模式流式读取，不在内存中建立所有单元格和样式，适合很大的患者库
+        
+    返回:
+        以值为键的有序字典，可直接用于成员判断，并保留B表中的原始顺序
     """
-    # 处理单文件情况
-    if not isinstance(file_a_paths, list):
-        return process_excel_file(file_a_paths, file_b_path, output_path, col_x, col_y, sheet_a, sheet_b, output_sheet)
-    
-    # 如果没有工作表映射，创建一个空字典
-    if sheet_a_map is None:
-        sheet_a_map = {}
-    
-    # 检查并转换B表格式
-    converted_files = []
+    converted_file = None
     _, file_b_ext = os.path.splitext(file_b_path)
     if file_b_ext.lower() == '.xls':
         print(f"检测到B表是.xls格式，将转换为.xlsx格式处理...")
-        temp_b_path = convert_xls_to_xlsx(file_b_path)
-        if temp_b_path:
-            converted_files.append(temp_b_path)
-            file_b_path = temp_b_path
+        converted_file = convert_xls_to_xlsx(file_b_path)
+        if converted_file:
+            file_b_path = converted_file
         else:
             print("B表转换失败，将尝试直接处理...")
     
-    total_matches = 0
-    all_results = []
-    last_saved_path = None
-    
     try:
-        # 创建新的工作簿用于保存所有结果
-        wb_result = openpyxl.Workbook()
-        ws_result = wb_result.active
-        
-        # 设置输出工作表名称
-        if output_sheet:
-            ws_result.title = output_sheet
-        else:
-            ws_result.title = "匹配结果"
-        
-        # 加载B表数据（只需要加载一次）
-        wb_b = openpyxl.load_workbook(file_b_path)
+        # data_only=True 使公式只返回结果值，与A表和患者库数据库的读取方式一致
+        wb_b = openpyxl.load_workbook(file_b_path, read_only=read_only, data_only=True)
         
         # 选择B表工作表
         if sheet_b and sheet_b in wb_b.sheetnames:
@@ -445,328 +719,420 @@ def process_excel_files(file_a_paths, file_b_path, output_path, col_x, col_y, sh
         else:
             ws_b = wb_b.active
         
-        # 获取B表中y列的所有值
-        b_values = set()
-        # 转换B表列名为列号
-        if isinstance(col_y, str) and not col_y.isdigit():
-            col_y_index = openpyxl.utils.column_index_from_string(col_y)
-        else:
-            col_y_index = int(col_y)
+        col_y_index = None
         
-        for row in ws_b.iter_rows(min_row=1, max_row=ws_b.max_row):
+        b_values = {}
+        # 只读模式下工作表的max_row取自<dimension>，可能缺失，直接读到最后一行
+        for row in ws_b.iter_rows(min_row=1, max_row=None if read_only else ws_b.max_row):
+            if col_y_index is None:
+                # 比较列可以是表头名称，按第一行确定列号
+                col_y_index = resolve_column(col_y, [cell.value for cell in row])
             if len(row) >= col_y_index:
                 cell_value = row[col_y_index-1].value
                 if cell_value is not None:  # 只添加非空值
-                    b_values.add(str(cell_value))
-        
-        header_added = False
-        start_row = 1
-        
-        # 用于收集所有文件的合并单元格信息
-        all_cells_to_merge = {}
-        # 创建一个全局行映射，记录原始文件中的行号与结果表中行号的对应关系
-        global_row_mapping = {}
-        
-        # 处理每个A表文件
-        for file_index, file_a_path in enumerate(file_a_paths):
-            # 检查A表文件格式并转换
-            _, file_a_ext = os.path.splitext(file_a_path)
-            original_file_a_path = file_a_path
-            
-            if file_a_ext.lower() == '.xls':
-                print(f"检测到A表[{file_index+1}]是.xls格式，将转换为.xlsx格式处理...")
-                temp_a_path = convert_xls_to_xlsx(file_a_path)
-                if temp_a_path:
-                    converted_files.append(temp_a_path)
-                    file_a_path = temp_a_path
-                else:
-                    print(f"A表[{file_index+1}]转换失败，将尝试直接处理...")
-            
-            # 获取该文件的工作表名
-            current_sheet_a = sheet_a_map.get(original_file_a_path, sheet_a)
-            
-            # 加载A表工作簿
+                    b_values[str(cell_value)] = None
+        wb_b.close()
+        return b_values
+    finally:
+        if converted_file and os.path.exists(converted_file):
+            os.remove(converted_file)
+
+def load_b_header_key(file_b_path, sheet_b=None, col_y="A"):
+    """
+    读取B表第一行（表头）中比较列的值，用于在患者库覆盖统计中排除表头
+
+    只读取第一行：.xlsx以只读模式打开，.xls用xlrd读取而不转换格式，
+    患者库数据库使用导入时记录的表头和比较列。
+
+    返回:
+        表头中比较列的值（字符串），该单元格为空或无法读取时返回None
+    """
+    # 延迟导入，library_store模块依赖本模块中的工具函数
+    from library_store import is_library_store, LibraryStore
+
+    try:
+        if is_library_store(file_b_path):
+            meta = LibraryStore(file_b_path).meta()
+            header = meta.get("header", [])
+            col_y = meta.get("key_column") or "A"
+        elif os.path.splitext(file_b_path)[1].lower() == '.xls':
+            import xlrd
+            book = xlrd.open_workbook(file_b_path, on_demand=True)
             try:
-                wb_a = openpyxl.load_workbook(file_a_path, data_only=True)
-            except Exception as e:
-                print(f"加载文件 {file_a_path} 时出错: {str(e)}")
-                continue
-            
-            # 选择A表工作表
-            if current_sheet_a and current_sheet_a in wb_a.sheetnames:
-                ws_a = wb_a[current_sheet_a]
-            else:
-                ws_a = wb_a.active
-            
-            # 转换A表列名为列号
-            if isinstance(col_x, str) and not col_x.isdigit():
-                col_x_index = openpyxl.utils.column_index_from_string(col_x)
-            else:
-                col_x_index = int(col_x)
-            
-            # 初始化合并单元格映射
-            merged_cells_map = {}
-            
-            # 收集所有A表中的合并单元格信息
-            merged_ranges = {}
-            for merged_range in ws_a.merged_cells.ranges:
-                min_col, min_row, max_col, max_row = merged_range.min_col, merged_range.min_row, merged_range.max_col, merged_range.max_row
-                
-                # 记录合并单元格范围
-                for row_idx in range(min_row, max_row + 1):
-                    for col_idx in range(min_col, max_col + 1):
-                        merged_ranges[(row_idx, col_idx)] = (min_row, min_col, max_row, max_col)
-                
-                # 只关注X列的合并单元格 (用于匹配)
-                if min_col <= col_x_index <= max_col:
-                    cell_value = ws_a.cell(row=min_row, column=min_col).value
-                    
-                    # 将所有在这个合并范围内的行映射到该值
-                    for row_idx in range(min_row, max_row + 1):
-                        merged_cells_map[row_idx] = cell_value
-            
-            # 查找表头中包含"日期"的列
-            date_columns = set()
-            if ws_a.max_row > 0:
-                header_row = ws_a[2]
-                for col_idx, cell in enumerate(header_row, 1):
-                    header_text = str(cell.value).lower() if cell.value else ""
-                    if "日期" in header_text or "时间" in header_text or "date" in header_text.lower() or "time" in header_text.lower():
-                        date_columns.add(col_idx)
-            
-            # 找到匹配的行
-            matching_rows = []
-            matching_row_indices = []  # 存储原始行索引，用于后续复制合并单元格
-            
-            for row_idx in range(1, ws_a.max_row + 1):
-                # 检查这个行是否是合并单元格的一部分
-                if row_idx in merged_cells_map:
-                    cell_value = merged_cells_map[row_idx]
-                else:
-                    # 如果不是合并单元格，直接获取值
-                    cell_value = ws_a.cell(row=row_idx, column=col_x_index).value
-                
-                # 跳过空值
-                if cell_value is None:
-                    continue
-                
-                # 将值转换为字符串进行比较
-                cell_value_str = str(cell_value)
-                
-                # 检查是否在B表的值中
-                if cell_value_str in b_values:
-                    # 添加整行到结果
-                    row_data = []
-                    cell_formats = []  # 存储单元格格式
-                    cell_objects = []  # 存储原始单元格对象
-                    
-                    for cell in ws_a[row_idx]:
-                        # 这里直接使用cell.value，因为wb_a已用data_only=True打开，会自动计算函数结果
-                        row_data.append(cell.value)
-                        # 保存单元格的数字格式
-                        cell_formats.append(cell.number_format)
-                        # 保存原始单元格对象引用
-                        cell_objects.append(cell)
-                    
-                    matching_rows.append((row_data, cell_formats, cell_objects))
-                    matching_row_indices.append(row_idx)
-            
-            # 如果是第一个文件并且找到了表头，复制表头
-            if not header_added and ws_a.max_row > 0 and len(matching_rows) > 0:
-                # 复制第一行作为表头
-                header_row = []
-                header_formats = []
-                header_objects = []
-                
-                for cell in ws_a[1]:
-                    header_row.append(cell.value)
-                    header_formats.append(cell.number_format)
-                    header_objects.append(cell)
-                
-                # 将表头添加到结果第一行
-                for j, (value, cell_format, orig_cell) in enumerate(zip(header_row, header_formats, header_objects)):
-                    result_cell = ws_result.cell(row=1, column=j+1, value=value)
-                    copy_cell_format_and_style(orig_cell, result_cell, False)  # 表头不处理为日期格式
-                
-                header_added = True
-                start_row = 2
-            
-            # 用于记录需要在结果表中合并的单元格
-            cells_to_merge = {}
-            
-            # 复制数据
-            for i, ((row_data, cell_formats, orig_cells), original_row_idx) in enumerate(zip(matching_rows, matching_row_indices)):
-                if original_row_idx == 1 and header_added:
-                    # 跳过表头行（如果已经添加）
-                    continue
-                    
-                target_row = start_row + total_matches
-                
-                for j, (value, cell_format, orig_cell) in enumerate(zip(row_data, cell_formats, orig_cells)):
-                    col_idx = j + 1
-                    result_cell = ws_result.cell(row=target_row, column=col_idx)
-                    
-                    # 判断是否为日期列
-                    is_date_column = col_idx in date_columns
-                    
-                    # 使用增强的复制函数，处理所有格式和样式
-                    copy_cell_format_and_style(orig_cell, result_cell, is_date_column)
-                    
-                    # 检查该单元格在A表中是否是合并单元格的一部分
-                    original_cell_key = (original_row_idx, col_idx)
-                    if original_cell_key in merged_ranges:
-                        # 获取原始合并范围
-                        o_min_row, o_min_col, o_max_row, o_max_col = merged_ranges[original_cell_key]
-                        
-                        # 记录原始行到结果表行的映射，用于最终合并单元格
-                        file_key = f"file_{file_index}"
-                        if file_key not in global_row_mapping:
-                            global_row_mapping[file_key] = {}
-                        
-                        # 记录当前行映射
-                        global_row_mapping[file_key][original_row_idx] = target_row
-                        
-                        # 保存合并单元格信息，稍后统一处理
-                        if o_min_row > 1:  # 跳过第一行（表头）
-                            # 查找原始表中所有需要合并的行
-                            rows_to_merge = set(range(o_min_row, o_max_row + 1))
-                            matched_merge_rows = set(matching_row_indices) & rows_to_merge
-                            
-                            # 只有当所有需要合并的行都匹配上时，才记录此合并信息
-                            if len(matched_merge_rows) == len(rows_to_merge):
-                                merge_info = {
-                                    'file_index': file_index,
-                                    'o_min_row': o_min_row,
-                                    'o_min_col': o_min_col,
-                                    'o_max_row': o_max_row,
-                                    'o_max_col': o_max_col,
-                                    'matching_rows': matching_row_indices.copy(),
-                                    'matched_merge_rows': list(matched_merge_rows)
-                                }
-                                
-                                merge_key = (file_index, o_min_row, o_min_col, o_max_row, o_max_col)
-                                all_cells_to_merge[merge_key] = merge_info
-                
-                # 只统计非表头行
-                if original_row_idx > 1 or not header_added:
-                    total_matches += 1
-            
-            # 在结果表中合并单元格
-            for _, (min_row, min_col, max_row, max_col) in cells_to_merge.items():
-                # 只有当范围至少包含2个单元格时才合并
-                if min_row != max_row or min_col != max_col:
-                    # 获取合并单元格的范围字符串
-                    start_cell = f"{get_column_letter(min_col)}{min_row}"
-                    end_cell = f"{get_column_letter(max_col)}{max_row}"
-                    merge_range = f"{start_cell}:{end_cell}"
-                    
-                    try:
-                        # 执行合并
-                        ws_result.merge_cells(merge_range)
-                        
-                        # 设置合并后单元格的对齐方式为居中
-                        merged_cell = ws_result.cell(row=min_row, column=min_col)
-                        merged_cell.alignment = Alignment(horizontal='center', vertical='center')
-                    except Exception as e:
-                        print(f"合并单元格 {merge_range} 时出错: {str(e)}")
-    
-        # 如果没有找到匹配的数据，返回0
-        if total_matches == 0:
-            return 0, None
+                sheet = book.sheet_by_name(sheet_b) if sheet_b in book.sheet_names() else book.sheet_by_index(0)
+                # xlrd的空单元格为空字符串
+                header = [value if value != "" else None for value in sheet.row_values(0)] if sheet.nrows else []
+            finally:
+                book.release_resources()
+        else:
+            wb_b = openpyxl.load_workbook(file_b_path, read_only=True, data_only=True)
+            try:
+                ws_b = wb_b[sheet_b] if sheet_b and sheet_b in wb_b.sheetnames else wb_b.active
+                header = next(ws_b.iter_rows(min_row=1, max_row=1, values_only=True), ())
+            finally:
+                wb_b.close()
+        col_y_index = resolve_column(col_y, header)
+    except Exception as e:
+        print(f"读取B表 {os.path.basename(file_b_path)} 的表头失败: {str(e)}")
+        return None
+    value = header[col_y_index - 1] if len(header) >= col_y_index else None
+    return None if value is None else str(value)
+
+class BRowMap(dict):
+    """
+    B表键值 -> 补充列的值
+    
+    值为[(补充列的值, ...), ...]，按重复键处理方式保留第一行、最后一行或所有行。
+    可以像load_b_values的字典一样用于成员判断和遍历；header为补充列在B表第一行中的标题。
+    """
+    
+    def __init__(self, header):
+        super().__init__()
+        self.header = header
+    
+    def add(self, key, values, duplicate="first"):
+        """按重复键处理方式加入一行"""
+        rows = self.get(key)
+        if rows is None:
+            self[key] = [values]
+        elif duplicate == "last":
+            rows[0] = values
+        elif duplicate == "all":
+            rows.append(values)
+
+def load_b_rows(file_b_path, sheet_b=None, col_y="A", columns=None, duplicate="first", read_only=False):
+    """
+    读取B表，建立比较列的值到补充列的值的映射，用于把B表的列追加到匹配行
+    
+    参数:
+        file_b_path: b表文件路径
+        sheet_b: b表中的工作表名称，默认为活动表
+        col_y: b表中的列名或列号
+        columns: 需要补充到结果中的B表列（列名、列号或表头名称）列表
+        duplicate: B表中有重复键时的处理方式，"first"保留第一行，"last"保留最后一行，"all"保留所有行
+        read_only: 以只读模式流式读取，见load_b_values
         
-        # 处理所有文件中收集到的合并单元格信息
-        cells_to_merge = {}
+    返回:
+        BRowMap对象
+    """
+    converted_file = None
+    _, file_b_ext = os.path.splitext(file_b_path)
+    if file_b_ext.lower() == '.xls':
+        print(f"检测到B表是.xls格式，将转换为.xlsx格式处理...")
+        converted_file = convert_xls_to_xlsx(file_b_path)
+        if converted_file:
+            file_b_path = converted_file
+        else:
+            print("B表转换失败，将尝试直接处理...")
+    
+    try:
+        # data_only=True 使公式只返回结果值，与A表和患者库数据库的读取方式一致
+        wb_b = openpyxl.load_workbook(file_b_path, read_only=read_only, data_only=True)
         
-        for merge_key, merge_info in all_cells_to_merge.items():
-            file_index = merge_info['file_index']
-            o_min_row = merge_info['o_min_row']
-            o_min_col = merge_info['o_min_col']
-            o_max_row = merge_info['o_max_row'] 
-            o_max_col = merge_info['o_max_col']
-            matched_merge_rows = merge_info['matched_merge_rows']
-            
-            file_key = f"file_{file_index}"
-            row_mapping = global_row_mapping.get(file_key, {})
-            
-            if not row_mapping:
-                print(f"警告: 文件 {file_index} 的行映射信息丢失，跳过合并单元格")
-                continue
-            
-            # 获取合并范围内所有行在结果表中的位置
-            result_rows = []
-            for row_idx in matched_merge_rows:
-                if row_idx in row_mapping:
-                    result_rows.append(row_mapping[row_idx])
-            
-            if not result_rows:
-                print(f"警告: 文件 {file_index} 合并范围 ({o_min_row},{o_min_col})-({o_max_row},{o_max_col}) 在结果表中找不到对应行")
-                continue
-            
-            # 计算结果表中的合并范围
-            new_min_row = min(result_rows)
-            new_max_row = max(result_rows)
-            
-            # 保存合并信息
-            final_merge_key = (new_min_row, o_min_col, new_max_row, o_max_col)
-            cells_to_merge[final_merge_key] = (new_min_row, o_min_col, new_max_row, o_max_col)
-            print(f"将合并单元格: 文件{file_index+1}原始范围=({o_min_row},{o_min_col})-({o_max_row},{o_max_col}) -> 结果表范围=({new_min_row},{o_min_col})-({new_max_row},{o_max_col})")
+        # 选择B表工作表
+        if sheet_b and sheet_b in wb_b.sheetnames:
+            ws_b = wb_b[sheet_b]
+        else:
+            ws_b = wb_b.active
         
-        # 在结果表中合并单元格
-        for _, (min_row, min_col, max_row, max_col) in cells_to_merge.items():
-            # 只有当范围至少包含2个单元格时才合并
-            if min_row != max_row or min_col != max_col:
-                # 获取合并单元格的范围字符串
-                start_cell = f"{get_column_letter(min_col)}{min_row}"
-                end_cell = f"{get_column_letter(max_col)}{max_row}"
-                merge_range = f"{start_cell}:{end_cell}"
-                
-                try:
-                    # 执行合并
-                    ws_result.merge_cells(merge_range)
-                    
-                    # 设置合并后单元格的对齐方式为居中
-                    merged_cell = ws_result.cell(row=min_row, column=min_col)
-                    merged_cell.alignment = Alignment(horizontal='center', vertical='center')
-                except Exception as e:
-                    print(f"合并单元格 {merge_range} 时出错: {str(e)}")
+        b_rows = None
+        for row in ws_b.iter_rows(min_row=1, max_row=None if read_only else ws_b.max_row, values_only=True):
+            if b_rows is None:
+                # 比较列和补充列可以是表头名称，按第一行确定列号
+                col_y_index = resolve_column(col_y, row)
+                column_indices = resolve_columns(columns, row)
+            values = tuple(row[index - 1] if len(row) >= index else None for index in column_indices)
+            if b_rows is None:
+                b_rows = BRowMap(list(values))
+            if len(row) >= col_y_index and row[col_y_index - 1] is not None:
+                b_rows.add(str(row[col_y_index - 1]), values, duplicate)
+        wb_b.close()
+        return b_rows if b_rows is not None else BRowMap([None] * len(columns))
+    finally:
+        if converted_file and os.path.exists(converted_file):
+            os.remove(converted_file)
+
+def load_b_index(file_b_path, sheet_b=None, col_y="A", backend="set", columns=None, duplicate="first", read_only=False):
+    """
+    读取B表并建立指定类型的索引
     
-        # 修复可能出现的文件名问题
-        if ".." in output_path:
-            output_path = output_path.replace("..", ".")
-        
-        # 为结果表中的所有已使用单元格添加边框
-        for row in ws_result.iter_rows(min_row=1, max_row=ws_result.max_row):
-            for cell in row:
-                set_cell_borders(cell)
+    file_b_path也可以是library_store模块导入的患者库数据库，此时直接从数据库读取比较列，
+    不解析Excel，sheet_b和col_y以导入时的设置为准。
+    
+    参数:
+        backend: "set"返回load_b_values的字典；"hashed"返回HashedKeyIndex，
+                 以排序的64位哈希数组保存键，适合数百万行的患者库
+        columns: 需要补充到结果中的B表列，提供时返回load_b_rows的BRowMap（只支持"set"）
+        duplicate: B表中有重复键时的处理方式，见load_b_rows
+        read_only: 以只读模式流式读取B表，见load_b_values（患者库数据库不读取Excel，忽略此参数）
+    """
+    # 延迟导入，library_store模块依赖本模块中的工具函数
+    from library_store import is_library_store, LibraryStore
+    
+    if columns:
+        if is_library_store(file_b_path):
+            return LibraryStore(file_b_path).load_rows(columns, duplicate)
+        return load_b_rows(file_b_path, sheet_b, col_y, columns, duplicate, read_only)
+    
+    if is_library_store(file_b_path):
+        b_values = LibraryStore(file_b_path).load_keys()
+    else:
+        b_values = load_b_values(file_b_path, sheet_b, col_y, read_only)
+    if backend == "hashed":
+        return HashedKeyIndex(b_values)
+    return b_values
+
+class BIndexCache:
+    """
+    线程安全的B表索引缓存
+    
+    以(文件路径, 修改时间, 文件大小, 工作表, 列, 索引类型)为键缓存B表索引，
+    多个任务使用同一个患者库时只建立一次索引；同一个键正在建立时，其他任务等待其完成。
+    患者库文件被修改后自动失效。
+    """
+    
+    def __init__(self, max_entries=4):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._building = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def _make_key(self, file_b_path, sheet_b, col_y, backend, columns, duplicate):
+        stat = os.stat(file_b_path)
+        columns = tuple(str(col).upper() for col in columns) if columns else None
+        return (os.path.abspath(file_b_path), stat.st_mtime_ns, stat.st_size, sheet_b or None, str(col_y).upper(), backend,
+                columns, duplicate if columns else None)
+    
+    def get(self, file_b_path, sheet_b=None, col_y="A", backend="set", columns=None, duplicate="first", read_only=False):
+        """
+        获取B表索引，缓存中没有时读取B表并放入缓存
         
-        # 添加时间戳到文件名
-        file_name, file_ext = os.path.splitext(output_path)
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        safe_output_path = f"{file_name}_{timestamp}{file_ext}"
+        参数:
+            backend: "set"为load_b_values返回的字典，"hashed"为紧凑的HashedKeyIndex
+            columns, duplicate: 需要补充的B表列和重复键处理方式，提供columns时缓存load_b_rows的结果
+            read_only: 缓存中没有时是否以只读模式读取B表，读取结果相同，不作为缓存键的一部分
+        """
+        key = self._make_key(file_b_path, sheet_b, col_y, backend, columns, duplicate)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                # 移到末尾，保持最近使用的顺序
+                self._entries[key] = self._entries.pop(key)
+                return self._entries[key]
+            build_lock = self._building.setdefault(key, threading.Lock())
         
-        try:
-            # 保存结果
-            wb_result.save(safe_output_path)
-            return total_matches, safe_output_path
-        except Exception as e:
-            print(f"保存文件时出错: {str(e)}")
-            # 尝试保存到桌面
-            desktop = os.path.join(os.path.expanduser("~"), "Desktop")
-            desktop_path = os.path.join(desktop, os.path.basename(safe_output_path))
+        with build_lock:
+            with self._lock:
+                if key in self._entries:
+                    self.hits += 1
+                    return self._entries[key]
             try:
-                wb_result.save(desktop_path)
-                return total_matches, desktop_path
-            except:
-                return 0, None
-    finally:
-        # 清理转换过程中创建的临时文件
-        for temp_file in converted_files:
+                b_values = load_b_index(file_b_path, sheet_b, col_y, backend, columns, duplicate, read_only)
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = b_values
+                while len(self._entries) > self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+            return b_values
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+_output_path_lock = threading.Lock()
+
+def reserve_output_path(output_path):
+    """
+    为输出文件名添加时间戳，并创建空文件占位
+    
+    同一秒内有多个任务保存到同一文件名时，依次追加序号，避免互相覆盖
+    """
+    file_name, file_ext = os.path.splitext(output_path)
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
+    candidate = f"{file_name}_{timestamp}{file_ext}"
+    counter = 1
+    with _output_path_lock:
+        while True:
             try:
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-                    print(f"已删除临时文件: {temp_file}")
-            except Exception as e:
-                print(f"删除临时文件失败: {temp_file}, 错误: {str(e)}")
+                with open(candidate, "x"):
+                    pass
+                return candidate
+            except FileExistsError:
+                counter += 1
+                candidate = f"{file_name}_{timestamp}_{counter}{file_ext}"
+            except OSError:
+                # 目录不可写等情况，交给后续保存逻辑处理
+                return candidate
+
+def release_output_path(reserved_path):
+    """删除保存失败时留下的空占位文件"""
+    try:
+        if os.path.exists(reserved_path) and os.path.getsize(reserved_path) == 0:
+            os.remove(reserved_path)
+    except OSError:
+        pass
+
+def save_workbook(wb, path, compression=None):
+    """
+    保存工作簿，可以指定zip压缩级别
+    
+    参数:
+        wb: openpyxl工作簿
+        path: 保存路径
+        compression: None使用openpyxl默认的deflate压缩；0为不压缩（只存储），
+                     1-9为deflate压缩级别，数字越小保存越快、文件越大
+    """
+    if compression is None:
+        wb.save(path)
+        return
+    
+    if compression == 0:
+        archive = zipfile.ZipFile(path, "w", zipfile.ZIP_STORED, allowZip64=True)
+    else:
+        archive = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, compresslevel=compression, allowZip64=True)
+    try:
+        wb.properties.modified = datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+        # ExcelWriter.save写完所有部件后会关闭压缩包
+        ExcelWriter(wb, archive).save()
+    except Exception:
+        archive.close()
+        raise
+
+def process_excel_files(file_a_paths, file_b_path, output_path, col_x, col_y, sheet_a=None, sheet_b=None, output_sheet=None, sheet_a_map=None,
+                        fuzzy_match=False, fuzzy_threshold=1, outputs=None,
+                        dedup=False, dedup_columns=None, dedup_keep="first", stats=None, b_index_cache=None,
+                        col_x_map=None, b_index=None, stages=None, preview=False, preview_rows=20, row_callback=None,
+                        run_history=None, save_options=None, prefetch=1, sheet_b_map=None, col_y_map=None,
+                        b_index_backend="set", b_columns=None, b_duplicate="first", summary_columns=None,
+                        output_columns=None, row_filters=None, append=False, b_read_only=False, auto=False, job_dir=None):
+    """
+    处理多个A表文件，查找它们中与B表有重合的行并输出到新文件
+    
+    参数:
+        file_a_paths: a表文件路径列表
+        file_b_path: b表文件路径，也可以是用library_store导入的患者库数据库（.sqlite3）；
+                     也可以是多个患者库的路径列表，所有患者库合并为一个索引，
+                     匹配行末尾追加"匹配患者库"列，列出该行出现在哪些患者库中（以文件名区分）
+        output_path: 输出文件路径
+        col_x: a表中的列名、列号或表头名称（如"患者姓名"，按每个文件的第一行确定列号，模板移动列后仍然正确）
+        col_y: b表中的列名、列号或表头名称
+        sheet_a: 所有a表默认的工作表名称，默认为活动表
+        sheet_b: b表中的工作表名称，默认为活动表
+        output_sheet: 输出工作表名称，默认为"匹配结果"
+        sheet_a_map: 文件路径到工作表名称的映射，用于单独设置每个文件的工作表名
+        fuzzy_match: 是否启用模糊匹配，精确匹配失败时按编辑距离查找最相近的B表值，
+                     并在结果末尾追加"匹配得分"和"匹配患者"两列
+        fuzzy_threshold: 模糊匹配允许的最大编辑距离
+        outputs: 需要生成的输出内容，可包含"matched"(匹配行)、"unmatched"(未匹配行，
+                 写入"未匹配"工作表)、"coverage"(患者库覆盖情况，写入"患者库覆盖"工作表)
+                 和"summary"(按患者、按文件和工作表统计匹配行数，写入"汇总统计"工作表)，
+                 默认只输出匹配行。所有输出在同一次扫描中写入同一个结果文件
+        dedup: 是否对跨文件的匹配行去重
+        dedup_columns: 用于判断重复的列（列名、列号或表头名称）列表，默认使用整行
+        dedup_keep: 重复时保留哪一行，"first"保留第一次出现，"last"保留最后一次出现
+                    （"last"需要先扫描完所有文件再写入，占用更多内存）
+        stats: 可选的字典，处理结束后写入统计信息，例如去重删除的行数"duplicates_dropped"、
+               各阶段耗时"stage_times"、扫描行数"rows_scanned"和匹配行数"rows_matched"
+        b_index_cache: 可选的BIndexCache对象，多个任务使用同一个患者库时共享B表索引
+        col_x_map: 文件路径到比较列的映射，用于单独设置每个文件的比较列
+        b_index: 预先建立的B表索引（如任务队列在进程模式下共享给工作进程的SharedKeyIndex），
+                 提供时直接用于成员判断，不再读取B表
+        stages: 替换流水线中某些阶段的实现，阶段名称到类的映射，见pipeline模块
+        preview: 预览模式，只流式扫描比较列，返回每个文件的匹配行数和前preview_rows条匹配行，
+                 不复制样式、不生成结果文件
+        preview_rows: 预览模式下返回的匹配行数上限
+        row_callback: 可选的回调函数，匹配行确定输出后按批次调用row_callback(header, rows)，
+                      rows为[(文件名, 原始行号, 值元组), ...]，在处理线程中调用
+        run_history: 处理记录（见run_history模块），默认写入用户目录下的记录数据库；
+                     可传入数据库路径或RunHistory对象，False表示不记录。预览模式不记录
+        save_options: 保存选项字典，可包含"compression"（压缩级别，0为不压缩、1-9为deflate级别，
+                      默认使用openpyxl的压缩，见save_workbook）和"background"（是否在后台线程保存）。
+                      后台保存时函数在开始保存后立即返回，stats["pending_save"]为保存完成时
+                      得到实际保存路径的Future对象；保存耗时写入stats["save_time"]
+        prefetch: 处理当前A表时在后台线程中预先加载的后续文件数，0表示逐个加载。
+                  同时驻留内存的A表工作簿最多为prefetch+1个
+        sheet_b_map: 患者库路径到工作表名称的映射，用于单独设置每个患者库的工作表名
+        col_y_map: 患者库路径到比较列的映射，用于单独设置每个患者库的比较列
+        b_index_backend: B表索引类型，"set"为字符串字典（默认）；"hashed"为排序的64位哈希数组，
+                         每个键只占约16字节加键长，A表比较列整列批量查找，适合数百万行的患者库
+        b_columns: 需要追加到匹配行末尾的B表列（列名、列号或表头名称）列表，标题取自B表第一行，
+                   省去在Excel中用VLOOKUP查回电话、会员等级、医生等信息。多个患者库时使用相同的列
+        b_duplicate: B表中同一个键有多行时补充哪一行，"first"第一行，"last"最后一行，
+                     "all"所有行（各行的值用顿号连接写在同一个单元格中）；多个患者库按列表顺序合并
+        summary_columns: 汇总统计中计算合计、最小值和最大值的数值列（列名、列号或表头名称）列表，
+                         在扫描时累加，统计的是去重后实际输出的匹配行
+        output_columns: 输出的A表列（列名、列号或表头名称）列表，按列表顺序输出，默认输出所有列。
+                        未选择的列不读取、不复制样式也不加边框；合并区域按输出列裁剪，
+                        左上角所在列没有输出的合并区域不再合并。去重和汇总统计的列必须在输出列中
+        row_filters: 匹配行的筛选条件列表，每个条件为(列, 运算, 值)或RowFilter对象，见RowFilter。
+                     例如[("日期", "between", ("2025-05-01", "2025-05-31")), ("金额", ">", 0)]，
+                     所有条件都满足的匹配行才输出。条件只读取条件列的单元格，在复制整行和样式之前判断，
+                     排除的行数写入stats["rows_filtered"]
+        append: 追加模式，把匹配行追加到output_path已有的结果文件中（不添加时间戳）。
+                已有的行不重新读取和写入，只在输出工作表末尾加入新行和新的合并区域，
+                追加的行数写入stats["rows_appended"]；文件不存在时按output_path创建。
+                追加模式只支持输出匹配行
+        b_read_only: 以只读模式流式读取B表，不在内存中建立所有单元格和样式，适合很大的患者库
+        auto: 自动选择处理方式。加载前按压缩包中工作表XML的大小和<dimension>（.xls按xlrd读取的行列数）
+              估算每个输入文件，选择B表读取方式（b_read_only）、B表索引类型（b_index_backend）、
+              预读文件数（prefetch）和压缩级别，并打印选择的原因，此时忽略这几个参数；
+              save_options中已指定的压缩级别保持不变。选择结果写入stats["auto_settings"]，见auto_tune模块
+        job_dir: 任务目录，设置后每处理完一个A表就把匹配结果和进度保存到该目录。
+                 中途失败（文件损坏、保存时磁盘已满等）后用同一目录重新运行相同的任务，
+                 已完成的文件直接读取保存的结果，只处理失败和未完成的文件，见checkpoint模块。
+                 处理失败的文件写入任务目录的errors.txt；无论是否设置任务目录，
+                 失败的文件及原因都写入stats["file_errors"]，处理结束时汇总打印
+        
+    返回:
+        (匹配行数, 保存的文件路径)，没有可输出的内容或保存失败时返回(0, None)；
+        预览模式下返回MatchPipeline.preview的结果字典
+    """
+    # 延迟导入，pipeline模块依赖本模块中的工具函数
+    from pipeline import MatchPipeline
+    
+    # 处理单文件情况
+    if not isinstance(file_a_paths, list):
+        file_a_paths = [file_a_paths]
+    
+    auto_settings = None
+    if auto and not preview:
+        from auto_tune import choose_settings
+        file_b_paths = list(file_b_path) if isinstance(file_b_path, (list, tuple)) else [file_b_path]
+        settings = choose_settings(file_a_paths, file_b_paths, sheet_a=sheet_a, sheet_a_map=sheet_a_map, sheet_b=sheet_b,
+                                   sheet_b_map=sheet_b_map, b_columns=b_columns, b_index=b_index, save_options=save_options)
+        print("自动选择处理方式:")
+        for reason in settings["reasons"]:
+            print(f"  {reason}")
+        prefetch = settings["prefetch"]
+        b_index_backend = settings["b_index_backend"]
+        b_read_only = settings["b_read_only"]
+        if settings["compression"] is not None:
+            save_options = dict(save_options or {}, compression=settings["compression"])
+        if stats is not None:
+            stats["auto_settings"] = settings
+        auto_settings = settings
+    
+    pipeline = MatchPipeline(
+        file_a_paths, file_b_path, output_path, col_x, col_y,
+        sheet_a=sheet_a, sheet_b=sheet_b, output_sheet=output_sheet, sheet_a_map=sheet_a_map,
+        sheet_b_map=sheet_b_map, col_y_map=col_y_map, fuzzy_match=fuzzy_match, fuzzy_threshold=fuzzy_threshold, outputs=outputs,
+        dedup=dedup, dedup_columns=dedup_columns, dedup_keep=dedup_keep, stats=stats,
+        b_index_cache=b_index_cache, col_x_map=col_x_map, b_index=b_index, stages=stages,
+        row_callback=row_callback, run_history=False if preview else run_history,
+        save_options=save_options, prefetch=prefetch, b_index_backend=b_index_backend,
+        b_columns=b_columns, b_duplicate=b_duplicate, summary_columns=summary_columns,
+        output_columns=output_columns, row_filters=row_filters, append=append, b_read_only=b_read_only,
+        job_dir=job_dir, auto_settings=auto_settings
+    )
+    if preview:
+        return pipeline.preview(preview_rows)
+    return pipeline.run()
 
 def main():
     """测试函数，演示如何使用本模块"""
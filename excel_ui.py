@@ -93,6 +93,25 @@ def import_excel_processor():
 # 获取process_excel_files函数
 process_excel_files = import_excel_processor()
 
+from job_queue import JobQueue, JOB_SAVING, JOB_DONE, JOB_FAILED
+
+# 预览时显示的匹配行数
+PREVIEW_ROWS = 20
+
+# 保存方式对应的压缩级别，None为openpyxl默认压缩
+SAVE_COMPRESSION_LEVELS = {
+    "标准压缩": None,
+    "快速压缩(文件较大)": 1,
+    "不压缩(最快,文件最大)": 0,
+}
+
+# 患者库中同一患者有多行时补充列的取值方式
+B_DUPLICATE_POLICIES = {
+    "取第一条": "first",
+    "取最后一条": "last",
+    "全部(顿号分隔)": "all",
+}
+
 # 在适当的位置创建一个函数用于创建按钮，根据平台选择不同的按钮类
 def create_button(parent, **kwargs):
     """根据平台创建合适的按钮"""
@@ -103,6 +122,105 @@ def create_button(parent, **kwargs):
         # 其他平台使用tk.Button
         return tk.Button(parent, **kwargs)
 
+class VirtualRowTable:
+    """
+    只渲染可见行的表格
+    
+    所有行保存在Python列表中，Treeview只保留固定数量的条目，滚动时替换这些条目的内容，
+    因此即使有十万行以上，追加和滚动的开销也只与可见行数有关。
+    """
+    
+    def __init__(self, parent, visible_rows=12):
+        self.visible_rows = visible_rows
+        self.rows = []
+        self.first = 0
+        self.follow_tail = True  # 停留在末尾时自动滚动显示新行
+        self.columns = ()
+        
+        self.frame = ttk.Frame(parent)
+        self.tree = ttk.Treeview(self.frame, show="headings", height=visible_rows)
+        self.vsb = ttk.Scrollbar(self.frame, orient="vertical", command=self._on_scrollbar)
+        self.hsb = ttk.Scrollbar(self.frame, orient="horizontal", command=self.tree.xview)
+        self.tree.config(xscrollcommand=self.hsb.set)
+        self.vsb.pack(side=tk.RIGHT, fill=tk.Y)
+        self.hsb.pack(side=tk.BOTTOM, fill=tk.X)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        # 鼠标滚轮（Windows/macOS使用<MouseWheel>，Linux使用Button-4/5）
+        self.tree.bind("<MouseWheel>", lambda event: self.scroll(-1 if event.delta > 0 else 1, "units") or "break")
+        self.tree.bind("<Button-4>", lambda event: self.scroll(-1, "units") or "break")
+        self.tree.bind("<Button-5>", lambda event: self.scroll(1, "units") or "break")
+        self._refresh()
+    
+    def set_columns(self, header):
+        """根据表头设置列（前两列固定为来源文件和原始行号）"""
+        columns = ("来源", "行号") + tuple(f"c{i}" for i in range(len(header)))
+        if columns == self.columns:
+            return
+        self.columns = columns
+        self.tree.config(columns=columns)
+        self.tree.heading("来源", text="来源")
+        self.tree.column("来源", width=120, minwidth=60, stretch=False)
+        self.tree.heading("行号", text="行号")
+        self.tree.column("行号", width=50, minwidth=40, anchor="center", stretch=False)
+        for i, title in enumerate(header):
+            column_id = f"c{i}"
+            self.tree.heading(column_id, text="" if title is None else str(title))
+            self.tree.column(column_id, width=100, minwidth=50, stretch=False)
+    
+    def clear(self):
+        """清空所有行"""
+        self.rows = []
+        self.first = 0
+        self.follow_tail = True
+        self._refresh()
+    
+    def append_rows(self, rows):
+        """追加一批行，每行为(来源文件, 原始行号, 值序列)"""
+        self.rows.extend(rows)
+        if self.follow_tail:
+            self.first = max(0, len(self.rows) - self.visible_rows)
+        self._refresh()
+    
+    def scroll(self, amount, what="units"):
+        """按行或按页滚动"""
+        step = self.visible_rows if what == "pages" else 1
+        self._scroll_to(self.first + int(amount) * step)
+    
+    def _on_scrollbar(self, action, *args):
+        if action == "moveto":
+            self._scroll_to(int(float(args[0]) * len(self.rows)))
+        elif action == "scroll":
+            self.scroll(args[0], args[1])
+    
+    def _scroll_to(self, first):
+        max_first = max(0, len(self.rows) - self.visible_rows)
+        self.first = min(max(0, first), max_first)
+        self.follow_tail = self.first >= max_first
+        self._refresh()
+    
+    def _refresh(self):
+        """只重新填充可见的条目"""
+        items = self.tree.get_children()
+        visible = self.rows[self.first:self.first + self.visible_rows]
+        for index in range(self.visible_rows):
+            item_id = f"row_{index}"
+            if index < len(visible):
+                source_name, row_idx, values = visible[index]
+                display = [source_name, row_idx] + ["" if value is None else str(value) for value in values]
+                if item_id in items:
+                    self.tree.item(item_id, values=display)
+                else:
+                    self.tree.insert("", "end", iid=item_id, values=display)
+            elif item_id in items:
+                self.tree.delete(item_id)
+        
+        total = len(self.rows)
+        if total:
+            self.vsb.set(self.first / total, min(1.0, (self.first + self.visible_rows) / total))
+        else:
+            self.vsb.set(0.0, 1.0)
+
 class ExcelProcessorUI:
     def __init__(self, root):
         self.root = root
@@ -181,6 +299,16 @@ class ExcelProcessorUI:
         self.a_files = []  # 格式: [(文件路径, 工作表名称), ...]
         self.a_common_sheet = tk.StringVar()  # 用于存储通用工作表名称
         
+        # 任务队列：限制同时运行的任务数，并共享患者库索引
+        self.job_queue = JobQueue(
+            process_excel_files, max_workers=2,
+            on_update=lambda job: self.root.after(0, self.on_job_update, job),
+            on_rows=lambda job, header, rows: self.root.after(0, self.on_job_rows, job, header, rows)
+        )
+        
+        # 实时结果表显示的任务编号（最近提交的任务）
+        self.live_job_id = None
+        
         self.create_widgets()
     
     def create_widgets(self):
@@ -345,7 +473,52 @@ class ExcelProcessorUI:
             pady=10,
             cursor="hand2"  # 手型光标
         )
-        process_button.pack(fill=tk.X, ipady=5, pady=5)
+        process_button.pack(side=tk.LEFT, fill=tk.X, expand=True, ipady=5, pady=5)
+        
+        # 预览按钮：只统计匹配行数，不生成结果文件
+        preview_button = create_button(
+            process_frame,
+            text="预览",
+            command=self.preview_data,
+            font=("微软雅黑", 12, "bold"),
+            bg="#2196F3",  # 蓝色背景
+            fg="white",
+            activebackground="#1e88e5",
+            activeforeground="white",
+            relief=tk.RAISED,
+            bd=1,
+            padx=20,
+            pady=10,
+            cursor="hand2"
+        )
+        preview_button.pack(side=tk.LEFT, ipady=5, pady=5, padx=(10, 0))
+        
+        # 任务队列显示
+        jobs_frame = ttk.LabelFrame(main_frame, text="任务队列", padding="10 10 10 10")
+        jobs_frame.pack(fill=tk.BOTH, expand=True, pady=(10, 0))
+        
+        jobs_columns = ("编号", "任务", "状态", "匹配行数", "耗时")
+        self.jobs_tree = ttk.Treeview(jobs_frame, columns=jobs_columns, show="headings", height=4)
+        self.jobs_tree.column("编号", width=50, anchor="center", minwidth=50)
+        self.jobs_tree.column("任务", width=330, minwidth=100)
+        self.jobs_tree.column("状态", width=80, anchor="center", minwidth=60)
+        self.jobs_tree.column("匹配行数", width=80, anchor="center", minwidth=60)
+        self.jobs_tree.column("耗时", width=80, anchor="center", minwidth=60)
+        for column in jobs_columns:
+            self.jobs_tree.heading(column, text=column)
+        
+        jobs_vsb = ttk.Scrollbar(jobs_frame, orient="vertical", command=self.jobs_tree.yview)
+        jobs_vsb.pack(side="right", fill="y")
+        self.jobs_tree.config(yscrollcommand=jobs_vsb.set)
+        self.jobs_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        # 实时显示最近提交任务的匹配行
+        live_frame = ttk.LabelFrame(main_frame, text="匹配行（实时）", padding="10 10 10 10")
+        live_frame.pack(fill=tk.BOTH, expand=True, pady=(10, 0))
+        self.live_count_var = tk.StringVar(value="尚未开始处理")
+        ttk.Label(live_frame, textvariable=self.live_count_var).pack(anchor="w")
+        self.live_table = VirtualRowTable(live_frame, visible_rows=10)
+        self.live_table.frame.pack(fill=tk.BOTH, expand=True)
         
         # 状态标签
         self.status_var = tk.StringVar()
@@ -556,18 +729,31 @@ class ExcelProcessorUI:
         col_frame = ttk.Frame(parent, style="TFrame")
         col_frame.pack(fill=tk.X, pady=5)
         
-        ttk.Label(col_frame, text="比较列:", style="TLabel").pack(side=tk.LEFT)
+        ttk.Label(col_frame, text="比较列(列名或表头名称):", style="TLabel").pack(side=tk.LEFT)
         
         self.a_column = tk.StringVar()
-        col_entry = ttk.Entry(col_frame, textvariable=self.a_column, width=5)
+        col_entry = ttk.Entry(col_frame, textvariable=self.a_column, width=12)
         col_entry.pack(side=tk.LEFT, padx=5)
+        
+        # 模糊匹配设置（用于姓名录入有误的情况）
+        fuzzy_frame = ttk.Frame(parent, style="TFrame")
+        fuzzy_frame.pack(fill=tk.X, pady=5)
+        
+        self.fuzzy_match = tk.BooleanVar(value=False)
+        ttk.Checkbutton(fuzzy_frame, text="模糊匹配", variable=self.fuzzy_match).pack(side=tk.LEFT)
+        
+        ttk.Label(fuzzy_frame, text="最大编辑距离:", style="TLabel").pack(side=tk.LEFT, padx=(10, 0))
+        
+        self.fuzzy_threshold = tk.StringVar(value="1")
+        fuzzy_entry = ttk.Entry(fuzzy_frame, textvariable=self.fuzzy_threshold, width=5)
+        fuzzy_entry.pack(side=tk.LEFT, padx=5)
     
     def setup_b_tab(self, parent):
         # B表文件路径 - 使用可伸缩布局，确保按钮始终可见
         path_frame = ttk.Frame(parent, style="TFrame")
         path_frame.pack(fill=tk.X, pady=(10, 5))
         
-        ttk.Label(path_frame, text="患者库文件路径:", style="TLabel").pack(side=tk.LEFT)
+        ttk.Label(path_frame, text="患者库文件路径(多个用;分隔):", style="TLabel").pack(side=tk.LEFT)
         
         # 创建一个框架来包含输入框和按钮
         entry_button_frame = ttk.Frame(path_frame)
@@ -610,11 +796,28 @@ class ExcelProcessorUI:
         col_frame = ttk.Frame(parent, style="TFrame")
         col_frame.pack(fill=tk.X, pady=5)
         
-        ttk.Label(col_frame, text="比较列:", style="TLabel").pack(side=tk.LEFT)
+        ttk.Label(col_frame, text="比较列(列名或表头名称):", style="TLabel").pack(side=tk.LEFT)
         
         self.b_column = tk.StringVar()
-        col_entry = ttk.Entry(col_frame, textvariable=self.b_column, width=5)
+        col_entry = ttk.Entry(col_frame, textvariable=self.b_column, width=12)
         col_entry.pack(side=tk.LEFT, padx=5)
+        
+        # 追加到匹配结果的患者库列
+        extra_frame = ttk.Frame(parent, style="TFrame")
+        extra_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(extra_frame, text="补充列(逗号分隔):", style="TLabel").pack(side=tk.LEFT)
+        
+        self.b_extra_columns = tk.StringVar()
+        extra_entry = ttk.Entry(extra_frame, textvariable=self.b_extra_columns, width=15)
+        extra_entry.pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(extra_frame, text="重复患者:", style="TLabel").pack(side=tk.LEFT, padx=(10, 0))
+        
+        self.b_duplicate = tk.StringVar(value="取第一条")
+        b_duplicate_combo = ttk.Combobox(extra_frame, textvariable=self.b_duplicate, width=10, state="readonly",
+                                         values=tuple(B_DUPLICATE_POLICIES))
+        b_duplicate_combo.pack(side=tk.LEFT, padx=5)
     
     def setup_output_tab(self, parent):
         # 输出文件夹路径 - 使用可伸缩布局
@@ -670,6 +873,82 @@ class ExcelProcessorUI:
         sheet_entry.pack(side=tk.LEFT, padx=5)
         
         ttk.Label(sheet_frame, style="TLabel").pack(side=tk.LEFT)
+        
+        # 输出列
+        columns_frame = ttk.Frame(parent, style="TFrame")
+        columns_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(columns_frame, text="输出列(逗号分隔,按顺序输出,留空为全部):", style="TLabel").pack(side=tk.LEFT)
+        
+        self.output_columns = tk.StringVar()
+        columns_entry = ttk.Entry(columns_frame, textvariable=self.output_columns, width=30)
+        columns_entry.pack(side=tk.LEFT, padx=5)
+        
+        # 附加输出内容
+        extra_outputs_frame = ttk.Frame(parent, style="TFrame")
+        extra_outputs_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(extra_outputs_frame, text="附加输出:", style="TLabel").pack(side=tk.LEFT)
+        
+        self.output_unmatched = tk.BooleanVar(value=False)
+        ttk.Checkbutton(extra_outputs_frame, text="未匹配行", variable=self.output_unmatched).pack(side=tk.LEFT, padx=5)
+        
+        self.output_coverage = tk.BooleanVar(value=False)
+        ttk.Checkbutton(extra_outputs_frame, text="患者库覆盖情况", variable=self.output_coverage).pack(side=tk.LEFT, padx=5)
+        
+        # 汇总统计
+        summary_frame = ttk.Frame(parent, style="TFrame")
+        summary_frame.pack(fill=tk.X, pady=5)
+        
+        self.output_summary = tk.BooleanVar(value=False)
+        ttk.Checkbutton(summary_frame, text="汇总统计", variable=self.output_summary).pack(side=tk.LEFT)
+        
+        ttk.Label(summary_frame, text="合计列(逗号分隔):", style="TLabel").pack(side=tk.LEFT, padx=(10, 0))
+        
+        self.summary_columns = tk.StringVar()
+        summary_entry = ttk.Entry(summary_frame, textvariable=self.summary_columns, width=15)
+        summary_entry.pack(side=tk.LEFT, padx=5)
+        
+        # 跨文件去重
+        dedup_frame = ttk.Frame(parent, style="TFrame")
+        dedup_frame.pack(fill=tk.X, pady=5)
+        
+        self.dedup = tk.BooleanVar(value=False)
+        ttk.Checkbutton(dedup_frame, text="去除重复行", variable=self.dedup).pack(side=tk.LEFT)
+        
+        ttk.Label(dedup_frame, text="判断列(逗号分隔,留空为整行):", style="TLabel").pack(side=tk.LEFT, padx=(10, 0))
+        
+        self.dedup_columns = tk.StringVar()
+        dedup_columns_entry = ttk.Entry(dedup_frame, textvariable=self.dedup_columns, width=12)
+        dedup_columns_entry.pack(side=tk.LEFT, padx=5)
+        
+        self.dedup_keep = tk.StringVar(value="保留第一条")
+        dedup_keep_combo = ttk.Combobox(dedup_frame, textvariable=self.dedup_keep, width=10, state="readonly",
+                                        values=("保留第一条", "保留最后一条"))
+        dedup_keep_combo.pack(side=tk.LEFT, padx=5)
+        
+        # 保存选项
+        save_frame = ttk.Frame(parent, style="TFrame")
+        save_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(save_frame, text="保存方式:", style="TLabel").pack(side=tk.LEFT)
+        
+        self.save_compression = tk.StringVar(value="标准压缩")
+        compression_combo = ttk.Combobox(save_frame, textvariable=self.save_compression, width=18, state="readonly",
+                                         values=tuple(SAVE_COMPRESSION_LEVELS))
+        compression_combo.pack(side=tk.LEFT, padx=5)
+        
+        self.background_save = tk.BooleanVar(value=False)
+        ttk.Checkbutton(save_frame, text="后台保存", variable=self.background_save).pack(side=tk.LEFT, padx=5)
+        
+        self.append_output = tk.BooleanVar(value=False)
+        ttk.Checkbutton(save_frame, text="追加到已有文件", variable=self.append_output).pack(side=tk.LEFT, padx=5)
+        
+        self.auto_tune = tk.BooleanVar(value=False)
+        ttk.Checkbutton(save_frame, text="自动选择处理方式", variable=self.auto_tune).pack(side=tk.LEFT, padx=5)
+        
+        self.resumable = tk.BooleanVar(value=False)
+        ttk.Checkbutton(save_frame, text="断点续传", variable=self.resumable).pack(side=tk.LEFT, padx=5)
     
     def add_a_file(self):
         """添加日报表文件到列表"""
@@ -764,12 +1043,13 @@ class ExcelProcessorUI:
             self.files_tree.insert("", "end", values=(i+1, file_path, sheet_name or "默认"))
     
     def browse_b_file(self):
-        filename = filedialog.askopenfilename(
+        # 可以同时选择多个分店的患者库
+        filenames = filedialog.askopenfilenames(
             title="选择患者库文件",
-            filetypes=[("Excel文件", "*.xlsx *.xls"), ("所有文件", "*.*")]
+            filetypes=[("Excel文件", "*.xlsx *.xls"), ("患者库数据库", "*.sqlite3 *.db"), ("所有文件", "*.*")]
         )
-        if filename:
-            self.b_file_path.set(filename)
+        if filenames:
+            self.b_file_path.set(";".join(filenames))
     
     def browse_output_folder(self):
         folder = filedialog.askdirectory(
@@ -788,9 +1068,97 @@ class ExcelProcessorUI:
         self.output_folder_path.set(os.getcwd())
     
     def process_data(self):
+        params = self.collect_params()
+        if params is None:
+            return
+        
+        # 相同的任务已在队列中时（例如重复点击），确认后才再次提交
+        active_job = self.job_queue.find_active(params)
+        if active_job is not None:
+            if not messagebox.askyesno("提示", f"相同的任务 #{active_job.id} 正在{active_job.status_label}，是否仍要再次提交?"):
+                return
+        
+        # 提交到任务队列，由工作线程处理，避免界面卡死
+        job_name = f"{len(params['file_a_paths'])}个日报表 → {os.path.basename(params['output_path'])}"
+        job = self.job_queue.submit(job_name, params)
+        self.status_var.set(f"已提交任务 #{job.id}，当前有 {self.job_queue.pending_count()} 个任务未完成")
+        
+        # 实时结果表切换到新提交的任务
+        self.live_job_id = job.id
+        self.live_table.clear()
+        self.live_count_var.set(f"任务 #{job.id}: 等待匹配行...")
+    
+    def on_job_rows(self, job, header, rows):
+        """任务找到一批匹配行时追加到实时结果表（在主线程中调用）"""
+        if job.id != self.live_job_id:
+            return
+        self.live_table.set_columns(header)
+        self.live_table.append_rows(rows)
+        self.live_count_var.set(f"任务 #{job.id}: 已找到 {len(self.live_table.rows)} 行")
+    
+    def preview_data(self):
+        """预览匹配情况：只扫描比较列，统计每个文件的匹配行数，不生成结果文件"""
+        params = self.collect_params(require_output=False)
+        if params is None:
+            return
+        
+        self.status_var.set("正在预览...")
+        
+        def run_preview():
+            try:
+                # 与任务队列共用患者库索引，预览后正式处理时无需重新读取患者库
+                result = process_excel_files(
+                    preview=True, preview_rows=PREVIEW_ROWS,
+                    b_index_cache=self.job_queue.b_index_cache, **params
+                )
+                self.root.after(0, self.show_preview, result)
+            except Exception as e:
+                self.root.after(0, self.show_preview_error, str(e))
+        
+        threading.Thread(target=run_preview, daemon=True).start()
+    
+    def show_preview(self, result):
+        """显示预览结果"""
+        lines = [f"预览: 共 {len(result['files'])} 个文件，预计匹配 {result['total_matches']} 行"]
+        for item in result["files"]:
+            file_name = os.path.basename(item["path"])
+            if item["error"]:
+                lines.append(f"  {file_name}: {item['error']}")
+            else:
+                lines.append(f"  {file_name} [{item['sheet']}]: 共 {item['rows']} 行，匹配 {item['matches']} 行")
+        
+        if result["rows"]:
+            lines.append(f"\n前 {len(result['rows'])} 条匹配行:")
+            multi_library = any(row["libraries"] for row in result["rows"])
+            header = list(result["header"]) + (["匹配患者库"] if multi_library else [])
+            lines.append("\t".join("" if value is None else str(value) for value in header))
+            for row in result["rows"]:
+                values = list(row["values"]) + ([row["libraries"]] if multi_library else [])
+                lines.append("\t".join("" if value is None else str(value) for value in values))
+        
+        self.status_var.set(f"预览完成，预计匹配 {result['total_matches']} 行")
+        self.result_text.insert(tk.END, "\n".join(lines) + "\n\n")
+        self.result_text.see(tk.END)
+    
+    def show_preview_error(self, error):
+        """显示预览失败的原因"""
+        self.status_var.set("预览失败")
+        self.result_text.insert(tk.END, f"预览过程中出错:\n{error}\n\n")
+        messagebox.showerror("错误", f"预览过程中出错:\n{error}")
+    
+    def collect_params(self, require_output=True):
+        """
+        从界面收集并检查处理参数
+        
+        参数:
+            require_output: 是否检查输出设置，预览时不需要
+            
+        返回:
+            传给process_excel_files的参数字典，参数有误时提示用户并返回None
+        """
         # 获取参数
         a_files = self.a_files
-        b_file = self.b_file_path.get().strip()
+        b_files = [path.strip() for path in self.b_file_path.get().replace("；", ";").split(";") if path.strip()]
         output_folder = self.output_folder_path.get().strip()
         output_filename = self.output_file_name.get().strip()
         output_file = os.path.join(output_folder, output_filename)
@@ -820,23 +1188,25 @@ class ExcelProcessorUI:
                 messagebox.showerror("错误", f"日报表文件不存在: {file_path}")
                 return
             
-        if not b_file:
+        if not b_files:
             messagebox.showerror("错误", "请选择患者库文件")
             return
-        if not os.path.exists(b_file):
-            messagebox.showerror("错误", f"患者库文件不存在: {b_file}")
-            return
-            
-        if not output_folder:
-            messagebox.showerror("错误", "请选择输出文件夹")
-            return
-        if not os.path.exists(output_folder):
-            messagebox.showerror("错误", f"输出文件夹不存在: {output_folder}")
-            return
+        for b_file in b_files:
+            if not os.path.exists(b_file):
+                messagebox.showerror("错误", f"患者库文件不存在: {b_file}")
+                return
             
-        if not output_filename:
-            messagebox.showerror("错误", "请指定输出文件名")
-            return
+        if require_output:
+            if not output_folder:
+                messagebox.showerror("错误", "请选择输出文件夹")
+                return
+            if not os.path.exists(output_folder):
+                messagebox.showerror("错误", f"输出文件夹不存在: {output_folder}")
+                return
+                
+            if not output_filename:
+                messagebox.showerror("错误", "请指定输出文件名")
+                return
         
         if not output_filename.lower().endswith('.xlsx'):
             output_file = output_file + '.xlsx'
@@ -849,47 +1219,118 @@ class ExcelProcessorUI:
             messagebox.showerror("错误", "请指定患者库的比较列")
             return
         
-        # 清空结果
-        self.result_text.delete(1.0, tk.END)
-        self.status_var.set("正在处理数据...")
+        # 收集可选的处理参数
+        options = {}
+        if self.fuzzy_match.get():
+            try:
+                fuzzy_threshold = int(self.fuzzy_threshold.get().strip())
+            except ValueError:
+                messagebox.showerror("错误", "最大编辑距离必须是整数")
+                return
+            options["fuzzy_match"] = True
+            options["fuzzy_threshold"] = fuzzy_threshold
+        
+        if self.output_unmatched.get() or self.output_coverage.get() or self.output_summary.get():
+            outputs = ["matched"]
+            if self.output_unmatched.get():
+                outputs.append("unmatched")
+            if self.output_coverage.get():
+                outputs.append("coverage")
+            if self.output_summary.get():
+                outputs.append("summary")
+                summary_columns = [col.strip() for col in self.summary_columns.get().replace("，", ",").split(",") if col.strip()]
+                options["summary_columns"] = summary_columns or None
+            options["outputs"] = outputs
+        
+        if self.dedup.get():
+            options["dedup"] = True
+            dedup_columns = [col.strip() for col in self.dedup_columns.get().replace("，", ",").split(",") if col.strip()]
+            options["dedup_columns"] = dedup_columns or None
+            options["dedup_keep"] = "last" if self.dedup_keep.get() == "保留最后一条" else "first"
+        
+        output_columns = [col.strip() for col in self.output_columns.get().replace("，", ",").split(",") if col.strip()]
+        if output_columns:
+            options["output_columns"] = output_columns
+        
+        b_columns = [col.strip() for col in self.b_extra_columns.get().replace("，", ",").split(",") if col.strip()]
+        if b_columns:
+            options["b_columns"] = b_columns
+            options["b_duplicate"] = B_DUPLICATE_POLICIES[self.b_duplicate.get()]
+        
+        save_options = {}
+        compression = SAVE_COMPRESSION_LEVELS.get(self.save_compression.get())
+        if compression is not None:
+            save_options["compression"] = compression
+        if self.background_save.get():
+            save_options["background"] = True
+        if save_options:
+            options["save_options"] = save_options
+        
+        if self.append_output.get():
+            if "outputs" in options:
+                messagebox.showerror("错误", "追加到已有文件时只能输出匹配行，请取消附加输出和汇总统计")
+                return
+            options["append"] = True
+        
+        if self.auto_tune.get():
+            options["auto"] = True
+        
+        if self.resumable.get():
+            # 任务目录放在输出文件旁边，同一输出文件名的任务中断后重新运行即可继续
+            options["job_dir"] = os.path.splitext(output_file)[0] + "_任务进度"
         
         # 提取A表文件路径列表
         a_file_paths = [file_path for file_path, _ in a_files]
         
-        # 使用线程进行处理，避免界面卡死
-        thread = threading.Thread(target=self.do_process, args=(
-            a_file_paths, b_file, output_file, a_col, b_col, default_sheet_a, b_sheet, output_sheet, sheet_a_map
-        ))
-        thread.daemon = True
-        thread.start()
+        return dict(
+            file_a_paths=a_file_paths, file_b_path=b_files if len(b_files) > 1 else b_files[0], output_path=output_file,
+            col_x=a_col, col_y=b_col, sheet_a=default_sheet_a, sheet_b=b_sheet,
+            output_sheet=output_sheet, sheet_a_map=sheet_a_map, **options
+        )
     
-    def do_process(self, a_files, b_file, output_file, a_col, b_col, default_sheet_a, b_sheet, output_sheet, sheet_a_map):
-        try:
-            # 执行处理
-            count, saved_path = process_excel_files(
-                a_files, b_file, output_file, a_col, b_col,
-                sheet_a=default_sheet_a, sheet_b=b_sheet, 
-                output_sheet=output_sheet, sheet_a_map=sheet_a_map
-            )
+    def on_job_update(self, job):
+        """任务状态变化时更新任务列表和结果显示（在主线程中调用）"""
+        duration = f"{job.duration:.1f}秒" if job.duration is not None else ""
+        values = (job.id, job.name, job.status_label, job.count if job.status == JOB_DONE else "", duration)
+        item_id = f"job_{job.id}"
+        if self.jobs_tree.exists(item_id):
+            self.jobs_tree.item(item_id, values=values)
+        else:
+            self.jobs_tree.insert("", "end", iid=item_id, values=values)
+        
+        if job.status == JOB_SAVING:
+            self.status_var.set(f"任务 #{job.id} 找到 {job.count} 行匹配数据，正在后台保存...")
+        elif job.status == JOB_DONE:
+            self.show_job_result(job)
+        elif job.status == JOB_FAILED:
+            error_message = f"任务 #{job.id} 处理过程中出错:\n{job.error}"
+            self.status_var.set("处理失败")
+            self.result_text.insert(tk.END, error_message + "\n\n")
+            messagebox.showerror("错误", error_message)
+    
+    def show_job_result(self, job):
+        """显示已完成任务的处理结果"""
+        count, saved_path = job.count, job.saved_path
+        file_errors = job.stats.get("file_errors")
+        if file_errors:
+            lines = [f"  {os.path.basename(error['file'])}（{error['stage']}）: {error['error']}" for error in file_errors]
+            self.result_text.insert(tk.END, f"任务 #{job.id}: {len(file_errors)} 个文件处理失败:\n" + "\n".join(lines) + "\n\n")
+        if count > 0 and saved_path:
+            self.status_var.set(f"任务 #{job.id} 处理完成，找到 {count} 行匹配数据")
+            result_message = f"任务 #{job.id} 处理成功！\n\n共处理了 {len(job.params['file_a_paths'])} 个文件，找到 {count} 行匹配的数据。\n\n结果已保存到文件:\n{saved_path}"
+            if "duplicates_dropped" in job.stats:
+                result_message += f"\n\n去重删除了 {job.stats['duplicates_dropped']} 行重复数据。"
+            if "save_time" in job.stats:
+                result_message += f"\n\n保存文件耗时 {job.stats['save_time']:.1f} 秒。"
+            self.result_text.insert(tk.END, result_message + "\n\n")
             
-            # 更新结果
-            if count > 0 and saved_path:
-                self.root.after(0, lambda: self.status_var.set(f"处理完成，找到 {count} 行匹配数据"))
-                result_message = f"处理成功！\n\n共处理了 {len(a_files)} 个文件，找到 {count} 行匹配的数据。\n\n结果已保存到文件:\n{saved_path}"
-                self.root.after(0, lambda: self.result_text.insert(tk.END, result_message))
-                
-                # 询问是否打开文件
-                if messagebox.askyesno("处理完成", f"找到 {count} 行匹配数据，已保存到\n{saved_path}\n\n是否打开此文件?"):
-                    # 使用全局函数打开文件
-                    open_file(saved_path)
-            else:
-                self.root.after(0, lambda: self.status_var.set("处理未完成"))
-                self.root.after(0, lambda: self.result_text.insert(tk.END, "未找到匹配的数据或保存文件失败。"))
-        except Exception as e:
-            error_message = f"处理过程中出错:\n{str(e)}"
-            self.root.after(0, lambda: self.status_var.set("处理失败"))
-            self.root.after(0, lambda: self.result_text.insert(tk.END, error_message))
-            self.root.after(0, lambda: messagebox.showerror("错误", error_message))
+            # 询问是否打开文件
+            if messagebox.askyesno("处理完成", f"找到 {count} 行匹配数据，已保存到\n{saved_path}\n\n是否打开此文件?"):
+                # 使用全局函数打开文件
+                open_file(saved_path)
+        else:
+            self.status_var.set(f"任务 #{job.id} 处理未完成")
+            self.result_text.insert(tk.END, f"任务 #{job.id}: 未找到匹配的数据或保存文件失败。\n\n")
 
 def open_file(file_path):
     """跨平台打开文件的函数"""
@@ -0,0 +1,354 @@
+import os
+import threading
+import time
+import itertools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from excel_processor import BIndexCache, load_b_values
+from key_index import SharedKeyIndex
+from library_store import is_library_store
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SAVING = "saving"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# 任务状态在界面上显示的名称
+JOB_STATUS_LABELS = {
+    JOB_QUEUED: "排队中",
+    JOB_RUNNING: "运行中",
+    JOB_SAVING: "保存中",
+    JOB_DONE: "已完成",
+    JOB_FAILED: "失败",
+}
+
+def job_signature(params):
+    """任务参数的签名，用于识别重复提交的相同任务"""
+    return repr(sorted((key, repr(value)) for key, value in params.items()))
+
+def run_job_in_process(process_func, params):
+    """
+    在工作进程中执行一个任务，返回(匹配行数, 保存的文件路径, 统计信息)
+
+    统计信息需要传回主进程，后台保存的Future不能跨进程传递，因此在工作进程中等待保存完成。
+    """
+    stats = {}
+    count, saved_path = process_func(stats=stats, **params)
+    pending = stats.pop("pending_save", None)
+    if pending is not None:
+        saved_path = pending.result()
+        if saved_path is None:
+            count = 0
+    return count, saved_path, stats
+
+class SharedBIndexPool:
+    """
+    进程模式下各患者库的共享内存B表索引
+
+    使用同一个患者库的任务只在一个工作进程中读取一次B表，键值放入共享内存（SharedKeyIndex）后
+    作为b_index参数传给各任务的工作进程，工作进程直接挂载同一块内存，不再各自读取B表、建立索引。
+    以(文件路径, 修改时间, 文件大小, 工作表, 列)为键，患者库文件被修改后重新建立；
+    超过max_entries个时关闭最早使用且没有任务在用的索引。
+    """
+
+    def __init__(self, max_entries=4):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._building = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def shareable(params):
+        """
+        任务是否可以使用共享索引：单个Excel患者库，且不需要补充B表列
+        （多个患者库需要位掩码，补充列需要整行数据，患者库数据库本身已是磁盘上的索引）
+        """
+        file_b_path = params.get("file_b_path")
+        return (isinstance(file_b_path, str) and params.get("b_index") is None and not params.get("b_columns")
+                and os.path.exists(file_b_path) and not is_library_store(file_b_path))
+
+    @staticmethod
+    def _sheet_and_column(params):
+        """患者库使用的工作表和比较列，与流水线一样优先使用sheet_b_map、col_y_map中为该患者库单独设置的值"""
+        file_b_path = params["file_b_path"]
+        sheet_b = (params.get("sheet_b_map") or {}).get(file_b_path, params.get("sheet_b"))
+        col_y = (params.get("col_y_map") or {}).get(file_b_path, params.get("col_y", "A"))
+        return sheet_b, col_y
+
+    @classmethod
+    def _make_key(cls, params):
+        file_b_path = params["file_b_path"]
+        stat = os.stat(file_b_path)
+        sheet_b, col_y = cls._sheet_and_column(params)
+        # 比较列可以是表头名称，表头名称区分大小写，不做大小写转换
+        return (os.path.abspath(file_b_path), stat.st_mtime_ns, stat.st_size, sheet_b or None, str(col_y).strip())
+
+    def acquire(self, params, load):
+        """
+        获取任务使用的共享索引，用完后调用release
+
+        参数:
+            params: 任务参数
+            load: 读取B表键值的函数，参数为(file_b_path, sheet_b, col_y, read_only)，通常在工作进程中执行
+        """
+        key = self._make_key(params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[1] += 1
+                # 移到末尾，保持最近使用的顺序
+                self._entries[key] = self._entries.pop(key)
+                return entry[0]
+            build_lock = self._building.setdefault(key, threading.Lock())
+
+        with build_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry[1] += 1
+                    return entry[0]
+            sheet_b, col_y = self._sheet_and_column(params)
+            try:
+                b_values = load(params["file_b_path"], sheet_b, col_y, params.get("b_read_only", False))
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+            index = SharedKeyIndex.create(b_values)
+            with self._lock:
+                self._entries[key] = [index, 1]
+                self._evict()
+            return index
+
+    def release(self, index):
+        """任务结束，不再使用该索引"""
+        with self._lock:
+            for entry in self._entries.values():
+                if entry[0] is index:
+                    entry[1] -= 1
+                    break
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            for key, (index, users) in self._entries.items():
+                if users == 0:
+                    break
+            else:
+                return
+            del self._entries[key]
+            index.close()
+
+    def close(self):
+        """删除所有共享内存"""
+        with self._lock:
+            for index, _ in self._entries.values():
+                index.close()
+            self._entries.clear()
+
+class Job:
+    """队列中的一个处理任务"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name, params):
+        """
+        参数:
+            name: 任务名称，用于在界面上显示
+            params: 传给process_excel_files的参数字典
+        """
+        self.id = next(Job._ids)
+        self.name = name
+        self.params = params
+        self.status = JOB_QUEUED
+        self.count = 0
+        self.saved_path = None
+        self.error = None
+        self.stats = {}
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def status_label(self):
+        return JOB_STATUS_LABELS.get(self.status, self.status)
+
+    @property
+    def duration(self):
+        """任务运行耗时（秒），尚未开始时为None"""
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+class JobQueue:
+    """
+    有上限的任务队列
+
+    任务提交后进入排队状态，由固定数量的工作线程依次执行；
+    所有任务共享同一个BIndexCache，使用同一患者库的任务无需重复建立B表索引。
+    使用后台保存的任务在开始保存后进入保存中状态并让出工作线程，下一个任务可以同时开始处理。
+
+    openpyxl解析工作簿时持有GIL，多个工作线程中的任务实际上轮流占用一个CPU核心。
+    use_processes为True时每个任务在进程池的工作进程中执行，多个任务可以同时使用多个CPU核心；
+    此时任务参数必须可以pickle，不支持on_rows回调。BIndexCache不能跨进程共享，
+    改为由SharedBIndexPool把患者库的键值放在共享内存中，各工作进程挂载同一份索引。
+    """
+
+    def __init__(self, process_func, max_workers=2, on_update=None, b_index_cache=None, on_rows=None,
+                 use_processes=False):
+        """
+        参数:
+            process_func: 实际执行处理的函数，通常为process_excel_files
+            max_workers: 同时运行的最大任务数
+            on_update: 任务状态变化时的回调函数，参数为Job对象，在工作线程中调用
+            b_index_cache: 共享的B表索引缓存，默认新建一个
+            on_rows: 任务找到匹配行时的回调函数，参数为(Job对象, 表头, 匹配行列表)，在工作线程中调用
+            use_processes: 是否在工作进程中执行任务，process_func必须是模块级函数
+        """
+        if use_processes and on_rows is not None:
+            raise ValueError("在工作进程中执行任务时不支持on_rows回调")
+        self.process_func = process_func
+        self.max_workers = max_workers
+        self.on_update = on_update
+        self.on_rows = on_rows
+        self.b_index_cache = b_index_cache if b_index_cache is not None else BIndexCache()
+        self.jobs = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="excel-job")
+        # 工作线程负责排队和更新状态，实际处理交给同样数量的工作进程，任务开始运行时总有空闲的进程
+        self._process_pool = ProcessPoolExecutor(max_workers=max_workers) if use_processes else None
+        self.shared_indexes = SharedBIndexPool() if use_processes else None
+
+    def submit(self, name, params):
+        """提交一个任务，返回Job对象"""
+        job = Job(name, params)
+        with self._lock:
+            self.jobs.append(job)
+        self._notify(job)
+        self._executor.submit(self._run, job)
+        return job
+
+    def find_active(self, params):
+        """查找参数完全相同且尚未结束的任务"""
+        signature = job_signature(params)
+        with self._lock:
+            for job in self.jobs:
+                if job.status in (JOB_QUEUED, JOB_RUNNING, JOB_SAVING) and job_signature(job.params) == signature:
+                    return job
+        return None
+
+    def get(self, job_id):
+        """根据编号获取任务"""
+        with self._lock:
+            for job in self.jobs:
+                if job.id == job_id:
+                    return job
+        return None
+
+    def list_jobs(self):
+        """所有任务的列表副本，工作线程可能同时在修改任务列表"""
+        with self._lock:
+            return list(self.jobs)
+
+    def pending_count(self):
+        """排队中、运行中和保存中的任务数量"""
+        with self._lock:
+            return sum(1 for job in self.jobs if job.status in (JOB_QUEUED, JOB_RUNNING, JOB_SAVING))
+
+    def clear_finished(self, finished_before=None):
+        """
+        从列表中移除已结束的任务
+
+        参数:
+            finished_before: 只移除在该时间（time.time()）之前结束的任务，默认移除所有已结束的任务
+
+        返回:
+            移除的任务列表
+        """
+        with self._lock:
+            kept, removed = [], []
+            for job in self.jobs:
+                finished = job.status not in (JOB_QUEUED, JOB_RUNNING, JOB_SAVING)
+                if finished and (finished_before is None or (job.finished_at or 0) < finished_before):
+                    removed.append(job)
+                else:
+                    kept.append(job)
+            self.jobs = kept
+        return removed
+
+    def shutdown(self, wait=False):
+        """关闭工作线程池和进程池"""
+        self._executor.shutdown(wait=wait)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=wait)
+            self.shared_indexes.close()
+
+    def _run(self, job):
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        self._notify(job)
+        extra = {}
+        if self.on_rows is not None:
+            extra["row_callback"] = lambda header, rows: self.on_rows(job, header, rows)
+        try:
+            if self._process_pool is not None:
+                job.count, job.saved_path, stats = self._run_in_process(job)
+                job.stats.update(stats)
+            else:
+                job.count, job.saved_path = self.process_func(
+                    stats=job.stats, b_index_cache=self.b_index_cache, **extra, **job.params
+                )
+                pending = job.stats.get("pending_save")
+                if pending is not None:
+                    job.status = JOB_SAVING
+                    self._notify(job)
+                    pending.add_done_callback(lambda future: self._finish_save(job, future))
+                    return
+            job.status = JOB_DONE
+        except Exception as e:
+            job.error = str(e)
+            job.status = JOB_FAILED
+        job.finished_at = time.time()
+        self._notify(job)
+
+    def _run_in_process(self, job):
+        """在工作进程中执行任务，可以共享B表索引时传入共享内存索引"""
+        params = job.params
+        b_index = None
+        if SharedBIndexPool.shareable(params):
+            try:
+                b_index = self.shared_indexes.acquire(params, self._load_b_values)
+                params = dict(params, b_index=b_index)
+            except Exception as e:
+                # 读取失败时由任务自己读取B表并按原来的方式报告错误
+                print(f"建立共享B表索引失败，任务单独读取B表: {str(e)}")
+        try:
+            return self._process_pool.submit(run_job_in_process, self.process_func, params).result()
+        finally:
+            if b_index is not None:
+                self.shared_indexes.release(b_index)
+
+    def _load_b_values(self, file_b_path, sheet_b, col_y, read_only):
+        # 在工作进程中读取B表，只把键值传回主进程，主进程的HTTP请求不会被B表解析阻塞
+        return self._process_pool.submit(load_b_values, file_b_path, sheet_b, col_y, read_only).result()
+
+    def _finish_save(self, job, future):
+        """后台保存结束时更新任务状态，在保存线程中调用"""
+        try:
+            job.saved_path = future.result()
+            if job.saved_path is None:
+                job.count = 0
+            job.status = JOB_DONE
+        except Exception as e:
+            job.error = f"保存文件失败: {str(e)}"
+            job.status = JOB_FAILED
+        job.finished_at = time.time()
+        self._notify(job)
+
+    def _notify(self, job):
+        if self.on_update is not None:
+            try:
+                self.on_update(job)
+            except Exception as e:
+                print(f"任务状态回调出错: {str(e)}")
@@ -0,0 +1,278 @@
+"""
+B表键值索引的紧凑存储格式
+
+索引由一块连续内存组成，可以放在multiprocessing.shared_memory中，
+多个工作进程直接挂载同一块内存，不需要各自重建或反序列化一份b_values集合（见job_queue的进程模式）。
+
+内存布局（小端序）:
+    头部    MAGIC(8字节) + 键数量(uint64) + 字符串区长度(uint64)
+    哈希区  uint64[键数量]，已排序的64位键哈希
+    偏移区  uint64[键数量+1]，每个键在字符串区中的起止位置（与哈希区顺序一致）
+    字符串区 所有键的UTF-8编码依次拼接
+
+成员判断先在哈希区二分查找，再比较字符串区中的原始键，排除哈希碰撞。
+HashedKeyIndex使用同样的布局作为进程内的紧凑索引，每个键约占16字节加上键本身的UTF-8长度，
+远小于Python字符串集合每个键70-100字节的开销。
+"""
+
+import struct
+import hashlib
+
+import numpy as np
+from multiprocessing import shared_memory
+
+MAGIC = b"BKIDX001"
+HEADER = struct.Struct("<8sQQ")
+
+def key_hash(key):
+    """计算键的64位哈希"""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+def hash_keys(keys):
+    """计算一组键的64位哈希，返回uint64数组（与key_hash结果一致）"""
+    return _hash_encoded([key.encode("utf-8") for key in keys])
+
+def _hash_encoded(encoded):
+    # 拼接摘要后一次转换为数组，避免逐个创建64位Python整数
+    digests = b"".join([hashlib.blake2b(data, digest_size=8).digest() for data in encoded])
+    return np.frombuffer(digests, dtype="<u8").astype(np.uint64)
+
+def encode_index(keys):
+    """
+    将键集合编码为索引的二进制格式
+
+    参数:
+        keys: 键的可迭代对象，会先转换为字符串并去重
+
+    返回:
+        bytes，可直接写入共享内存或文件
+    """
+    return _encode_sorted(list(dict.fromkeys(str(key) for key in keys)))[0]
+
+def _encode_sorted(unique_keys):
+    """
+    编码不含重复的键列表
+
+    返回:
+        (索引数据, 排序后每个位置对应的原列表下标)
+    """
+    encoded = [key.encode("utf-8") for key in unique_keys]
+    hashes = _hash_encoded(encoded)
+
+    order = np.argsort(hashes, kind="stable")
+    hashes = hashes[order]
+    lengths = np.fromiter(map(len, encoded), dtype=np.uint64, count=len(encoded))[order]
+    offsets = np.zeros(len(order) + 1, dtype=np.uint64)
+    np.cumsum(lengths, out=offsets[1:])
+    blob = b"".join([encoded[i] for i in order.tolist()])
+
+    data = b"".join([
+        HEADER.pack(MAGIC, len(order), len(blob)),
+        hashes.astype("<u8").tobytes(),
+        offsets.astype("<u8").tobytes(),
+        blob,
+    ])
+    return data, order
+
+def encoded_size(buffer):
+    """根据头部计算索引实际占用的字节数（共享内存块可能按页大小向上取整）"""
+    magic, count, blob_size = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("不是有效的B表索引数据")
+    return HEADER.size + 8 * count + 8 * (count + 1) + blob_size
+
+class KeyIndexView:
+    """
+    在一块现有内存上只读访问索引，不复制数据
+
+    支持 `key in index`、len(index) 和遍历所有键，可以直接替代process_excel_files中的b_values集合。
+    contains_batch一次查找一整列键，哈希区的二分查找由np.searchsorted批量完成。
+    """
+
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer)
+        magic, count, blob_size = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("不是有效的B表索引数据")
+        self.count = count
+        hashes_start = HEADER.size
+        offsets_start = hashes_start + 8 * count
+        blob_start = offsets_start + 8 * (count + 1)
+        self.hashes = np.frombuffer(self._buffer, dtype="<u8", count=count, offset=hashes_start)
+        self.offsets = np.frombuffer(self._buffer, dtype="<u8", count=count + 1, offset=offsets_start)
+        self.blob = self._buffer[blob_start:blob_start + blob_size]
+
+    def _key_at(self, position):
+        return bytes(self.blob[int(self.offsets[position]):int(self.offsets[position + 1])])
+
+    def _find(self, key, target, position):
+        """从哈希区的position处开始查找键，返回位置，不存在时返回-1"""
+        encoded = key.encode("utf-8")
+        # 相同哈希的键连续存放，逐个比较原始键
+        while position < self.count and int(self.hashes[position]) == target:
+            if self._key_at(position) == encoded:
+                return position
+            position += 1
+        return -1
+
+    def find(self, key):
+        """返回键在索引中的位置，不存在时返回-1"""
+        if not isinstance(key, str):
+            key = str(key)
+        target = key_hash(key)
+        # 用np.uint64比较，Python整数超过int64范围时numpy会转换整个哈希数组
+        return self._find(key, target, int(np.searchsorted(self.hashes, np.uint64(target), side="left")))
+
+    def find_batch(self, keys):
+        """
+        批量查找一组字符串键
+
+        返回:
+            int64数组，每个键在索引中的位置，不存在时为-1
+        """
+        positions = np.full(len(keys), -1, dtype=np.int64)
+        if not keys or self.count == 0:
+            return positions
+        encoded = [key.encode("utf-8") for key in keys]
+        targets = _hash_encoded(encoded)
+        # 先排序再查找，二分查找的内存访问更连续
+        probe_order = np.argsort(targets, kind="stable")
+        starts = np.empty(len(keys), dtype=np.int64)
+        starts[probe_order] = np.searchsorted(self.hashes, targets[probe_order], side="left")
+        # 只有哈希命中的键才需要比较原始键
+        candidates = np.flatnonzero(self.hashes[np.minimum(starts, self.count - 1)] == targets)
+        candidate_starts = starts[candidates]
+        begins = self.offsets[candidate_starts].tolist()
+        ends = self.offsets[candidate_starts + 1].tolist()
+        blob = self.blob
+        for i, position, begin, end in zip(candidates.tolist(), candidate_starts.tolist(), begins, ends):
+            if blob[begin:end] == encoded[i]:
+                positions[i] = position
+            else:
+                # 哈希碰撞：继续比较相同哈希的后续键
+                positions[i] = self._find(keys[i], int(targets[i]), position + 1)
+        return positions
+
+    def contains_batch(self, keys):
+        """批量成员判断，返回bool数组"""
+        return self.find_batch(keys) >= 0
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield self._key_at(position).decode("utf-8")
+
+    def release(self):
+        """释放对底层内存的引用，关闭共享内存或文件映射前必须调用"""
+        if self._buffer is None:
+            return
+        self.hashes = None
+        self.offsets = None
+        self.blob.release()
+        self._buffer.release()
+        self._buffer = None
+
+class HashedKeyIndex(KeyIndexView):
+    """
+    进程内的紧凑B表索引，可以代替load_b_values返回的字典
+
+    可选的values为与键一一对应的非负整数（例如多个患者库的位掩码），用get(key)读取。
+    遍历时按键的原始顺序返回（与load_b_values的字典一致），为此额外保存每个键4字节的位置。
+    """
+
+    def __init__(self, keys, values=None):
+        """
+        参数:
+            keys: 键的可迭代对象；提供values时键不能重复（例如字典的keys()）
+            values: 与keys顺序一致的非负整数序列
+        """
+        if values is None:
+            data, order = _encode_sorted(list(dict.fromkeys(str(key) for key in keys)))
+            self.values = None
+        else:
+            data, order = _encode_sorted([str(key) for key in keys])
+            self.values = np.fromiter(values, dtype=np.uint64, count=len(order))[order]
+        # 原始顺序中第i个键在哈希区中的位置
+        self.positions = np.empty(len(order), dtype=np.uint32)
+        self.positions[order] = np.arange(len(order), dtype=np.uint32)
+        super().__init__(data)
+
+    def __iter__(self):
+        for position in self.positions.tolist():
+            yield self._key_at(position).decode("utf-8")
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """根据键 -> 整数的字典建立索引"""
+        return cls(mapping.keys(), mapping.values())
+
+    def get(self, key, default=None):
+        """读取键对应的整数值，键不存在时返回default"""
+        position = self.find(key)
+        if position < 0:
+            return default
+        return int(self.values[position]) if self.values is not None else None
+
+    @property
+    def nbytes(self):
+        """索引占用的字节数"""
+        size = len(self._buffer) + self.positions.nbytes
+        if self.values is not None:
+            size += self.values.nbytes
+        return size
+
+class SharedKeyIndex(KeyIndexView):
+    """
+    存放在multiprocessing.shared_memory中的B表索引
+
+    主进程用create()建立索引，工作进程用attach(name)挂载同一块内存。
+    该对象被pickle传给子进程时只传递共享内存名称，子进程会自动挂载而不是复制数据。
+    """
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        super().__init__(shm.buf[:encoded_size(shm.buf)])
+
+    @classmethod
+    def create(cls, keys, name=None):
+        """根据键集合创建共享内存索引"""
+        data = encode_index(keys)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=max(len(data), 1))
+        shm.buf[:len(data)] = data
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """挂载已存在的共享内存索引"""
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python 3.13之前不支持track参数；由创建者启动的子进程共用同一个资源跟踪进程，
+            # 不会在子进程退出时删除共享内存
+            shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __reduce__(self):
+        return (SharedKeyIndex.attach, (self.shm.name,))
+
+    def __del__(self):
+        # 先释放对共享内存的引用，否则SharedMemory被回收时无法关闭
+        if self._buffer is not None:
+            self.release()
+
+    def close(self):
+        """关闭当前进程对共享内存的访问；创建者同时删除共享内存"""
+        self.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+患者库数据库
+把患者库工作簿导入本地SQLite数据库（比较列建有索引，并保存完整的行），
+之后process_excel_files可以直接用数据库文件作为file_b_path，
+只在患者库更新后解析一次Excel，而不是每次运行都重新解析。
+
+数据库记录了源工作簿的路径、修改时间和大小，使用时发现源工作簿有变化会自动重新导入。
+
+命令:
+    python library_store.py import 患者库.xlsx --db 患者库.sqlite3 [--sheet 工作表] [--col A]
+    python library_store.py refresh --db 患者库.sqlite3    源工作簿有变化时重新导入
+    python library_store.py info --db 患者库.sqlite3
+"""
+
+import os
+import json
+import time
+import sqlite3
+import argparse
+from contextlib import closing, contextmanager
+
+import openpyxl
+
+from excel_processor import BRowMap, resolve_column, resolve_columns, convert_xls_to_xlsx
+
+# SQLite数据库文件的头部
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+# 每批写入的行数
+INSERT_BATCH_SIZE = 5000
+
+# 每次查询的键数量上限（SQLite对参数个数有限制）
+LOOKUP_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS patients (
+    row_idx INTEGER PRIMARY KEY,
+    key TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_patients_key ON patients(key);
+"""
+
+def is_library_store(path):
+    """判断路径是否为患者库数据库（按SQLite文件头判断）"""
+    if not isinstance(path, str):
+        return False
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+    except OSError:
+        return False
+
+class LibraryStore:
+    """一个患者库的SQLite数据库"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # sqlite3连接的with语句只提交或回滚事务，不会关闭连接，因此用closing在每次使用后关闭
+        with closing(sqlite3.connect(self.db_path, timeout=30)) as conn:
+            with conn:
+                yield conn
+
+    def meta(self):
+        """导入信息：源文件路径、工作表、比较列、源文件修改时间和大小、表头、行数、导入时间"""
+        with self._connect() as conn:
+            return {name: json.loads(value) for name, value in conn.execute("SELECT name, value FROM meta")}
+
+    def import_workbook(self, source_path, sheet=None, col="A"):
+        """
+        从患者库工作簿导入，替换数据库中原有的数据
+
+        参数:
+            source_path: 患者库工作簿路径（.xlsx或.xls）
+            sheet: 工作表名称，默认为活动表
+            col: 比较列的列名、列号或表头名称
+
+        返回:
+            导入的行数
+        """
+        source_path = os.path.abspath(source_path)
+        stat = os.stat(source_path)
+
+        converted_file = None
+        workbook_path = source_path
+        if os.path.splitext(source_path)[1].lower() == ".xls":
+            converted_file = convert_xls_to_xlsx(source_path)
+            if converted_file:
+                workbook_path = converted_file
+
+        started = time.perf_counter()
+        try:
+            wb = openpyxl.load_workbook(workbook_path, read_only=True, data_only=True)
+            try:
+                ws = wb[sheet] if sheet and sheet in wb.sheetnames else wb.active
+                header = None
+                row_count = 0
+                with self._connect() as conn:
+                    # 在同一个事务中替换，导入失败时保留原有数据
+                    conn.execute("DELETE FROM patients")
+                    batch = []
+                    for row_idx, values in enumerate(ws.iter_rows(values_only=True), 1):
+                        values = list(values)
+                        if header is None:
+                            header = values
+                            col_index = resolve_column(col, header)
+                        key = values[col_index - 1] if len(values) >= col_index else None
+                        batch.append((row_idx, None if key is None else str(key),
+                                      json.dumps(values, ensure_ascii=False, default=str)))
+                        if len(batch) >= INSERT_BATCH_SIZE:
+                            conn.executemany("INSERT INTO patients (row_idx, key, data) VALUES (?, ?, ?)", batch)
+                            batch = []
+                        row_count = row_idx
+                    conn.executemany("INSERT INTO patients (row_idx, key, data) VALUES (?, ?, ?)", batch)
+
+                    meta = {
+                        "source_path": source_path,
+                        "sheet": sheet,
+                        "key_column": str(col),
+                        "source_mtime_ns": stat.st_mtime_ns,
+                        "source_size": stat.st_size,
+                        "header": json.loads(json.dumps(header or [], ensure_ascii=False, default=str)),
+                        "row_count": row_count,
+                        "imported_at": time.time(),
+                    }
+                    conn.execute("DELETE FROM meta")
+                    conn.executemany("INSERT INTO meta (name, value) VALUES (?, ?)",
+                                     [(name, json.dumps(value, ensure_ascii=False)) for name, value in meta.items()])
+            finally:
+                wb.close()
+        finally:
+            if converted_file and os.path.exists(converted_file):
+                os.remove(converted_file)
+
+        print(f"已导入患者库 {os.path.basename(source_path)}: {row_count} 行，耗时 {time.perf_counter() - started:.2f}秒")
+        return row_count
+
+    def is_stale(self):
+        """源工作簿在导入后是否被修改过（源文件不存在时视为未修改，继续使用数据库中的数据）"""
+        meta = self.meta()
+        source_path = meta.get("source_path")
+        if not source_path or not os.path.exists(source_path):
+            return False
+        stat = os.stat(source_path)
+        return stat.st_mtime_ns != meta.get("source_mtime_ns") or stat.st_size != meta.get("source_size")
+
+    def refresh(self):
+        """
+        源工作簿有变化时重新导入
+
+        返回:
+            是否重新导入
+        """
+        if not self.is_stale():
+            return False
+        meta = self.meta()
+        print(f"患者库 {os.path.basename(meta['source_path'])} 已更新，重新导入...")
+        self.import_workbook(meta["source_path"], meta.get("sheet"), meta.get("key_column") or "A")
+        return True
+
+    def load_keys(self):
+        """读取比较列的所有非空值，返回与load_b_values相同的有序字典"""
+        with self._connect() as conn:
+            return dict.fromkeys(key for (key,) in conn.execute(
+                "SELECT key FROM patients WHERE key IS NOT NULL ORDER BY row_idx"
+            ))
+
+    def load_rows(self, columns, duplicate="first"):
+        """
+        读取比较列的值到补充列的值的映射，与load_b_rows的结果相同
+
+        日期等非文本值在导入时已保存为文本。
+        """
+        header = self.header()
+        column_indices = resolve_columns(columns, header)
+        b_rows = BRowMap([header[index - 1] if len(header) >= index else None for index in column_indices])
+        with self._connect() as conn:
+            for key, data in conn.execute("SELECT key, data FROM patients WHERE key IS NOT NULL ORDER BY row_idx"):
+                row = json.loads(data)
+                b_rows.add(key, tuple(row[index - 1] if len(row) >= index else None for index in column_indices), duplicate)
+        return b_rows
+
+    def header(self):
+        """患者库第一行的值"""
+        return self.meta().get("header", [])
+
+    def lookup(self, keys):
+        """
+        按比较列的值查找完整的行（使用索引，不扫描全表）
+
+        参数:
+            keys: 要查找的键
+
+        返回:
+            键 -> [(行号, 值列表), ...]，按行号排序；找不到的键不出现在结果中
+        """
+        keys = list(dict.fromkeys(str(key) for key in keys))
+        rows = {}
+        with self._connect() as conn:
+            for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+                chunk = keys[start:start + LOOKUP_BATCH_SIZE]
+                placeholders = ", ".join("?" * len(chunk))
+                for key, row_idx, data in conn.execute(
+                    f"SELECT key, row_idx, data FROM patients WHERE key IN ({placeholders}) ORDER BY row_idx", chunk
+                ):
+                    rows.setdefault(key, []).append((row_idx, json.loads(data)))
+        return rows
+
+def print_info(store):
+    """打印导入信息"""
+    meta = store.meta()
+    if not meta:
+        print("数据库中还没有导入患者库")
+        return
+    imported_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(meta["imported_at"]))
+    print(f"源文件: {meta['source_path']}")
+    print(f"工作表: {meta.get('sheet') or '活动表'}  比较列: {meta['key_column']}")
+    print(f"行数: {meta['row_count']}  导入时间: {imported_at}")
+    print(f"表头: {meta['header']}")
+    print("源文件已修改，需要重新导入" if store.is_stale() else "与源文件一致")
+
+def main():
+    parser = argparse.ArgumentParser(description="Excel数据处理工具 - 患者库数据库")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="从患者库工作簿导入")
+    import_parser.add_argument("source", help="患者库工作簿路径")
+    import_parser.add_argument("--db", required=True, help="数据库路径")
+    import_parser.add_argument("--sheet", default=None, help="工作表名称，默认为活动表")
+    import_parser.add_argument("--col", default="A", help="比较列（列名、列号或表头名称）")
+
+    refresh_parser = subparsers.add_parser("refresh", help="源工作簿有变化时重新导入")
+    refresh_parser.add_argument("--db", required=True, help="数据库路径")
+
+    info_parser = subparsers.add_parser("info", help="显示导入信息")
+    info_parser.add_argument("--db", required=True, help="数据库路径")
+
+    args = parser.parse_args()
+
+    if args.command == "import":
+        LibraryStore(args.db).import_workbook(args.source, args.sheet, args.col)
+        return
+
+    if not is_library_store(args.db):
+        print(f"患者库数据库不存在: {args.db}")
+        return
+    store = LibraryStore(args.db)
+    if args.command == "refresh":
+        if not store.refresh():
+            print("源工作簿没有变化，无需重新导入")
+    else:
+        print_info(store)
+
+if __name__ == "__main__":
+    main()
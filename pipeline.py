@@ -0,0 +1,1901 @@
+"""
+A表与B表匹配的处理流水线
+
+process_excel_file和process_excel_files共用同一条流水线，由以下可替换的阶段组成:
+    reader   读取A表文件（.xls转换、加载工作簿、收集合并单元格和日期列）
+    indexer  建立B表键值索引
+    matcher  判断A表的键值是否与B表匹配
+    sink     将匹配行、未匹配行和患者库覆盖情况写入结果工作簿
+    merger   在结果表中重建合并单元格
+    writer   添加边框并保存结果文件
+
+每个阶段是一个类，构造时接收流水线对象。通过stages参数传入同名阶段的其他实现即可替换，
+例如 MatchPipeline(..., stages={"matcher": MyMatcher})。
+各阶段的耗时记录在stats["stage_times"]中，可以用benchmark_pipeline单独比较。
+"""
+
+import os
+import time
+import queue
+import threading
+from array import array
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import openpyxl
+from openpyxl.styles import Alignment
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+
+# 预览时流式解析A表使用openpyxl的内部解析器，以便在同一次解析中取得合并区域；
+# 不同版本的openpyxl中没有该解析器时改用公开的iter_rows
+try:
+    from openpyxl.worksheet._reader import WorkSheetParser
+except ImportError:
+    WorkSheetParser = None
+
+from excel_processor import (
+    StyleTable, MatchedRow, FuzzyKeyIndex, BRowMap, RowFilter,
+    is_column_number, resolve_column, resolve_columns, row_fingerprint, select_file_matches,
+    copy_row_to_sheet, write_record_to_sheet, write_cell_value_and_style,
+    load_b_index, load_b_header_key, reserve_output_path, release_output_path, save_workbook,
+    set_cell_borders, convert_xls_to_xlsx, find_date_columns, find_header_row, is_title_row,
+)
+from key_index import HashedKeyIndex
+from library_store import is_library_store, LibraryStore
+from run_history import RunHistory, DEFAULT_DB_PATH
+from xlsx_append import append_sheet_rows, has_sheet
+from checkpoint import JobCheckpoint, job_fingerprint
+
+# 阶段名称，按执行顺序排列
+STAGE_NAMES = ("reader", "indexer", "matcher", "sink", "merger", "writer")
+
+# B表索引类型: set为字符串字典，hashed为排序的64位哈希数组（HashedKeyIndex）
+B_INDEX_BACKENDS = ("set", "hashed")
+
+class SourceSheet:
+    """读取阶段的结果：一个A表工作表及其合并单元格和日期列信息"""
+
+    def __init__(self, file_index, path, ws, col_x_index, merged_ranges, merged_key_map, date_columns,
+                 output_columns=None, source_merged_ranges=None, header_values=None):
+        """
+        参数:
+            file_index: 文件在输入列表中的序号
+            path: 用户提供的原始文件路径（.xls转换前）
+            ws: openpyxl工作表
+            col_x_index: 比较列的列号
+            merged_ranges: (行, 列) -> 所在合并区域(min_row, min_col, max_row, max_col)
+            merged_key_map: 比较列处于合并区域内的行 -> 合并区域的值
+            date_columns: 需要按日期处理的列，列号 -> DateColumnConverter
+            output_columns: 输出列在A表中的列号列表（按输出顺序），None表示输出所有列。
+                            选择了输出列时merged_ranges和date_columns中的列号为输出中的列号
+            source_merged_ranges: 按A表列号记录的合并区域，默认与merged_ranges相同
+            header_values: 表头行的值，默认按find_header_row确定
+        """
+        self.file_index = file_index
+        self.path = path
+        self.ws = ws
+        self.col_x_index = col_x_index
+        self.merged_ranges = merged_ranges
+        self.merged_key_map = merged_key_map
+        self.date_columns = date_columns
+        self.output_columns = output_columns
+        self.source_merged_ranges = merged_ranges if source_merged_ranges is None else source_merged_ranges
+        self.row_filters = []  # [(RowFilter, 列号), ...]
+        self._header_values = header_values
+        # 工作表的max_row/max_column每次访问都要遍历所有单元格，打开时只计算一次
+        self.max_row = ws.max_row
+        self.max_column = ws.max_column
+        # 选择了输出列时每行只读取输出列所在的范围
+        if output_columns:
+            self.min_read_col = min(output_columns)
+            self.max_read_col = max(output_columns)
+        else:
+            self.min_read_col = 1
+            self.max_read_col = self.max_column
+
+    @property
+    def source_name(self):
+        return os.path.basename(self.path)
+
+    def key_value(self, row_idx):
+        """获取一行比较列的值，合并单元格取合并区域左上角的值"""
+        if row_idx in self.merged_key_map:
+            return self.merged_key_map[row_idx]
+        return self.ws.cell(row=row_idx, column=self.col_x_index).value
+
+    def value_at(self, row_idx, col_idx):
+        """获取一个单元格的值（A表列号），合并单元格取合并区域左上角的值"""
+        merged = self.source_merged_ranges.get((row_idx, col_idx))
+        if merged is not None:
+            row_idx, col_idx = merged[0], merged[1]
+        return self.ws.cell(row=row_idx, column=col_idx).value
+
+    def row_cells(self, row_idx):
+        """获取一整行单元格，选择了输出列时只返回输出列的单元格（按输出顺序）"""
+        cells = next(self.ws.iter_rows(min_row=row_idx, max_row=row_idx, min_col=self.min_read_col, max_col=self.max_read_col))
+        if self.output_columns is None:
+            return cells
+        return tuple(cells[col_idx - self.min_read_col] for col_idx in self.output_columns)
+
+    @property
+    def header_values(self):
+        """A表表头行（未选择输出列前）的值，用于按表头名称确定列号"""
+        if self._header_values is None:
+            self._header_values = find_header_row(self.ws, self.max_column)[1]
+        return self._header_values
+
+    def value_indices(self, columns):
+        """
+        将列（列名、列号或表头名称）转换为匹配行记录中值的下标（从0开始），columns为空时返回None
+
+        选择了输出列时，列必须在输出列中。
+        """
+        if not columns:
+            return None
+        header_values = None if all(is_column_number(col) for col in columns) else self.header_values
+        col_indices = resolve_columns(columns, header_values)
+        if self.output_columns is None:
+            return [col_idx - 1 for col_idx in col_indices]
+        positions = {col_idx: pos for pos, col_idx in enumerate(self.output_columns)}
+        missing = [str(col) for col, col_idx in zip(columns, col_indices) if col_idx not in positions]
+        if missing:
+            raise ValueError(f"列不在输出列中: {', '.join(missing)}")
+        return [positions[col_idx] for col_idx in col_indices]
+
+    def close(self):
+        """释放对工作表的引用"""
+        self.ws = None
+
+def project_merged_ranges(ranges, output_columns):
+    """
+    将A表的合并区域换算为输出列中的合并区域
+
+    合并区域的值保存在左上角的单元格中，因此从左上角所在列的输出位置开始，
+    向右取输出中相邻且仍在合并区域内的列作为新的合并区域；左上角所在列没有输出时不再合并。
+
+    参数:
+        ranges: A表合并区域(min_row, min_col, max_row, max_col)的集合
+        output_columns: 输出列在A表中的列号列表
+
+    返回:
+        (行, 输出列号) -> 输出中的合并区域(min_row, min_col, max_row, max_col)
+    """
+    projected = {}
+    for min_row, min_col, max_row, max_col in ranges:
+        for start, col_idx in enumerate(output_columns, 1):
+            if col_idx != min_col:
+                continue
+            end = start
+            while end < len(output_columns) and output_columns[end] != min_col and min_col <= output_columns[end] <= max_col:
+                end += 1
+            for row_idx in range(min_row, max_row + 1):
+                for output_col in range(start, end + 1):
+                    projected[(row_idx, output_col)] = (min_row, start, max_row, end)
+    return projected
+
+class WorkbookSourceReader:
+    """用openpyxl完整加载A表工作簿的读取阶段"""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.converted_files = []
+
+    def open(self, file_index, file_a_path):
+        """
+        加载一个A表文件
+
+        返回:
+            SourceSheet对象，加载失败时返回None
+        """
+        pipeline = self.pipeline
+        original_file_a_path = file_a_path
+
+        # 检查A表文件格式并转换
+        _, file_a_ext = os.path.splitext(file_a_path)
+        if file_a_ext.lower() == '.xls':
+            print(f"检测到A表[{file_index+1}]是.xls格式，将转换为.xlsx格式处理...")
+            temp_a_path = convert_xls_to_xlsx(file_a_path)
+            if temp_a_path:
+                self.converted_files.append(temp_a_path)
+                file_a_path = temp_a_path
+            else:
+                print(f"A表[{file_index+1}]转换失败，将尝试直接处理...")
+
+        # 加载A表工作簿
+        try:
+            wb_a = openpyxl.load_workbook(file_a_path, data_only=True)
+        except Exception as e:
+            print(f"加载文件 {file_a_path} 时出错: {str(e)}")
+            pipeline.record_file_error(file_index, original_file_a_path, "加载", str(e))
+            return None
+
+        # 选择A表工作表（可按文件单独设置工作表名）
+        current_sheet_a = pipeline.sheet_a_map.get(original_file_a_path, pipeline.sheet_a)
+        if current_sheet_a and current_sheet_a in wb_a.sheetnames:
+            ws_a = wb_a[current_sheet_a]
+        else:
+            ws_a = wb_a.active
+
+        # 转换A表列名为列号（可按文件单独设置比较列和输出列），表头名称按表头行确定列号
+        # （表头一般在第一行，第一行为标题时在第二行）
+        current_col_x = pipeline.col_x_map.get(original_file_a_path, pipeline.col_x)
+        _, header_values = find_header_row(ws_a)
+        try:
+            col_x_index = resolve_column(current_col_x, header_values)
+            output_columns = resolve_columns(pipeline.output_columns, header_values) if pipeline.output_columns else None
+            # 筛选列在某个文件的表头中不存在时只跳过该文件
+            row_filters = pipeline.bind_row_filters(header_values)
+        except ValueError as e:
+            print(f"A表[{file_index+1}] {os.path.basename(original_file_a_path)}: {str(e)}")
+            pipeline.record_file_error(file_index, original_file_a_path, "表头", str(e))
+            return None
+
+        # 收集所有A表中的合并单元格信息
+        merged_ranges = {}
+        merged_key_map = {}
+        for merged_range in ws_a.merged_cells.ranges:
+            min_col, min_row, max_col, max_row = merged_range.min_col, merged_range.min_row, merged_range.max_col, merged_range.max_row
+
+            # 记录合并单元格范围
+            for row_idx in range(min_row, max_row + 1):
+                for col_idx in range(min_col, max_col + 1):
+                    merged_ranges[(row_idx, col_idx)] = (min_row, min_col, max_row, max_col)
+
+            # 只关注X列的合并单元格 (用于匹配)，将合并范围内的所有行映射到该值
+            if min_col <= col_x_index <= max_col:
+                cell_value = ws_a.cell(row=min_row, column=min_col).value
+                for row_idx in range(min_row, max_row + 1):
+                    merged_key_map[row_idx] = cell_value
+
+        # 查找表头中包含"日期"的列（表头在第一行或第二行），每列按样本确定日期格式
+        date_columns = find_date_columns(ws_a)
+
+        # 只输出选择的列时，合并区域和日期列换算为输出中的列号
+        source_merged_ranges = merged_ranges
+        if output_columns:
+            merged_ranges = project_merged_ranges(set(merged_ranges.values()), output_columns)
+            date_columns = {pos: date_columns[col_idx] for pos, col_idx in enumerate(output_columns, 1) if col_idx in date_columns}
+
+        source = SourceSheet(file_index, original_file_a_path, ws_a, col_x_index, merged_ranges, merged_key_map, date_columns,
+                             output_columns, source_merged_ranges, header_values)
+        source.row_filters = row_filters
+        return source
+
+    def close(self):
+        """清理转换过程中创建的临时文件"""
+        for temp_file in self.converted_files:
+            try:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                    print(f"已删除临时文件: {temp_file}")
+            except Exception as e:
+                print(f"删除临时文件失败: {temp_file}, 错误: {str(e)}")
+        self.converted_files = []
+
+class SourcePrefetcher:
+    """
+    在后台线程中提前打开后续的A表文件，与当前文件的匹配和写入重叠进行
+
+    读取阶段的open在预读线程中按文件顺序调用（跳过skip中的文件序号，如断点续传时已完成的文件）。已打开但尚未处理完的文件最多depth+1个
+    （depth个预读文件加上正在处理的文件），用于限制同时驻留在内存中的工作簿数量。
+    """
+
+    def __init__(self, reader, file_a_paths, depth, skip=()):
+        self.reader = reader
+        self.file_a_paths = list(file_a_paths)
+        self.skip = set(skip)
+        self.results = queue.Queue()
+        self.slots = threading.Semaphore(depth + 1)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._load_all, name="excel-prefetch", daemon=True)
+        self.thread.start()
+
+    def _load_all(self):
+        for file_index, file_a_path in enumerate(self.file_a_paths):
+            if file_index in self.skip:
+                continue
+            # 等待正在处理的文件释放位置
+            while not self.slots.acquire(timeout=0.1):
+                if self.stopped.is_set():
+                    return
+            if self.stopped.is_set():
+                return
+            try:
+                self.results.put((self.reader.open(file_index, file_a_path), None))
+            except Exception as e:
+                self.results.put((None, e))
+                return
+
+    def get(self):
+        """
+        按文件顺序取出下一个已打开的文件
+
+        返回:
+            SourceSheet对象，加载失败时返回None；读取阶段抛出的异常在这里重新抛出
+        """
+        source, error = self.results.get()
+        if error is not None:
+            raise error
+        return source
+
+    def release(self):
+        """当前文件处理完毕并已释放工作簿后调用，允许预读线程打开下一个文件"""
+        self.slots.release()
+
+    def close(self):
+        """停止预读线程，并释放已预读但未处理的文件"""
+        self.stopped.set()
+        self.thread.join()
+        while True:
+            try:
+                source, _ = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if source is not None:
+                source.close()
+
+class KeyColumn:
+    """预览读取阶段的结果：一个A表工作表比较列（及筛选列）的所有值（合并单元格已展开）"""
+
+    def __init__(self, file_index, path, wb, ws, keys, output_columns=None, column_values=None):
+        """
+        参数:
+            file_index: 文件在输入列表中的序号
+            path: 用户提供的原始文件路径（.xls转换前）
+            wb, ws: 只读模式打开的工作簿和工作表，用于按需读取整行
+            keys: 比较列的值列表，keys[i]对应第i+1行
+            output_columns: 输出列在A表中的列号列表，None表示输出所有列
+            column_values: 列号 -> 该列的值列表，包含比较列和筛选条件用到的列
+        """
+        self.file_index = file_index
+        self.path = path
+        self.wb = wb
+        self.ws = ws
+        self.keys = keys
+        self.output_columns = output_columns
+        self.column_values = column_values or {}
+        self.row_filters = []  # [(RowFilter, 列号), ...]
+
+    @property
+    def source_name(self):
+        return os.path.basename(self.path)
+
+    @property
+    def sheet_name(self):
+        return self.ws.title
+
+    def value_at(self, row_idx, col_idx):
+        """获取已读取的列中一个单元格的值"""
+        values = self.column_values[col_idx]
+        return values[row_idx - 1] if row_idx <= len(values) else None
+
+    def fetch_rows(self, row_indices, project=True):
+        """
+        再次流式读取工作表，只取出指定行的值，读到最后一个需要的行即停止
+
+        参数:
+            project: 是否只取输出列（按输出顺序），False时返回整行
+        """
+        wanted = set(row_indices)
+        rows = {}
+        if not wanted:
+            return rows
+        last_row = max(wanted)
+        output_columns = self.output_columns if project else None
+        max_col = max(output_columns) if output_columns else None
+        for row_idx, values in enumerate(self.ws.iter_rows(max_row=last_row, max_col=max_col, values_only=True), 1):
+            if row_idx in wanted:
+                if output_columns:
+                    rows[row_idx] = [values[col_idx - 1] if col_idx <= len(values) else None for col_idx in output_columns]
+                else:
+                    rows[row_idx] = list(values)
+            if row_idx >= last_row:
+                break
+        return rows
+
+    def close(self):
+        """关闭只读工作簿"""
+        self.wb.close()
+
+def row_values_list(row_values):
+    """列号 -> 值的字典转换为按列排列的值列表"""
+    return [row_values.get(col_idx) for col_idx in range(1, max(row_values, default=0) + 1)]
+
+class StreamingKeyReader:
+    """
+    预览用的读取阶段
+
+    以只读模式流式解析A表，只保留比较列的值，不加载样式，也不在内存中建立整个工作表。
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.converted_files = []
+
+    def open(self, file_index, file_a_path):
+        """
+        读取一个A表文件的比较列
+
+        返回:
+            KeyColumn对象，加载失败时返回None
+        """
+        pipeline = self.pipeline
+        original_file_a_path = file_a_path
+
+        _, file_a_ext = os.path.splitext(file_a_path)
+        if file_a_ext.lower() == '.xls':
+            temp_a_path = convert_xls_to_xlsx(file_a_path)
+            if temp_a_path:
+                self.converted_files.append(temp_a_path)
+                file_a_path = temp_a_path
+
+        try:
+            wb_a = openpyxl.load_workbook(file_a_path, read_only=True, data_only=True)
+        except Exception as e:
+            print(f"加载文件 {file_a_path} 时出错: {str(e)}")
+            pipeline.record_file_error(file_index, original_file_a_path, "加载", str(e))
+            return None
+
+        current_sheet_a = pipeline.sheet_a_map.get(original_file_a_path, pipeline.sheet_a)
+        if current_sheet_a and current_sheet_a in wb_a.sheetnames:
+            ws_a = wb_a[current_sheet_a]
+        else:
+            ws_a = wb_a.active
+        current_col_x = pipeline.col_x_map.get(original_file_a_path, pipeline.col_x)
+        col_x_index = resolve_column(current_col_x) if is_column_number(current_col_x) else None
+
+        def resolve_read_columns(header_values):
+            # 比较列和筛选列为表头名称时按表头行确定列号
+            key_col = col_x_index if col_x_index is not None else resolve_column(current_col_x, header_values)
+            row_filters = pipeline.bind_row_filters(header_values)
+            return key_col, row_filters, {col_idx: [] for col_idx in [key_col] + [col_idx for _, col_idx in row_filters]}
+
+        merged_refs = []
+        try:
+            try:
+                header_values, column_values, col_x_index, row_filters = self.read_columns(
+                    self.parsed_rows(wb_a, ws_a, merged_refs), resolve_read_columns)
+            except (AttributeError, TypeError) as e:
+                # openpyxl的内部接口有变化，改用公开接口（只读工作表不提供合并区域）
+                print(f"无法使用openpyxl的工作表解析器（{str(e)}），改用iter_rows读取，合并单元格按空值处理")
+                merged_refs = []
+                header_values, column_values, col_x_index, row_filters = self.read_columns(
+                    self.public_rows(ws_a), resolve_read_columns)
+            output_columns = resolve_columns(pipeline.output_columns, header_values) if pipeline.output_columns else None
+        except ValueError as e:
+            wb_a.close()
+            print(f"A表[{file_index+1}] {os.path.basename(original_file_a_path)}: {str(e)}")
+            pipeline.record_file_error(file_index, original_file_a_path, "表头", str(e))
+            return None
+
+        keys = column_values[col_x_index]
+        column = KeyColumn(file_index, original_file_a_path, wb_a, ws_a, keys, output_columns, column_values)
+        column.row_filters = row_filters
+
+        # 读取的列处于合并区域内的行使用合并区域左上角的值
+        read_ranges = []
+        for ref in merged_refs:
+            merged_range = CellRange(ref)
+            if any(merged_range.min_col <= col_idx <= merged_range.max_col for col_idx in column_values):
+                read_ranges.append(merged_range)
+
+        # 左上角不在读取的列上的合并区域，需要再读取一次这些行
+        other_rows = column.fetch_rows((r.min_row for r in read_ranges if r.min_col not in column_values), project=False)
+        for merged_range in read_ranges:
+            if merged_range.min_col in column_values:
+                anchor_values = column_values[merged_range.min_col]
+                value = anchor_values[merged_range.min_row - 1] if merged_range.min_row <= len(anchor_values) else None
+            else:
+                row_values = other_rows.get(merged_range.min_row, [])
+                value = row_values[merged_range.min_col - 1] if merged_range.min_col <= len(row_values) else None
+            for col_idx, values in column_values.items():
+                if not merged_range.min_col <= col_idx <= merged_range.max_col:
+                    continue
+                if len(values) < merged_range.max_row:
+                    values.extend([None] * (merged_range.max_row - len(values)))
+                for row_idx in range(merged_range.min_row, merged_range.max_row + 1):
+                    values[row_idx - 1] = value
+
+        return column
+
+    @staticmethod
+    def read_columns(rows, resolve_read_columns):
+        """
+        从逐行读取的值中取出比较列和筛选列
+
+        参数:
+            rows: 产生(行号, 列号 -> 值)的迭代器
+            resolve_read_columns: 根据表头确定(比较列, 筛选条件, 列号 -> 值列表)的函数
+
+        返回:
+            (表头值列表, 列号 -> 值列表, 比较列号, 筛选条件)
+        """
+        column_values = None
+        header_values = ()
+        # 表头可能在第二行（第一行为标题），读到第二行之后才能确定读取哪些列
+        head_rows = []
+        for row_idx, row_values in rows:
+            if column_values is None and row_idx <= 2:
+                head_rows.append((row_idx, row_values))
+                if row_idx < 2:
+                    continue
+            if column_values is None:
+                header_values = StreamingKeyReader.head_header_values(head_rows)
+                col_x_index, row_filters, column_values = resolve_read_columns(header_values)
+                pending = head_rows if row_idx <= 2 else head_rows + [(row_idx, row_values)]
+            else:
+                pending = [(row_idx, row_values)]
+            for pending_idx, pending_values in pending:
+                StreamingKeyReader.append_row(column_values, pending_idx, pending_values)
+        if column_values is None:
+            header_values = StreamingKeyReader.head_header_values(head_rows)
+            col_x_index, row_filters, column_values = resolve_read_columns(header_values)
+            for row_idx, row_values in head_rows:
+                StreamingKeyReader.append_row(column_values, row_idx, row_values)
+        return header_values, column_values, col_x_index, row_filters
+
+    @staticmethod
+    def head_header_values(head_rows):
+        """按前两行确定表头的值，规则与find_header_row相同"""
+        head = dict(head_rows)
+        first = row_values_list(head.get(1, {}))
+        if 2 in head and is_title_row(first):
+            return row_values_list(head[2])
+        return first
+
+    @staticmethod
+    def append_row(column_values, row_idx, row_values):
+        """把一行中读取的列的值追加到各列的值列表，跳过的空行补None"""
+        for col_idx, values in column_values.items():
+            if len(values) < row_idx - 1:
+                values.extend([None] * (row_idx - 1 - len(values)))
+            values.append(row_values.get(col_idx))
+
+    @staticmethod
+    def parsed_rows(wb_a, ws_a, merged_refs):
+        """
+        用openpyxl的工作表解析器逐行读取，解析结束后把合并区域的引用加入merged_refs
+
+        只读工作表不提供合并单元格信息，而mergeCells位于工作表XML的末尾，
+        直接使用解析器可以在同一次解析中取得各列的值和合并区域。
+        """
+        if WorkSheetParser is None:
+            raise AttributeError("openpyxl中没有WorkSheetParser")
+        with ws_a._get_source() as source:
+            parser = WorkSheetParser(source, ws_a._shared_strings, data_only=True, epoch=wb_a.epoch,
+                                     date_formats=wb_a._date_formats, timedelta_formats=wb_a._timedelta_formats)
+            for row_idx, cells in parser.parse():
+                yield row_idx, {cell["column"]: cell["value"] for cell in cells}
+        if parser.merged_cells is not None:
+            merged_refs.extend(merge_cell.ref for merge_cell in parser.merged_cells.mergeCell)
+
+    @staticmethod
+    def public_rows(ws_a):
+        """用公开的iter_rows逐行读取，不提供合并区域"""
+        for row_idx, values in enumerate(ws_a.iter_rows(values_only=True), 1):
+            yield row_idx, {col_idx: value for col_idx, value in enumerate(values, 1) if value is not None}
+
+    def close(self):
+        """清理转换过程中创建的临时文件"""
+        for temp_file in self.converted_files:
+            try:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+            except Exception as e:
+                print(f"删除临时文件失败: {temp_file}, 错误: {str(e)}")
+        self.converted_files = []
+
+class BKeyIndexer:
+    """
+    建立B表键值索引：优先使用预先建立的索引，其次使用缓存，最后读取B表
+
+    有多个患者库时合并为一个字典，值为患者库位掩码（第i位表示第i个患者库中有该键），
+    只需扫描一遍A表就能知道每个匹配行出现在哪些患者库中。
+    使用hashed索引时合并结果同样保存为HashedKeyIndex，位掩码存放在对齐的整数数组中。
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    def build(self):
+        """返回支持成员判断和遍历的B表键值集合"""
+        pipeline = self.pipeline
+        # 索引中包含各患者库第一行（表头）的值，患者库覆盖统计需要排除
+        if "coverage" in pipeline.outputs:
+            pipeline.b_header_keys = self.header_keys()
+        if pipeline.b_index is not None:
+            return pipeline.b_index
+        if not pipeline.multi_library:
+            b_values = self.load(pipeline.file_b_paths[0])
+            if pipeline.b_columns:
+                pipeline.b_rows = b_values
+            return b_values
+
+        combined = {}
+        b_rows = None
+        for library_index, file_b_path in enumerate(pipeline.file_b_paths):
+            bit = 1 << library_index
+            library_values = self.load(file_b_path)
+            for key in library_values:
+                combined[key] = combined.get(key, 0) | bit
+            # 补充列按患者库顺序合并，重复键的处理方式与单个患者库内相同
+            if pipeline.b_columns:
+                if b_rows is None:
+                    b_rows = BRowMap(library_values.header)
+                for key, rows in library_values.items():
+                    for values in rows:
+                        b_rows.add(key, values, pipeline.b_duplicate)
+        pipeline.b_rows = b_rows
+        if pipeline.b_index_backend == "hashed":
+            return HashedKeyIndex.from_mapping(combined)
+        return combined
+
+    def header_keys(self):
+        """各患者库表头中比较列的值的集合"""
+        pipeline = self.pipeline
+        keys = set()
+        for file_b_path in pipeline.file_b_paths:
+            key = load_b_header_key(file_b_path, pipeline.sheet_b_map.get(file_b_path, pipeline.sheet_b),
+                                    pipeline.col_y_map.get(file_b_path, pipeline.col_y))
+            if key is not None:
+                keys.add(key)
+        return keys
+
+    def load(self, file_b_path):
+        """读取一个患者库的键值，可按患者库单独设置工作表和比较列"""
+        pipeline = self.pipeline
+        # 患者库数据库的源工作簿有变化时先重新导入，缓存随数据库文件的修改时间失效
+        if is_library_store(file_b_path):
+            LibraryStore(file_b_path).refresh()
+        sheet_b = pipeline.sheet_b_map.get(file_b_path, pipeline.sheet_b)
+        col_y = pipeline.col_y_map.get(file_b_path, pipeline.col_y)
+        if pipeline.b_index_cache is not None:
+            return pipeline.b_index_cache.get(file_b_path, sheet_b, col_y, pipeline.b_index_backend,
+                                              pipeline.b_columns, pipeline.b_duplicate, pipeline.b_read_only)
+        return load_b_index(file_b_path, sheet_b, col_y, pipeline.b_index_backend, pipeline.b_columns, pipeline.b_duplicate,
+                            pipeline.b_read_only)
+
+class KeyMatcher:
+    """
+    精确匹配，启用模糊匹配时精确匹配失败后再按编辑距离查找
+
+    B表索引提供contains_batch时（如HashedKeyIndex和共享内存索引），match_batch一次完成整列的精确匹配。
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.b_values = None
+        self.fuzzy_index = None
+
+    def prepare(self, b_values):
+        """B表索引建立后调用一次"""
+        self.b_values = b_values
+        if self.pipeline.fuzzy_match:
+            self.fuzzy_index = FuzzyKeyIndex(b_values, max_distance=self.pipeline.fuzzy_threshold)
+
+    def match(self, key):
+        """
+        返回:
+            (匹配到的B表值, 得分)，未匹配时返回None
+        """
+        if key in self.b_values:
+            return (key, 1.0)
+        if self.fuzzy_index is not None:
+            return self.fuzzy_index.lookup(key)
+        return None
+
+    def match_batch(self, keys):
+        """
+        匹配一个文件比较列的所有值
+
+        参数:
+            keys: 字符串键列表，空值为None
+
+        返回:
+            与keys一一对应的匹配结果列表，空值和未匹配的键为None
+        """
+        contains_batch = getattr(self.b_values, "contains_batch", None)
+        # 子类只重写了match时逐个调用，保证自定义的匹配逻辑生效
+        if contains_batch is None or type(self).match is not KeyMatcher.match:
+            return [None if key is None else self.match(key) for key in keys]
+
+        present = [key for key in keys if key is not None]
+        found = iter(contains_batch(present).tolist())
+        results = []
+        for key in keys:
+            if key is None:
+                results.append(None)
+            elif next(found):
+                results.append((key, 1.0))
+            elif self.fuzzy_index is not None:
+                results.append(self.fuzzy_index.lookup(key))
+            else:
+                results.append(None)
+        return results
+
+class MatchSummary:
+    """
+    输出的匹配行的汇总统计，在写入匹配行时累加，不需要重新读取结果表
+
+    每个分组只保存一个列表: [行数, 第1列合计, 最小, 最大, 第2列合计, ...]，
+    统计列中的非数值单元格（空值、文本、日期）不参与合计。
+    """
+
+    def __init__(self, columns):
+        """
+        参数:
+            columns: 需要统计合计、最小值和最大值的列（列名或列号）列表
+        """
+        self.columns = list(columns or [])
+        self.titles = None
+        self.by_key = {}
+        self.by_source = {}
+
+    def set_header(self, header_values, column_indices):
+        """用第一个文件的表头确定统计列的标题"""
+        if self.titles is None:
+            self.titles = [
+                header_values[index] if index < len(header_values) and header_values[index] is not None else str(col)
+                for col, index in zip(self.columns, column_indices)
+            ]
+
+    def add(self, key, source, values, column_indices):
+        """累加一条匹配行，source为(文件名, 工作表名)，column_indices为统计列在该文件中的下标"""
+        for table, group in ((self.by_key, key), (self.by_source, source)):
+            acc = table.get(group)
+            if acc is None:
+                acc = table[group] = [0] + [0, None, None] * len(self.columns)
+            acc[0] += 1
+            for pos, index in enumerate(column_indices):
+                value = values[index] if index < len(values) else None
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    base = 1 + 3 * pos
+                    acc[base] += value
+                    if acc[base + 1] is None or value < acc[base + 1]:
+                        acc[base + 1] = value
+                    if acc[base + 2] is None or value > acc[base + 2]:
+                        acc[base + 2] = value
+
+    def write(self, ws):
+        """写入汇总工作表：先按患者，空一行后按文件和工作表"""
+        titles = self.titles or [str(col) for col in self.columns]
+        value_headers = ["匹配行数"] + [f"{title}{suffix}" for title in titles for suffix in ("合计", "最小", "最大")]
+        ws.append(["患者"] + value_headers)
+        for key, acc in self.by_key.items():
+            ws.append([key] + acc)
+        ws.append([])
+        ws.append(["文件", "工作表"] + value_headers)
+        for (file_name, sheet_name), acc in self.by_source.items():
+            ws.append([file_name, sheet_name] + acc)
+
+class WorkbookRowSink:
+    """将各类输出写入同一个openpyxl结果工作簿"""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+        # 创建新的工作簿用于保存所有结果
+        self.wb_result = openpyxl.Workbook()
+        self.ws_result = self.wb_result.active
+        self.ws_result.title = pipeline.output_sheet or "匹配结果"
+
+        # 未匹配行工作表
+        self.ws_unmatched = self.wb_result.create_sheet("未匹配") if "unmatched" in pipeline.outputs else None
+        self.unmatched_header_added = False
+        self.unmatched_count = 0
+
+        # 患者库覆盖统计: B表值 -> [命中次数, 出现的文件列表]
+        self.coverage = {} if "coverage" in pipeline.outputs else None
+
+        # 汇总统计和各文件的(文件名, 工作表名)
+        self.summary = MatchSummary(pipeline.summary_columns) if "summary" in pipeline.outputs else None
+        self.summary_indices = {}
+        self.source_names = {}
+
+        self.header_added = False
+        self.start_row = 1
+        self.total_matches = 0
+
+        # 断点续传时记录当前文件写入未匹配工作表的行，随匹配结果一起保存，见replay
+        self.capture = None
+        self.source_unmatched_state = (0, False)
+
+        # 用于收集所有文件的合并单元格信息
+        self.all_cells_to_merge = {}
+        # 全局行映射，记录原始文件中的行号与结果表中行号的对应关系
+        self.global_row_mapping = {}
+
+    def start(self, b_values):
+        """B表索引建立后调用一次"""
+        if self.coverage is not None:
+            header_keys = self.pipeline.b_header_keys
+            for key in b_values:
+                if key not in header_keys:
+                    self.coverage[key] = [0, []]
+
+    def start_source(self, source):
+        """开始扫描一个A表前调用，未匹配工作表使用第一个文件的表头"""
+        # 扫描失败时按开始前的状态撤销写入未匹配工作表的行，见discard_source
+        self.source_unmatched_state = (self.unmatched_count, self.unmatched_header_added)
+        self.source_names[source.file_index] = (source.source_name, source.ws.title)
+        if self.summary is not None:
+            # 统计列可以是表头名称，每个文件按自己的表头确定下标
+            column_indices = self.summary_indices[source.file_index] = source.value_indices(self.summary.columns) or []
+            # 统计列的标题取自表头行（第一行为标题时在第二行），按输出列换算为匹配行中的位置
+            header_values = list(source.header_values)
+            if source.output_columns:
+                header_values = [header_values[col_idx - 1] if col_idx <= len(header_values) else None
+                                 for col_idx in source.output_columns]
+            self.summary.set_header(header_values, column_indices)
+        if self.ws_unmatched is not None and not self.unmatched_header_added and source.max_row > 0:
+            if self.capture is not None:
+                header_record = MatchedRow.from_cells(1, source.row_cells(1), self.pipeline.style_table)
+                self.capture["unmatched_header"] = header_record
+                write_record_to_sheet(header_record, self.pipeline.style_table, self.ws_unmatched, 1)
+            else:
+                copy_row_to_sheet(source.row_cells(1), self.ws_unmatched, 1)
+            self.unmatched_header_added = True
+
+    def discard_source(self, source):
+        """撤销扫描失败的A表写入未匹配工作表的行（包括该文件写入的表头）"""
+        unmatched_count, header_added = self.source_unmatched_state
+        if self.ws_unmatched is not None:
+            first_row = unmatched_count + 2 if header_added else 1
+            if self.ws_unmatched.max_row >= first_row:
+                self.ws_unmatched.delete_rows(first_row, self.ws_unmatched.max_row - first_row + 1)
+        self.unmatched_count, self.unmatched_header_added = unmatched_count, header_added
+
+    def write_unmatched(self, source, row_idx):
+        """将A表中未匹配的一行（表头除外）写入未匹配工作表"""
+        if self.ws_unmatched is not None and row_idx > 1:
+            self.unmatched_count += 1
+            if self.capture is not None:
+                record = MatchedRow.from_cells(row_idx, source.row_cells(row_idx), self.pipeline.style_table)
+                self.capture["unmatched_records"].append(record)
+                write_record_to_sheet(record, self.pipeline.style_table, self.ws_unmatched, self.unmatched_count + 1,
+                                      source.date_columns)
+            else:
+                copy_row_to_sheet(source.row_cells(row_idx), self.ws_unmatched, self.unmatched_count + 1, source.date_columns)
+
+    def record_coverage(self, key, source_name):
+        """记录患者库覆盖情况"""
+        if self.coverage is None:
+            return
+        hits = self.coverage.setdefault(key, [0, []])
+        hits[0] += 1
+        if source_name not in hits[1]:
+            hits[1].append(source_name)
+
+    def replay(self, capture, date_columns):
+        """断点续传时重放一个已完成文件写入未匹配工作表的行"""
+        style_table = self.pipeline.style_table
+        if self.ws_unmatched is not None:
+            if not self.unmatched_header_added and capture["unmatched_header"] is not None:
+                write_record_to_sheet(capture["unmatched_header"], style_table, self.ws_unmatched, 1)
+                self.unmatched_header_added = True
+            for record in capture["unmatched_records"]:
+                self.unmatched_count += 1
+                write_record_to_sheet(record, style_table, self.ws_unmatched, self.unmatched_count + 1, date_columns)
+
+    def write_matches(self, file_index, header_record, records, merged_ranges, date_columns):
+        """将一个A表文件的匹配行（及其合并单元格信息）写入结果表"""
+        pipeline = self.pipeline
+
+        if self.summary is not None:
+            self.add_to_summary(file_index, header_record, records)
+
+        # 覆盖统计只计入去重后写入结果的行
+        if self.coverage is not None:
+            source_name = self.source_names[file_index][0]
+            for record in records:
+                if record.row_idx > 1:
+                    self.record_coverage(record.match_info[0], source_name)
+
+        # 不输出匹配行时只统计数量
+        if not pipeline.write_matched:
+            self.total_matches += sum(1 for record in records if record.row_idx > 1)
+            return
+
+        ws_result = self.ws_result
+        style_table = pipeline.style_table
+
+        # 如果是第一个文件并且找到了表头，复制表头（表头不处理为日期格式）
+        if not self.header_added and header_record is not None and len(records) > 0:
+            write_record_to_sheet(header_record, style_table, ws_result, 1)
+
+            # 追加匹配信息列的表头
+            for offset, title in enumerate(pipeline.extra_headers(), 1):
+                ws_result.cell(row=1, column=len(header_record.values)+offset, value=title)
+
+            self.header_added = True
+            self.start_row = 2
+
+        matching_row_indices = [record.row_idx for record in records]
+        matched_row_set = set(matching_row_indices)
+        styles = style_table.styles
+
+        # 复制数据
+        for record in records:
+            original_row_idx = record.row_idx
+            if original_row_idx == 1 and self.header_added:
+                # 跳过表头行（如果已经添加）
+                continue
+
+            target_row = self.start_row + self.total_matches
+
+            for col_idx, (value, style_id) in enumerate(zip(record.values, record.style_ids), 1):
+                result_cell = ws_result.cell(row=target_row, column=col_idx)
+                cell_format, alignment = styles[style_id]
+
+                # 按驻留的样式写入值、格式和对齐方式
+                write_cell_value_and_style(result_cell, value, cell_format, alignment, date_columns.get(col_idx, False))
+
+                # 检查该单元格在A表中是否是合并单元格的一部分
+                original_cell_key = (original_row_idx, col_idx)
+                if original_cell_key in merged_ranges:
+                    o_min_row, o_min_col, o_max_row, o_max_col = merged_ranges[original_cell_key]
+
+                    # 记录原始行到结果表行的映射，用于最终合并单元格
+                    self.global_row_mapping.setdefault(f"file_{file_index}", {})[original_row_idx] = target_row
+
+                    # 跳过第一行（表头）；只有当所有需要合并的行都匹配上时，才记录此合并信息
+                    if o_min_row > 1:
+                        rows_to_merge = set(range(o_min_row, o_max_row + 1))
+                        matched_merge_rows = matched_row_set & rows_to_merge
+                        if len(matched_merge_rows) == len(rows_to_merge):
+                            merge_key = (file_index, o_min_row, o_min_col, o_max_row, o_max_col)
+                            self.all_cells_to_merge[merge_key] = {
+                                'file_index': file_index,
+                                'o_min_row': o_min_row,
+                                'o_min_col': o_min_col,
+                                'o_max_row': o_max_row,
+                                'o_max_col': o_max_col,
+                                'matched_merge_rows': list(matched_merge_rows)
+                            }
+
+            # 写入匹配信息列
+            for offset, value in enumerate(pipeline.extra_values(record), 1):
+                ws_result.cell(row=target_row, column=len(record.values)+offset, value=value)
+
+            self.total_matches += 1
+
+    def add_to_summary(self, file_index, header_record, records):
+        """将一个文件确定输出的匹配行累加到汇总统计（表头行除外）"""
+        header_values = header_record.values if header_record is not None else ()
+        column_indices = self.summary_indices.get(file_index, [])
+        self.summary.set_header(header_values, column_indices)
+        source = self.source_names.get(file_index, (os.path.basename(self.pipeline.file_a_paths[file_index]), None))
+        for record in records:
+            if record.row_idx > 1:
+                self.summary.add(record.match_info[0], source, record.values, column_indices)
+
+    def finish(self):
+        """所有文件写完后生成覆盖和汇总工作表，并移除不需要的工作表"""
+        if self.coverage is not None:
+            ws_coverage = self.wb_result.create_sheet("患者库覆盖")
+            if self.pipeline.multi_library:
+                ws_coverage.append(["患者", "命中次数", "出现文件", "所在患者库"])
+                for key, (hit_count, file_names) in self.coverage.items():
+                    ws_coverage.append([key, hit_count, "、".join(file_names), self.pipeline.library_label(key)])
+            else:
+                ws_coverage.append(["患者", "命中次数", "出现文件"])
+                for key, (hit_count, file_names) in self.coverage.items():
+                    ws_coverage.append([key, hit_count, "、".join(file_names)])
+
+        if self.summary is not None:
+            self.summary.write(self.wb_result.create_sheet("汇总统计"))
+
+        # 不输出匹配行时移除匹配结果工作表
+        if not self.pipeline.write_matched:
+            self.wb_result.remove(self.ws_result)
+
+class MergeBuilder:
+    """根据收集到的合并信息在结果表中重建合并单元格"""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    def apply(self, sink):
+        """在sink.ws_result中执行合并"""
+        cells_to_merge = {}
+
+        for merge_info in sink.all_cells_to_merge.values():
+            file_index = merge_info['file_index']
+            o_min_row = merge_info['o_min_row']
+            o_min_col = merge_info['o_min_col']
+            o_max_row = merge_info['o_max_row']
+            o_max_col = merge_info['o_max_col']
+
+            row_mapping = sink.global_row_mapping.get(f"file_{file_index}", {})
+            if not row_mapping:
+                print(f"警告: 文件 {file_index} 的行映射信息丢失，跳过合并单元格")
+                continue
+
+            # 获取合并范围内所有行在结果表中的位置
+            result_rows = [row_mapping[row_idx] for row_idx in merge_info['matched_merge_rows'] if row_idx in row_mapping]
+            if not result_rows:
+                print(f"警告: 文件 {file_index} 合并范围 ({o_min_row},{o_min_col})-({o_max_row},{o_max_col}) 在结果表中找不到对应行")
+                continue
+
+            # 计算结果表中的合并范围
+            new_min_row = min(result_rows)
+            new_max_row = max(result_rows)
+            cells_to_merge[(new_min_row, o_min_col, new_max_row, o_max_col)] = (new_min_row, o_min_col, new_max_row, o_max_col)
+            print(f"将合并单元格: 文件{file_index+1}原始范围=({o_min_row},{o_min_col})-({o_max_row},{o_max_col}) -> 结果表范围=({new_min_row},{o_min_col})-({new_max_row},{o_max_col})")
+
+        for min_row, min_col, max_row, max_col in cells_to_merge.values():
+            # 只有当范围至少包含2个单元格时才合并
+            if min_row == max_row and min_col == max_col:
+                continue
+            merge_range = f"{get_column_letter(min_col)}{min_row}:{get_column_letter(max_col)}{max_row}"
+            try:
+                sink.ws_result.merge_cells(merge_range)
+                # 设置合并后单元格的对齐方式为居中
+                sink.ws_result.cell(row=min_row, column=min_col).alignment = Alignment(horizontal='center', vertical='center')
+            except Exception as e:
+                print(f"合并单元格 {merge_range} 时出错: {str(e)}")
+
+class WorkbookWriter:
+    """
+    为结果工作簿添加边框并保存，保存失败时尝试保存到桌面
+
+    后台保存时write在启动保存线程后立即返回预留的文件路径，
+    pending为保存完成时得到实际保存路径（失败时为None）的Future对象。
+    追加模式下输出文件已存在时，只把匹配结果工作表的行追加到文件中（见xlsx_append模块）。
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.pending = None
+        self.appending = False
+
+    def write(self, wb_result, output_path):
+        """
+        返回:
+            实际保存的文件路径，保存失败时返回None
+        """
+        # 修复可能出现的文件名问题
+        if ".." in output_path:
+            output_path = output_path.replace("..", ".")
+
+        # 为结果文件中所有工作表的已使用单元格添加边框
+        for ws in wb_result.worksheets:
+            for row in ws.iter_rows(min_row=1, max_row=ws.max_row):
+                for cell in row:
+                    set_cell_borders(cell)
+
+        if self.pipeline.append:
+            # 追加模式固定写入output_path，不添加时间戳
+            safe_output_path = output_path
+            self.appending = os.path.exists(output_path)
+            sheet_name = wb_result.worksheets[0].title
+            if self.appending and not has_sheet(output_path, sheet_name):
+                raise ValueError(f"结果文件 {os.path.basename(output_path)} 中没有工作表: {sheet_name}")
+        else:
+            # 添加时间戳到文件名，并预留文件避免同时运行的任务互相覆盖
+            safe_output_path = reserve_output_path(output_path)
+
+        if self.pipeline.save_options.get("background"):
+            self.pending = Future()
+            thread = threading.Thread(target=self._save_in_background, args=(wb_result, safe_output_path),
+                                      name="excel-save")
+            thread.start()
+            return safe_output_path
+        return self.save(wb_result, safe_output_path)
+
+    def _save_in_background(self, wb_result, safe_output_path):
+        try:
+            self.pending.set_result(self.save(wb_result, safe_output_path))
+        except Exception as e:
+            self.pending.set_exception(e)
+
+    def save(self, wb_result, safe_output_path):
+        """按保存选项写入文件，并把保存耗时写入stats["save_time"]"""
+        compression = self.pipeline.save_options.get("compression")
+        started = time.perf_counter()
+        try:
+            if self.appending:
+                self.append(wb_result, safe_output_path, compression)
+            else:
+                save_workbook(wb_result, safe_output_path, compression)
+            return safe_output_path
+        except Exception as e:
+            print(f"保存文件时出错: {str(e)}")
+            if not self.appending:
+                release_output_path(safe_output_path)
+            # 尝试保存到桌面
+            desktop = os.path.join(os.path.expanduser("~"), "Desktop")
+            desktop_path = os.path.join(desktop, os.path.basename(safe_output_path))
+            try:
+                save_workbook(wb_result, desktop_path, compression)
+                return desktop_path
+            except:
+                return None
+        finally:
+            save_time = time.perf_counter() - started
+            self.pipeline.stats["save_time"] = save_time
+            print(f"保存耗时: {save_time:.2f}秒")
+
+    def append(self, wb_result, output_path, compression):
+        """把匹配结果工作表的行追加到已有文件的同名工作表"""
+        ws_result = wb_result.worksheets[0]
+        rows_appended = append_sheet_rows(output_path, ws_result.title, ws_result, compression=compression)
+        self.pipeline.stats["rows_appended"] = rows_appended
+        print(f"已追加 {rows_appended} 行到 {os.path.basename(output_path)} 的工作表 {ws_result.title}")
+
+class RowPublisher:
+    """
+    将确定输出的匹配行按批次交给回调函数
+
+    回调形式为callback(header, rows)，rows为[(文件名, 原始行号, 值元组), ...]，在处理线程中调用。
+    凑满batch_size行或距上次发送超过interval秒时发送一批，避免逐行回调的开销。
+    """
+
+    def __init__(self, callback, batch_size=500, interval=0.2):
+        self.callback = callback
+        self.batch_size = batch_size
+        self.interval = interval
+        self.header = None
+        self.batch = []
+        self.last_flush = time.perf_counter()
+
+    def set_header(self, values):
+        """使用第一个文件的表头"""
+        if self.header is None:
+            self.header = list(values)
+
+    def add(self, source_name, record):
+        self.batch.append((source_name, record.row_idx, record.values))
+        if len(self.batch) >= self.batch_size or time.perf_counter() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """发送尚未发送的行"""
+        if self.batch:
+            batch, self.batch = self.batch, []
+            try:
+                self.callback(self.header or [], batch)
+            except Exception as e:
+                print(f"匹配行回调出错: {str(e)}")
+        self.last_flush = time.perf_counter()
+
+# 各阶段的默认实现
+DEFAULT_STAGES = {
+    "reader": WorkbookSourceReader,
+    "indexer": BKeyIndexer,
+    "matcher": KeyMatcher,
+    "sink": WorkbookRowSink,
+    "merger": MergeBuilder,
+    "writer": WorkbookWriter,
+}
+
+def open_run_history(run_history):
+    """
+    根据参数得到处理记录对象
+
+    参数:
+        run_history: None或True使用默认位置的数据库，False不记录，
+                     字符串为数据库路径，也可以直接传入RunHistory对象
+    """
+    if run_history is False:
+        return None
+    if isinstance(run_history, RunHistory):
+        return run_history
+    try:
+        return RunHistory(DEFAULT_DB_PATH if run_history in (None, True) else run_history)
+    except Exception as e:
+        print(f"无法打开处理记录数据库: {str(e)}")
+        return None
+
+class MatchPipeline:
+    """
+    串联各阶段完成一次匹配处理
+
+    参数含义与process_excel_files相同；stages为阶段名称到替换实现（类）的映射。
+    """
+
+    # 预览模式使用的读取阶段
+    preview_reader_class = StreamingKeyReader
+
+    def __init__(self, file_a_paths, file_b_path, output_path, col_x, col_y, sheet_a=None, sheet_b=None, output_sheet=None, sheet_a_map=None,
+                 sheet_b_map=None, col_y_map=None, fuzzy_match=False, fuzzy_threshold=1, outputs=None,
+                 dedup=False, dedup_columns=None, dedup_keep="first", stats=None, b_index_cache=None,
+                 col_x_map=None, b_index=None, stages=None, row_callback=None, run_history=None, save_options=None,
+                 prefetch=1, b_index_backend="set", b_columns=None, b_duplicate="first", summary_columns=None,
+                 output_columns=None, row_filters=None, append=False, b_read_only=False, job_dir=None,
+                 auto_settings=None):
+        self.file_a_paths = list(file_a_paths)
+        self.file_b_path = file_b_path
+        self.output_path = output_path
+        self.col_x = col_x
+        self.col_y = col_y
+        self.sheet_a = sheet_a
+        self.sheet_b = sheet_b
+        self.output_sheet = output_sheet
+        self.sheet_a_map = sheet_a_map or {}
+        self.col_x_map = col_x_map or {}
+        self.fuzzy_match = fuzzy_match
+        self.fuzzy_threshold = fuzzy_threshold
+        self.b_index_cache = b_index_cache
+        self.b_index = b_index
+        self.stats = stats if stats is not None else {}
+
+        # 一个或多个患者库，多个时结果中追加"匹配患者库"列
+        self.file_b_paths = list(file_b_path) if isinstance(file_b_path, (list, tuple)) else [file_b_path]
+        if not self.file_b_paths:
+            raise ValueError("请至少指定一个患者库")
+        self.sheet_b_map = sheet_b_map or {}
+        self.col_y_map = col_y_map or {}
+        self.multi_library = len(self.file_b_paths) > 1
+        if self.multi_library and b_index is not None:
+            raise ValueError("预先建立的B表索引只能用于单个患者库")
+        self.library_names = [os.path.splitext(os.path.basename(path))[0] for path in self.file_b_paths]
+        self.library_labels = {}
+        self.b_values = None
+        self.b_header_keys = set()  # 各患者库表头中比较列的值，不计入患者库覆盖统计
+        if b_index_backend not in B_INDEX_BACKENDS:
+            raise ValueError(f"不支持的B表索引类型: {b_index_backend}")
+        self.b_index_backend = b_index_backend
+        self.b_read_only = b_read_only
+        # process_excel_files自动选择处理方式时的设置（见auto_tune.choose_settings），只用于处理记录
+        self.auto_settings = auto_settings
+
+        # 追加到匹配行的B表列，B表索引为键 -> 补充列的值的映射
+        if b_duplicate not in ("first", "last", "all"):
+            raise ValueError(f"不支持的重复键处理方式: {b_duplicate}")
+        self.b_columns = list(b_columns) if b_columns else None
+        self.b_duplicate = b_duplicate
+        self.b_rows = None
+        if self.b_columns and (b_index is not None or b_index_backend != "set"):
+            raise ValueError("补充B表列时需要读取B表的完整行，不能使用预先建立的索引或hashed索引")
+
+        # 预读的A表文件数，0表示逐个加载
+        if prefetch < 0:
+            raise ValueError(f"预读文件数不能为负数: {prefetch}")
+        self.prefetch = prefetch
+
+        # 解析需要生成的输出
+        self.outputs = set(outputs) if outputs is not None else {"matched"}
+        unknown_outputs = self.outputs - {"matched", "unmatched", "coverage", "summary"}
+        if unknown_outputs:
+            raise ValueError(f"不支持的输出类型: {', '.join(sorted(unknown_outputs))}")
+        self.write_matched = "matched" in self.outputs
+        self.summary_columns = summary_columns
+
+        # 追加模式只在已有结果文件的输出工作表末尾加入匹配行
+        if append and self.outputs != {"matched"}:
+            raise ValueError("追加模式只支持输出匹配行")
+        self.append = append
+
+        # 输出的A表列（按输出顺序），None表示输出所有列
+        self.output_columns = list(output_columns) if output_columns else None
+
+        # 匹配行的筛选条件，在复制整行之前只根据单元格的值判断
+        self.row_filters = [RowFilter.from_spec(spec) for spec in row_filters or []]
+        self.rows_filtered = 0
+
+        # 解析去重设置
+        if dedup_keep not in ("first", "last"):
+            raise ValueError(f"不支持的去重方式: {dedup_keep}")
+        self.dedup_keep = dedup_keep
+        self.dedup_seen = set() if dedup else None  # 只保存每行的64位指纹
+        self.dedup_columns = dedup_columns
+        self.dedup_indices = {}  # 文件序号 -> 判断列在该文件中的下标，判断列可以是表头名称
+        self.scan_fingerprints = []
+        self.duplicates_dropped = 0
+        self.deferred_files = []
+
+        # 所有文件的匹配行共用一张样式驻留表
+        self.style_table = StyleTable()
+
+        # 确定输出的匹配行按批次交给回调函数（例如界面的实时结果表）
+        self.publisher = RowPublisher(row_callback) if row_callback is not None else None
+
+        self.run_history = open_run_history(run_history)
+        self.rows_scanned = 0
+
+        # 各A表处理失败的原因；设置任务目录时保存每个文件的匹配结果，重新运行时从中断处继续
+        self.file_errors = []
+        self.job_dir = job_dir
+        self.checkpoint = None
+
+        # 解析保存选项
+        self.save_options = dict(save_options or {})
+        unknown_options = set(self.save_options) - {"compression", "background"}
+        if unknown_options:
+            raise ValueError(f"不支持的保存选项: {', '.join(sorted(unknown_options))}")
+        compression = self.save_options.get("compression")
+        if compression is not None and compression not in range(10):
+            raise ValueError(f"不支持的压缩级别: {compression}")
+
+        stage_classes = dict(DEFAULT_STAGES)
+        if stages:
+            unknown_stages = set(stages) - set(STAGE_NAMES)
+            if unknown_stages:
+                raise ValueError(f"不支持的处理阶段: {', '.join(sorted(unknown_stages))}")
+            stage_classes.update(stages)
+        self.stage_times = {name: 0.0 for name in STAGE_NAMES}
+        self.reader = stage_classes["reader"](self)
+        self.indexer = stage_classes["indexer"](self)
+        self.matcher = stage_classes["matcher"](self)
+        self.sink = stage_classes["sink"](self)
+        self.merger = stage_classes["merger"](self)
+        self.writer = stage_classes["writer"](self)
+
+    def build_index(self):
+        """建立B表索引并交给匹配阶段"""
+        with self.timed("indexer"):
+            self.b_values = self.indexer.build()
+            # 模糊匹配索引只在B表加载后建立一次
+            self.matcher.prepare(self.b_values)
+        return self.b_values
+
+    def match_keys(self, keys):
+        """用匹配阶段匹配一列键（None表示空值），匹配阶段没有match_batch时逐个调用match"""
+        match_batch = getattr(self.matcher, "match_batch", None)
+        if match_batch is not None:
+            return match_batch(keys)
+        return [None if key is None else self.matcher.match(key) for key in keys]
+
+    def library_label(self, key):
+        """B表值所在的患者库名称，多个时用顿号连接"""
+        mask = self.b_values.get(key, 0)
+        label = self.library_labels.get(mask)
+        if label is None:
+            label = "、".join(name for library_index, name in enumerate(self.library_names) if mask >> library_index & 1)
+            self.library_labels[mask] = label
+        return label
+
+    def extra_headers(self):
+        """追加在匹配行末尾的匹配信息列的表头"""
+        headers = []
+        if self.fuzzy_match:
+            headers += ["匹配得分", "匹配患者"]
+        if self.multi_library:
+            headers.append("匹配患者库")
+        if self.b_columns:
+            headers += ["" if title is None else title for title in self.b_rows.header]
+        return headers
+
+    def extra_values(self, record):
+        """一条匹配行的匹配信息列的值，与extra_headers对应"""
+        values = []
+        matched_key, score = record.match_info
+        if self.fuzzy_match:
+            values += [score, matched_key]
+        if self.multi_library:
+            values.append(self.library_label(matched_key))
+        if self.b_columns:
+            values += self.b_column_values(matched_key)
+        return values
+
+    def b_column_values(self, key):
+        """匹配到的B表值对应的补充列的值；保留所有行时每列的值用顿号连接"""
+        rows = self.b_rows.get(key)
+        if not rows:
+            return [None] * len(self.b_columns)
+        if len(rows) == 1:
+            return list(rows[0])
+        return ["、".join(dict.fromkeys(str(value) for value in column if value is not None)) or None
+                for column in zip(*rows)]
+
+    def bind_row_filters(self, header_values):
+        """按一个文件的表头确定筛选列的列号，返回[(RowFilter, 列号), ...]"""
+        return [(row_filter, resolve_column(row_filter.column, header_values)) for row_filter in self.row_filters]
+
+    @contextmanager
+    def timed(self, stage_name):
+        """累计一个阶段的耗时"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_times[stage_name] += time.perf_counter() - started
+
+    def run(self):
+        """
+        返回:
+            (匹配行数, 保存的文件路径)，没有可输出的内容或保存失败时返回(0, None)
+        """
+        started_at = time.time()
+        saved_path = None
+        error = None
+        try:
+            _, saved_path = result = self._run()
+            return result
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            pending = getattr(self.writer, "pending", None)
+            if pending is not None and error is None:
+                # 后台保存完成后再记录，耗时包含保存时间
+                self.stats["pending_save"] = pending
+                pending.add_done_callback(
+                    lambda future: self.record_history(started_at, None if future.exception() else future.result(),
+                                                       str(future.exception()) if future.exception() else None)
+                )
+            else:
+                self.record_history(started_at, saved_path, error)
+
+    def record_history(self, started_at, saved_path, error):
+        """把本次运行写入处理记录"""
+        if self.run_history is None:
+            return
+        try:
+            self.run_history.record(
+                self.file_a_paths, self.file_b_path, self.history_params(),
+                started_at, time.time() - started_at, self.stats,
+                output_path=saved_path, error=error
+            )
+        except Exception as e:
+            print(f"写入处理记录失败: {str(e)}")
+
+    def history_params(self):
+        """写入处理记录的参数，不含随每次运行变化的A表文件路径"""
+        params = {
+            "col_x": self.col_x,
+            "col_y": self.col_y,
+            "sheet_a": self.sheet_a,
+            "sheet_b": self.sheet_b,
+            "output_sheet": self.output_sheet,
+            "outputs": sorted(self.outputs),
+            "fuzzy_match": self.fuzzy_match,
+            "fuzzy_threshold": self.fuzzy_threshold if self.fuzzy_match else None,
+            "dedup": self.dedup_seen is not None,
+            "dedup_keep": self.dedup_keep if self.dedup_seen is not None else None,
+            "dedup_columns": self.dedup_columns,
+        }
+        if "summary" in self.outputs:
+            params["summary_columns"] = self.summary_columns
+        if self.output_columns:
+            params["output_columns"] = self.output_columns
+        if self.row_filters:
+            params["row_filters"] = [row_filter.spec() for row_filter in self.row_filters]
+        if self.multi_library or self.sheet_b_map or self.col_y_map:
+            params["sheet_b_map"] = self.sheet_b_map
+            params["col_y_map"] = self.col_y_map
+        if self.b_columns:
+            params["b_columns"] = self.b_columns
+            params["b_duplicate"] = self.b_duplicate
+        if self.auto_settings is not None:
+            # 自动选择的值随输入大小变化，加入任务键会把同一个任务的记录按输入大小分开，
+            # 因此只记录使用了自动模式和用户指定的压缩级别
+            params["auto"] = True
+            if self.auto_settings["compression_specified"]:
+                params["compression"] = self.save_options["compression"]
+        else:
+            # 压缩级别、预读文件数和索引类型影响耗时，只在不是默认值时加入参数，保持默认设置的任务键不变
+            if self.save_options.get("compression") is not None:
+                params["compression"] = self.save_options["compression"]
+            if self.prefetch != 1:
+                params["prefetch"] = self.prefetch
+            if self.b_index_backend != "set":
+                params["b_index_backend"] = self.b_index_backend
+            if self.b_read_only:
+                params["b_read_only"] = True
+        if self.append:
+            params["append"] = True
+        return params
+
+    def _run(self):
+        prefetcher = None
+        try:
+            completed_files = set()
+            if self.job_dir is not None:
+                fingerprint = job_fingerprint(self.file_a_paths, self.file_b_paths, self.history_params())
+                self.checkpoint = JobCheckpoint(self.job_dir, fingerprint)
+                completed_files = self.checkpoint.completed_files(self.file_a_paths)
+                if completed_files:
+                    print(f"从任务目录继续: {len(completed_files)}/{len(self.file_a_paths)} 个文件已完成，读取保存的匹配结果")
+
+            # 多个文件时在后台线程中预读后续文件，B表索引建立的同时就开始加载第一个文件
+            if self.prefetch > 0 and len(self.file_a_paths) - len(completed_files) > 1:
+                prefetcher = SourcePrefetcher(self.reader, self.file_a_paths, self.prefetch, skip=completed_files)
+
+            b_values = self.build_index()
+            self.sink.start(b_values)
+
+            for file_index, file_a_path in enumerate(self.file_a_paths):
+                if file_index in completed_files:
+                    with self.timed("reader"):
+                        file_state = self.restore_file(self.checkpoint.load_file(file_index))
+                    self.emit(file_state)
+                    continue
+
+                # 预读时reader阶段的耗时为等待预读线程的时间
+                with self.timed("reader"):
+                    source = prefetcher.get() if prefetcher is not None else self.reader.open(file_index, file_a_path)
+                try:
+                    if source is None:
+                        continue
+                    counters = (self.rows_scanned, self.rows_filtered, self.duplicates_dropped)
+                    if self.checkpoint is not None:
+                        self.sink.capture = {"unmatched_header": None, "unmatched_records": []}
+                    with self.timed("matcher"):
+                        try:
+                            file_state = self.scan(source)
+                        except Exception as e:
+                            # 与加载失败一样只跳过该文件，断点续传时重新处理
+                            print(f"处理文件 {file_a_path} 时出错: {str(e)}")
+                            self.record_file_error(file_index, file_a_path, "匹配", str(e))
+                            self.discard_scan(source, counters)
+                            file_state = None
+                    # 记录中不再引用单元格对象，A表工作簿可以随时释放
+                    source.close()
+                finally:
+                    if prefetcher is not None:
+                        prefetcher.release()
+                if file_state is None:
+                    continue
+                if self.checkpoint is not None:
+                    self.checkpoint_file(file_state, source, counters)
+                if self.publisher is not None:
+                    self.publisher.flush()
+                self.emit(file_state)
+
+            self.flush_deferred()
+
+            if self.dedup_seen is not None:
+                print(f"去重完成，共删除 {self.duplicates_dropped} 行重复数据")
+            if self.row_filters:
+                print(f"筛选条件排除了 {self.rows_filtered} 行匹配数据")
+
+            # 如果没有找到匹配的数据，且没有其他输出，返回0
+            if self.sink.total_matches == 0 and self.outputs == {"matched"}:
+                return 0, None
+
+            with self.timed("sink"):
+                self.sink.finish()
+            with self.timed("merger"):
+                self.merger.apply(self.sink)
+            with self.timed("writer"):
+                saved_path = self.writer.write(self.sink.wb_result, self.output_path)
+
+            if self.checkpoint is not None:
+                self.finish_checkpoint(saved_path)
+            if saved_path is None:
+                return 0, None
+            return self.sink.total_matches, saved_path
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
+            self.reader.close()
+            print("各阶段耗时: " + ", ".join(f"{name} {seconds:.2f}秒" for name, seconds in self.stage_times.items()))
+            self.stats["duplicates_dropped"] = self.duplicates_dropped
+            self.stats["rows_filtered"] = self.rows_filtered
+            self.stats["stage_times"] = dict(self.stage_times)
+            self.stats["rows_scanned"] = self.rows_scanned
+            self.stats["rows_matched"] = self.sink.total_matches
+            self.stats["file_errors"] = list(self.file_errors)
+            if self.file_errors:
+                print(f"{len(self.file_errors)} 个文件处理失败:")
+                for error in self.file_errors:
+                    print(f"  {os.path.basename(error['file'])}（{error['stage']}）: {error['error']}")
+                if self.checkpoint is not None:
+                    print(f"错误报告已写入任务目录 {self.job_dir}，修复后重新运行只处理失败和未完成的文件")
+
+    def preview(self, limit=20):
+        """
+        预览模式：只扫描比较列，统计每个文件的匹配行数并取出前limit条匹配行，不生成任何文件
+
+        计数不含表头行，也不做去重。
+
+        返回:
+            {
+                "total_matches": 匹配行总数,
+                "files": [{"path", "sheet", "rows", "matches", "error"}, ...],
+                "header": 第一个文件的表头值列表,
+                "rows": [{"file", "row", "values", "match", "libraries"}, ...]  前limit条匹配行，
+                        libraries为匹配到的患者库名称（只有一个患者库时为None）,
+                "stage_times": 各阶段耗时,
+            }
+        """
+        reader = self.preview_reader_class(self)
+        files = []
+        header = None
+        rows = []
+        try:
+            self.build_index()
+
+            for file_index, file_a_path in enumerate(self.file_a_paths):
+                with self.timed("reader"):
+                    column = reader.open(file_index, file_a_path)
+                if column is None:
+                    errors = [error["error"] for error in self.file_errors if error["file"] == file_a_path]
+                    files.append({"path": file_a_path, "sheet": None, "rows": 0, "matches": 0,
+                                  "error": errors[-1] if errors else "无法加载文件"})
+                    continue
+
+                try:
+                    with self.timed("matcher"):
+                        match_results = self.match_keys([
+                            None if row_idx == 1 or key is None else str(key)
+                            for row_idx, key in enumerate(column.keys, 1)
+                        ])
+                        matched = [(row_idx, match_info) for row_idx, match_info in enumerate(match_results, 1)
+                                   if match_info is not None and all(
+                                       row_filter.test(column.value_at(row_idx, col_idx))
+                                       for row_filter, col_idx in column.row_filters)]
+
+                    files.append({
+                        "path": file_a_path,
+                        "sheet": column.sheet_name,
+                        "rows": len(column.keys),
+                        "matches": len(matched),
+                        "error": None,
+                    })
+
+                    # 只读取表头和需要展示的少量匹配行
+                    wanted = matched[:max(0, limit - len(rows))]
+                    if wanted or header is None:
+                        with self.timed("reader"):
+                            fetched = column.fetch_rows(([1] if header is None else []) + [row_idx for row_idx, _ in wanted])
+                        if header is None:
+                            header = fetched.get(1, [])
+                        for row_idx, match_info in wanted:
+                            rows.append({
+                                "file": column.source_name,
+                                "row": row_idx,
+                                "values": fetched.get(row_idx, []),
+                                "match": match_info,
+                                "libraries": self.library_label(match_info[0]) if self.multi_library else None,
+                            })
+                finally:
+                    column.close()
+
+            return {
+                "total_matches": sum(item["matches"] for item in files),
+                "files": files,
+                "header": header or [],
+                "rows": rows,
+                "stage_times": dict(self.stage_times),
+            }
+        finally:
+            reader.close()
+            self.stats["stage_times"] = dict(self.stage_times)
+            self.stats["file_errors"] = list(self.file_errors)
+
+    def scan(self, source):
+        """
+        扫描一个A表，找到匹配的行
+
+        返回:
+            (文件序号, 表头记录, 匹配行记录列表, 合并单元格范围, 日期列)
+        """
+        records = []
+        # 本文件加入去重集合的指纹，扫描失败时撤销
+        self.scan_fingerprints = []
+        header_record = MatchedRow.from_cells(1, source.row_cells(1), self.style_table) if source.max_row > 0 else None
+        source_name = source.source_name
+        self.sink.start_source(source)
+        self.rows_scanned += source.max_row
+        if self.dedup_seen is not None:
+            self.dedup_indices[source.file_index] = source.value_indices(self.dedup_columns)
+        # 筛选列一般已在读取阶段按表头确定（见WorkbookSourceReader.open），其他读取阶段的结果在这里确定
+        row_filters = getattr(source, "row_filters", None)
+        if self.row_filters and not row_filters:
+            row_filters = self.bind_row_filters(source.header_values)
+
+        # 断点续传时保存去重前的匹配行：前面失败的文件重新处理后，已完成文件中哪些行重复可能不同，恢复时重新去重
+        undeduped = None
+        if self.sink.capture is not None and self.dedup_seen is not None and self.dedup_keep == "first":
+            undeduped = self.sink.capture["undeduped_records"] = []
+
+        # 保留最后一次出现时，要等所有文件扫描完才能确定输出哪些行
+        publish = self.publisher is not None and not (self.dedup_seen is not None and self.dedup_keep == "last")
+        if self.publisher is not None and header_record is not None:
+            self.publisher.set_header(header_record.values)
+
+        # 先取出整列比较值，一次交给匹配阶段；值转换为字符串进行比较，精确匹配失败时再尝试模糊匹配
+        key_values = [source.key_value(row_idx) for row_idx in range(1, source.max_row + 1)]
+        match_results = self.match_keys([None if value is None else str(value) for value in key_values])
+
+        for row_idx, (cell_value, match_info) in enumerate(zip(key_values, match_results), 1):
+            # 跳过空值
+            if cell_value is None:
+                continue
+
+            if match_info is None:
+                # 未匹配行直接写入未匹配工作表
+                self.sink.write_unmatched(source, row_idx)
+                continue
+
+            # 筛选条件只读取条件列的单元格，不满足的行不再创建记录、驻留样式
+            if row_idx > 1 and row_filters and not all(
+                row_filter.test(source.value_at(row_idx, col_idx)) for row_filter, col_idx in row_filters
+            ):
+                self.rows_filtered += 1
+                continue
+
+            # 添加整行到结果（A表已用data_only=True打开，cell.value即为函数计算结果）
+            record = MatchedRow.from_cells(row_idx, source.row_cells(row_idx), self.style_table, match_info)
+            if undeduped is not None:
+                undeduped.append(record)
+
+            # 保留第一次出现时，边扫描边用指纹集合去重（表头行始终保留）
+            if row_idx > 1 and self.dedup_seen is not None and self.dedup_keep == "first":
+                fingerprint = row_fingerprint(record.values, self.dedup_indices[source.file_index])
+                if fingerprint in self.dedup_seen:
+                    self.duplicates_dropped += 1
+                    continue
+                self.dedup_seen.add(fingerprint)
+                self.scan_fingerprints.append(fingerprint)
+
+            records.append(record)
+            if publish and row_idx > 1:
+                self.publisher.add(source_name, record)
+
+        return (source.file_index, header_record, records, source.merged_ranges, source.date_columns)
+
+    def discard_scan(self, source, counters):
+        """撤销扫描失败的A表已经更新的计数、去重指纹、未匹配行和尚未发送的匹配行"""
+        self.rows_scanned, self.rows_filtered, self.duplicates_dropped = counters
+        if self.dedup_seen is not None:
+            self.dedup_seen.difference_update(self.scan_fingerprints)
+        self.scan_fingerprints = []
+        discard_source = getattr(self.sink, "discard_source", None)
+        if discard_source is not None:
+            discard_source(source)
+        self.sink.capture = None
+        if self.publisher is not None:
+            self.publisher.batch = [row for row in self.publisher.batch if row[0] != source.source_name]
+
+    def record_file_error(self, file_index, path, stage, message):
+        """记录一个A表处理失败的原因，处理结束时汇总打印并写入stats["file_errors"]"""
+        self.file_errors.append({"file": path, "stage": stage, "error": message})
+        if self.checkpoint is not None:
+            self.checkpoint.record_error(file_index, path, stage, message)
+
+    def checkpoint_file(self, file_state, source, counters):
+        """把刚扫描完的一个A表的匹配结果和扫描时更新的状态保存到任务目录"""
+        file_index, header_record, records, merged_ranges, date_columns = file_state
+        rows_scanned, rows_filtered, duplicates_dropped = counters
+        capture, self.sink.capture = self.sink.capture, None
+        undeduped = capture.pop("undeduped_records", None)
+        payload = {
+            "file_state": (file_index, header_record, records if undeduped is None else undeduped, merged_ranges, date_columns),
+            # 记录中的样式编号对应本次运行的样式表，恢复时重新驻留
+            "styles": list(self.style_table.styles),
+            "source_names": self.sink.source_names[file_index],
+            "summary_indices": self.sink.summary_indices.get(file_index),
+            "dedup_indices": self.dedup_indices.get(file_index),
+            "rows_scanned": self.rows_scanned - rows_scanned,
+            "rows_filtered": self.rows_filtered - rows_filtered,
+            "duplicates_dropped": self.duplicates_dropped - duplicates_dropped,
+            "capture": capture,
+        }
+        self.checkpoint.save_file(file_index, source.path, payload, sum(1 for record in records if record.row_idx > 1))
+
+    def restore_file(self, payload):
+        """
+        读取任务目录中一个已完成A表的匹配结果，恢复扫描该文件时更新的状态
+
+        返回:
+            与scan相同的匹配结果
+        """
+        file_state = payload["file_state"]
+        file_index, header_record, records, _, _ = file_state
+        capture = payload["capture"]
+
+        styles = payload["styles"]
+        style_ids = {}
+        for record in [header_record, capture["unmatched_header"], *records, *capture["unmatched_records"]]:
+            if record is None:
+                continue
+            for style_id in record.style_ids:
+                if style_id not in style_ids:
+                    style_ids[style_id] = self.style_table.intern_style(*styles[style_id])
+            record.style_ids = array("I", [style_ids[style_id] for style_id in record.style_ids])
+
+        self.sink.source_names[file_index] = tuple(payload["source_names"])
+        if payload["summary_indices"] is not None:
+            self.sink.summary_indices[file_index] = payload["summary_indices"]
+        self.rows_scanned += payload["rows_scanned"]
+        self.rows_filtered += payload["rows_filtered"]
+        if self.dedup_seen is not None:
+            self.dedup_indices[file_index] = payload["dedup_indices"]
+        if self.dedup_seen is not None and self.dedup_keep == "first":
+            # 保存的是去重前的匹配行，按本次运行已经输出的行重新去重
+            kept = []
+            for record in records:
+                if record.row_idx > 1:
+                    fingerprint = row_fingerprint(record.values, payload["dedup_indices"])
+                    if fingerprint in self.dedup_seen:
+                        self.duplicates_dropped += 1
+                        continue
+                    self.dedup_seen.add(fingerprint)
+                kept.append(record)
+            records = kept
+            file_state = (file_index, header_record, records, file_state[3], file_state[4])
+        else:
+            self.duplicates_dropped += payload["duplicates_dropped"]
+        self.sink.replay(capture, file_state[4])
+
+        if self.publisher is not None and not (self.dedup_seen is not None and self.dedup_keep == "last"):
+            if header_record is not None:
+                self.publisher.set_header(header_record.values)
+            source_name = self.sink.source_names[file_index][0]
+            for record in records:
+                if record.row_idx > 1:
+                    self.publisher.add(source_name, record)
+            self.publisher.flush()
+        return file_state
+
+    def finish_checkpoint(self, saved_path):
+        """记录任务目录对应的结果文件，后台保存时在保存完成后记录"""
+        pending = getattr(self.writer, "pending", None)
+        if pending is not None:
+            pending.add_done_callback(
+                lambda future: self.checkpoint.finish(None if future.exception() else future.result())
+            )
+        elif saved_path is None:
+            print(f"保存结果文件失败，各文件的匹配结果保留在任务目录 {self.job_dir}，重新运行只需重新保存")
+        else:
+            self.checkpoint.finish(saved_path)
+
+    def emit(self, file_state):
+        """将一个文件的匹配结果交给sink"""
+        # 保留最后一次出现时需要先扫描完所有文件，暂存匹配结果
+        if self.dedup_seen is not None and self.dedup_keep == "last":
+            self.deferred_files.append(file_state)
+            return
+
+        with self.timed("sink"):
+            self.sink.write_matches(*file_state)
+
+    def flush_deferred(self):
+        """保留最后一次出现：先记录每个指纹最后出现的位置，再按原顺序写入"""
+        if not self.deferred_files:
+            return
+
+        last_positions = {}
+        for file_index, _, records, _, _ in self.deferred_files:
+            for record in records:
+                if record.row_idx > 1:
+                    last_positions[row_fingerprint(record.values, self.dedup_indices[file_index])] = (file_index, record.row_idx)
+
+        for file_state in self.deferred_files:
+            file_index, _, records, _, _ = file_state
+            keep_positions = []
+            for pos, record in enumerate(records):
+                if record.row_idx == 1 or last_positions[row_fingerprint(record.values, self.dedup_indices[file_index])] == (file_index, record.row_idx):
+                    keep_positions.append(pos)
+                    if self.publisher is not None and record.row_idx > 1:
+                        self.publisher.add(os.path.basename(self.file_a_paths[file_index]), record)
+                else:
+                    self.duplicates_dropped += 1
+            with self.timed("sink"):
+                self.sink.write_matches(*select_file_matches(file_state, keep_positions))
+        self.deferred_files = []
+        if self.publisher is not None:
+            self.publisher.flush()
+
+def benchmark_pipeline(params, stages=None, repeat=3):
+    """
+    多次运行流水线，比较各阶段的耗时
+
+    参数:
+        params: 传给MatchPipeline的参数字典
+        stages: 要替换的阶段实现，与MatchPipeline的stages参数相同
+        repeat: 运行次数
+
+    返回:
+        阶段名称 -> 多次运行中的最短耗时（秒）。基准测试生成的结果文件会被删除
+    """
+    best = {}
+    for _ in range(repeat):
+        stats = {}
+        params = dict(params, stats=stats)
+        _, saved_path = MatchPipeline(stages=stages, run_history=False, **params).run()
+        if "pending_save" in stats:
+            saved_path = stats["pending_save"].result()
+        if saved_path and os.path.exists(saved_path):
+            os.remove(saved_path)
+        for name, seconds in stats["stage_times"].items():
+            best[name] = min(best.get(name, seconds), seconds)
+
+    for name in STAGE_NAMES:
+        print(f"{name:<8} {best[name]:.3f}秒")
+    return best
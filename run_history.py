@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+处理记录
+每次运行process_excel_files时把输入、参数、各阶段耗时、行数、内存和输出大小写入本地SQLite数据库，
+用于观察报表逐月变大后处理速度的变化。
+
+查看记录:
+    python run_history.py               最近的运行记录，明显变慢的运行会被标记
+    python run_history.py --jobs        按任务汇总
+    python run_history.py --job <任务键> 只看某个任务
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import statistics
+from contextlib import closing, contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# 默认的记录数据库位置
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser("~"), ".excel_processor", "run_history.sqlite3")
+
+# 计算文件指纹时读取的头尾字节数
+FINGERPRINT_SAMPLE_SIZE = 64 * 1024
+
+# 每千行耗时超过同一任务历史中位数的倍数时标记为变慢
+SLOW_FACTOR = 1.5
+
+# 至少有多少条历史记录才判断是否变慢
+MIN_HISTORY = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_key TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    duration REAL,
+    status TEXT NOT NULL,
+    error TEXT,
+    params TEXT,
+    stage_times TEXT,
+    file_count INTEGER,
+    input_bytes INTEGER,
+    rows_scanned INTEGER,
+    rows_matched INTEGER,
+    peak_memory INTEGER,
+    output_path TEXT,
+    output_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_runs_job ON runs(job_key, started_at);
+CREATE TABLE IF NOT EXISTS run_inputs (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    role TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_run_inputs_run ON run_inputs(run_id);
+"""
+
+def file_fingerprint(path):
+    """
+    计算文件的抽样指纹：文件大小加上开头和末尾各64KB内容的哈希
+
+    完整哈希大文件的开销与一次处理相当，抽样足以区分不同版本的报表。
+    文件不存在时返回None
+    """
+    try:
+        size = os.path.getsize(path)
+        digest = hashlib.blake2b(str(size).encode("ascii"), digest_size=16)
+        with open(path, "rb") as f:
+            digest.update(f.read(FINGERPRINT_SAMPLE_SIZE))
+            if size > FINGERPRINT_SAMPLE_SIZE:
+                f.seek(max(FINGERPRINT_SAMPLE_SIZE, size - FINGERPRINT_SAMPLE_SIZE))
+                digest.update(f.read(FINGERPRINT_SAMPLE_SIZE))
+        return digest.hexdigest()
+    except OSError:
+        return None
+
+def file_size(path):
+    """文件大小，文件不存在时返回None"""
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
+
+def peak_memory_bytes():
+    """
+    当前进程的峰值内存（字节），无法获取时返回None
+
+    注意这是整个进程生命周期内的峰值，界面中连续运行多个任务时只会增加不会减少
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux单位为KB，macOS单位为字节
+        return peak if sys.platform == "darwin" else peak * 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    return None
+
+def job_key(file_b_path, params):
+    """
+    任务键：患者库和处理参数相同的运行视为同一个任务
+
+    不包含A表文件列表，每天处理新日报表的运行也能和以前的记录比较。file_b_path可以是多个患者库的列表
+    """
+    if isinstance(file_b_path, (list, tuple)):
+        b_source = [os.path.abspath(str(path)) for path in file_b_path]
+    else:
+        b_source = os.path.abspath(str(file_b_path))
+    key_source = json.dumps([b_source, params], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(key_source.encode("utf-8"), digest_size=6).hexdigest()
+
+class RunHistory:
+    """SQLite中的处理记录，每次写入或查询都使用独立的连接，可在多个工作线程中同时使用"""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = db_path
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # sqlite3连接的with语句只提交或回滚事务，不会关闭连接，因此用closing在每次使用后关闭
+        with closing(sqlite3.connect(self.db_path, timeout=10)) as conn:
+            conn.row_factory = sqlite3.Row
+            with conn:
+                yield conn
+
+    def record(self, file_a_paths, file_b_path, params, started_at, duration, stats,
+               output_path=None, error=None):
+        """
+        写入一次运行的记录
+
+        参数:
+            file_a_paths: A表文件路径列表
+            file_b_path: B表文件路径，或多个患者库的路径列表
+            params: 影响结果的处理参数（可JSON序列化的字典）
+            started_at: 开始时间（time.time()）
+            duration: 总耗时（秒）
+            stats: process_excel_files写入的统计字典
+            output_path: 保存的结果文件路径
+            error: 运行失败时的错误信息
+
+        返回:
+            记录编号
+        """
+        inputs = [("a", path) for path in file_a_paths]
+        file_b_paths = file_b_path if isinstance(file_b_path, (list, tuple)) else [file_b_path]
+        inputs.extend(("b", path) for path in file_b_paths if isinstance(path, str))
+        input_rows = [(role, os.path.abspath(path), file_size(path), file_fingerprint(path)) for role, path in inputs]
+
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """INSERT INTO runs (job_key, started_at, duration, status, error, params, stage_times,
+                                     file_count, input_bytes, rows_scanned, rows_matched, peak_memory,
+                                     output_path, output_bytes)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    job_key(file_b_path, params), started_at, duration,
+                    "failed" if error else "done", error,
+                    json.dumps(params, ensure_ascii=False, default=str),
+                    json.dumps(stats.get("stage_times", {})),
+                    len(file_a_paths),
+                    sum(size for _, _, size, _ in input_rows if size),
+                    stats.get("rows_scanned"), stats.get("rows_matched"),
+                    peak_memory_bytes(),
+                    output_path, file_size(output_path),
+                )
+            )
+            run_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO run_inputs (run_id, role, path, size, fingerprint) VALUES (?, ?, ?, ?, ?)",
+                [(run_id,) + row for row in input_rows]
+            )
+        return run_id
+
+    def runs(self, job=None, limit=50):
+        """最近的运行记录（按时间从早到晚），每条记录附带与历史相比的变慢标记"""
+        query = "SELECT * FROM runs"
+        args = []
+        if job:
+            query += " WHERE job_key = ?"
+            args.append(job)
+        query += " ORDER BY started_at DESC, id DESC LIMIT ?"
+        args.append(limit)
+        with self._connect() as conn:
+            rows = [dict(row) for row in conn.execute(query, args)]
+        rows.reverse()
+
+        for row in rows:
+            row["stage_times"] = json.loads(row["stage_times"] or "{}")
+            row["ms_per_krow"] = ms_per_krow(row)
+            row["baseline"], row["slow"] = self._compare_with_history(row)
+        return rows
+
+    def jobs(self):
+        """按任务汇总：运行次数、最近一次运行时间、平均耗时"""
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(
+                """SELECT job_key, COUNT(*) AS run_count, MAX(started_at) AS last_run,
+                          AVG(duration) AS avg_duration, MAX(rows_scanned) AS max_rows, params
+                   FROM runs GROUP BY job_key ORDER BY last_run DESC"""
+            )]
+
+    def _compare_with_history(self, run):
+        """与同一任务之前成功的运行比较每千行耗时，返回(历史中位数, 是否明显变慢)"""
+        if run["status"] != "done" or run["ms_per_krow"] is None:
+            return None, False
+        with self._connect() as conn:
+            previous = [dict(row) for row in conn.execute(
+                """SELECT duration, rows_scanned FROM runs
+                   WHERE job_key = ? AND status = 'done' AND id < ?
+                   ORDER BY id DESC LIMIT 20""",
+                (run["job_key"], run["id"])
+            )]
+        history = [value for value in (ms_per_krow(row) for row in previous) if value is not None]
+        if len(history) < MIN_HISTORY:
+            return None, False
+        baseline = statistics.median(history)
+        return baseline, run["ms_per_krow"] > baseline * SLOW_FACTOR
+
+def ms_per_krow(run):
+    """每千行扫描耗时（毫秒），按行数归一化后报表变大本身不会被当作变慢"""
+    if not run.get("duration") or not run.get("rows_scanned"):
+        return None
+    return run["duration"] * 1000 / (run["rows_scanned"] / 1000)
+
+def format_bytes(size):
+    if size is None:
+        return "-"
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+
+def print_runs(history, job=None, limit=50):
+    """打印运行记录和变慢标记"""
+    runs = history.runs(job=job, limit=limit)
+    if not runs:
+        print("没有运行记录")
+        return
+    print(f"{'编号':>6} {'时间':<19} {'任务键':<12} {'文件':>4} {'输入':>9} {'扫描行':>9} {'匹配行':>8} "
+          f"{'耗时':>8} {'毫秒/千行':>9} {'峰值内存':>9} {'输出':>9}  状态")
+    for run in runs:
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run["started_at"]))
+        per_krow = f"{run['ms_per_krow']:.1f}" if run["ms_per_krow"] is not None else "-"
+        status = f"失败: {run['error']}" if run["status"] == "failed" else "完成"
+        if run["slow"]:
+            status += f"  ⚠ 比历史中位数({run['baseline']:.1f})慢{run['ms_per_krow'] / run['baseline']:.1f}倍"
+        print(f"{run['id']:>6} {started:<19} {run['job_key']:<12} {run['file_count'] or 0:>4} "
+              f"{format_bytes(run['input_bytes']):>9} {run['rows_scanned'] or 0:>9} {run['rows_matched'] or 0:>8} "
+              f"{(run['duration'] or 0):>7.1f}s {per_krow:>9} {format_bytes(run['peak_memory']):>9} "
+              f"{format_bytes(run['output_bytes']):>9}  {status}")
+        if run["slow"] and run["stage_times"]:
+            stages = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in run["stage_times"].items())
+            print(f"{'':>6} 各阶段耗时: {stages}")
+
+def print_jobs(history):
+    """打印按任务汇总的信息"""
+    jobs = history.jobs()
+    if not jobs:
+        print("没有运行记录")
+        return
+    print(f"{'任务键':<12} {'次数':>5} {'最近运行':<19} {'平均耗时':>8} {'最大行数':>9}  参数")
+    for job in jobs:
+        last_run = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(job["last_run"]))
+        print(f"{job['job_key']:<12} {job['run_count']:>5} {last_run:<19} {(job['avg_duration'] or 0):>7.1f}s "
+              f"{job['max_rows'] or 0:>9}  {job['params']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Excel数据处理工具 - 处理记录")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="记录数据库路径")
+    parser.add_argument("--job", default=None, help="只显示指定任务键的记录")
+    parser.add_argument("--jobs", action="store_true", help="按任务汇总")
+    parser.add_argument("--limit", type=int, default=50, help="显示的记录条数")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"记录数据库不存在: {args.db}")
+        return
+    history = RunHistory(args.db)
+    if args.jobs:
+        print_jobs(history)
+    else:
+        print_runs(history, job=args.job, limit=args.limit)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+"""测试公用的夹具：在临时目录中生成日报表（A表）和患者库（B表）"""
+
+import os
+import sys
+import datetime
+
+import pytest
+import openpyxl
+
+# 项目模块都在仓库根目录下
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+A_HEADER = ["序号", "日期", "患者姓名", "金额", "备注"]
+
+def write_workbook(path, header, rows, sheet_title=None):
+    """写入一个只有一个工作表的工作簿"""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    if sheet_title:
+        ws.title = sheet_title
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+    return path
+
+@pytest.fixture
+def make_a(tmp_path):
+    """生成日报表，默认5行数据"""
+    def make(name="a.xlsx", rows=None, header=A_HEADER):
+        if rows is None:
+            rows = [
+                [1, datetime.datetime(2025, 5, 3), "张三", 100, "复诊"],
+                [2, "2025-05-01", "李四", 0, "初诊"],
+                [3, "2025-05-02", "陌生人", 50, ""],
+                [4, "5月3日", "王五", 20, "复诊"],
+                [5, "2025/5/4", "赵六", 30, "初诊"],
+            ]
+        return str(write_workbook(tmp_path / name, header, rows, sheet_title="5.3"))
+    return make
+
+@pytest.fixture
+def make_b(tmp_path):
+    """生成患者库"""
+    def make(name="b.xlsx", rows=None, header=("姓名", "电话", "医生")):
+        if rows is None:
+            rows = [("张三", "111", "刘"), ("李四", "222", "陈"), ("王五", "333", "刘"), ("赵六", "444", "周")]
+        return str(write_workbook(tmp_path / name, list(header), rows))
+    return make
+
+@pytest.fixture
+def run_match(tmp_path):
+    """调用process_excel_files并返回(匹配行数, 结果路径, stats)，不写处理记录"""
+    from excel_processor import process_excel_files
+
+    def run(file_a_paths, file_b_path, col_x="C", col_y="A", output_name="out.xlsx", **kwargs):
+        stats = {}
+        kwargs.setdefault("run_history", False)
+        count, saved_path = process_excel_files(file_a_paths, file_b_path, str(tmp_path / output_name),
+                                                col_x, col_y, stats=stats, **kwargs)
+        return count, saved_path, stats
+    return run
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import re
+import zipfile
+
+import openpyxl
+
+from xlsx_append import find_sheet_part
+
+def sheet_part_info(path):
+    with zipfile.ZipFile(path) as archive:
+        return archive.getinfo(find_sheet_part(archive, None))
+
+def style_counts(path):
+    with zipfile.ZipFile(path) as archive:
+        styles = archive.read("xl/styles.xml").decode("utf-8")
+    return {element: int(re.search(rf'<{element}\b[^>]*\bcount="(\d+)"', styles).group(1))
+            for element in ("cellXfs", "borders")}
+
+def test_append_adds_rows_after_existing(make_a, make_b, run_match):
+    b_path = make_b()
+    _, saved_path, _ = run_match([make_a("a1.xlsx")], b_path, append=True)
+    _, appended_path, stats = run_match([make_a("a2.xlsx")], b_path, append=True)
+    assert appended_path == saved_path
+    assert stats["rows_appended"] == 4
+    ws = openpyxl.load_workbook(saved_path).active
+    assert ws.max_row == 9
+    assert [ws.cell(row_idx, 3).value for row_idx in range(2, 10)] == ["张三", "李四", "王五", "赵六"] * 2
+
+def test_appended_sheet_part_stays_compressed(make_a, make_b, run_match):
+    b_path = make_b()
+    _, saved_path, _ = run_match([make_a()], b_path, append=True)
+    run_match([make_a()], b_path, append=True)
+    assert sheet_part_info(saved_path).compress_type == zipfile.ZIP_DEFLATED
+
+def test_append_without_compression_stores_sheet_part(make_a, make_b, run_match):
+    b_path = make_b()
+    _, saved_path, _ = run_match([make_a()], b_path, append=True)
+    run_match([make_a()], b_path, append=True, save_options={"compression": 0})
+    assert sheet_part_info(saved_path).compress_type == zipfile.ZIP_STORED
+
+def test_repeated_append_does_not_grow_styles(make_a, make_b, run_match):
+    b_path = make_b()
+    _, saved_path, _ = run_match([make_a()], b_path, append=True)
+    run_match([make_a()], b_path, append=True)
+    counts = style_counts(saved_path)
+    for _ in range(3):
+        run_match([make_a()], b_path, append=True)
+    assert style_counts(saved_path) == counts
+    assert openpyxl.load_workbook(saved_path).active.max_row == 1 + 4 * 5
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import openpyxl
+import pytest
+
+from library_store import LibraryStore
+
+B_ROWS = [("张三", "111", "刘"), ("李四", "222", "陈"), ("张三", "999", "王"), ("张三", "111", None)]
+
+@pytest.mark.parametrize("b_duplicate, expected", [
+    ("first", ("111", "刘")),
+    ("last", ("111", None)),
+    # 保留所有行时各列的值去重后用顿号连接
+    ("all", ("111、999", "刘、王")),
+])
+@pytest.mark.parametrize("library", ["xlsx", "store"])
+def test_b_columns_follow_duplicate_rule(tmp_path, make_a, make_b, run_match, b_duplicate, expected, library):
+    b_path = make_b(rows=B_ROWS)
+    if library == "store":
+        store_path = str(tmp_path / "b.sqlite3")
+        LibraryStore(store_path).import_workbook(b_path)
+        b_path = store_path
+    count, saved_path, _ = run_match([make_a()], b_path, b_columns=["电话", "C"], b_duplicate=b_duplicate)
+    assert count == 2
+    rows = list(openpyxl.load_workbook(saved_path).active.iter_rows(values_only=True))
+    assert rows[0][-2:] == ("电话", "医生")
+    assert {row[2]: row[-2:] for row in rows[1:]} == {"张三": expected, "李四": ("222", "陈")}
+
+def test_b_columns_merge_across_libraries(make_a, make_b, run_match):
+    libraries = [make_b("b1.xlsx", rows=[("张三", "111", "刘")]),
+                 make_b("b2.xlsx", rows=[("张三", "999", "王"), ("王五", "333", "刘")])]
+    _, saved_path, _ = run_match([make_a()], libraries, b_columns=["医生"], b_duplicate="last")
+    rows = list(openpyxl.load_workbook(saved_path).active.iter_rows(values_only=True))
+    assert rows[0][-2:] == ("匹配患者库", "医生")
+    assert [(row[2],) + row[-2:] for row in rows[1:]] == [("张三", "b1、b2", "王"), ("王五", "b2", "刘")]
+
+def test_unknown_b_column_is_rejected(make_a, make_b, run_match):
+    with pytest.raises(ValueError):
+        run_match([make_a()], make_b(), b_columns=["地址"])
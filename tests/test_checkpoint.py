@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+
+import openpyxl
+
+from checkpoint import PROGRESS_FILE, job_fingerprint
+from pipeline import WorkbookRowSink
+
+def read_progress(job_dir):
+    with open(os.path.join(job_dir, PROGRESS_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+def test_resume_reuses_completed_files(tmp_path, make_a, make_b, run_match):
+    job_dir = str(tmp_path / "job")
+    good = make_a("a1.xlsx")
+    bad = str(tmp_path / "a2.xlsx")
+    with open(bad, "wb") as f:
+        f.write(b"not a workbook")
+    b_path = make_b()
+
+    count, _, stats = run_match([good, bad], b_path, job_dir=job_dir, dedup=True)
+    assert count == 4
+    assert [(error["file"], error["stage"]) for error in stats["file_errors"]] == [(bad, "加载")]
+    assert os.path.exists(os.path.join(job_dir, "errors.txt"))
+
+    first_done = read_progress(job_dir)["files"]["0"]
+
+    # 修复损坏的文件后重新运行，只处理该文件；统计信息包含读取的已完成文件
+    make_a("a2.xlsx")
+    count, saved_path, stats = run_match([good, bad], b_path, job_dir=job_dir, dedup=True, output_name="out2.xlsx")
+    files = read_progress(job_dir)["files"]
+    assert files["0"] == first_done
+    assert files["1"]["status"] == "done"
+    assert stats["rows_scanned"] == 12
+    assert not stats["file_errors"]
+    assert not os.path.exists(os.path.join(job_dir, "errors.txt"))
+
+    _, plain_path, _ = run_match([good, bad], b_path, dedup=True, output_name="plain.xlsx")
+    values = lambda path: list(openpyxl.load_workbook(path).active.iter_rows(values_only=True))
+    assert values(saved_path) == values(plain_path)
+    assert count == 4
+
+def test_fingerprint_ignores_timing_params_but_not_append(make_a, make_b):
+    files, libraries = [make_a()], [make_b()]
+    base = job_fingerprint(files, libraries, {"col_x": "C"})
+    assert job_fingerprint(files, libraries, {"col_x": "C", "prefetch": 2, "auto": True}) == base
+    assert job_fingerprint(files, libraries, {"col_x": "C", "append": True}) != base
+
+def test_switching_append_mode_starts_over(tmp_path, make_a, make_b, run_match):
+    job_dir = str(tmp_path / "job")
+    files, b_path = [make_a()], make_b()
+    run_match(files, b_path, job_dir=job_dir)
+    first_done = read_progress(job_dir)["files"]["0"]
+    run_match(files, b_path, job_dir=job_dir, append=True, output_name="appended.xlsx")
+    assert read_progress(job_dir)["files"]["0"]["finished_at"] > first_done["finished_at"]
+
+class FailingSink(WorkbookRowSink):
+    """写入bad.xlsx中"路人"所在的未匹配行时出错"""
+
+    def write_unmatched(self, source, row_idx):
+        if source.source_name == "bad.xlsx" and source.key_value(row_idx) == "路人":
+            raise RuntimeError("写入失败")
+        super().write_unmatched(source, row_idx)
+
+def test_scan_error_skips_only_that_file(tmp_path, make_a, make_b, run_match):
+    job_dir = str(tmp_path / "job")
+    bad = make_a("bad.xlsx")
+    workbook = openpyxl.load_workbook(bad)
+    workbook.active.append([6, "2025-05-05", "路人", 0, ""])
+    workbook.save(bad)
+    good = make_a("good.xlsx")
+
+    count, saved_path, stats = run_match([bad, good], make_b(), job_dir=job_dir, dedup=True,
+                                         outputs=["matched", "unmatched"], stages={"sink": FailingSink})
+    assert [(error["file"], error["stage"]) for error in stats["file_errors"]] == [(bad, "匹配")]
+    assert read_progress(job_dir)["files"]["0"]["status"] == "failed"
+    # 失败文件加入的去重指纹、计数和未匹配行都已撤销
+    assert count == 4
+    assert stats["duplicates_dropped"] == 0
+    assert stats["rows_scanned"] == 6
+    unmatched = list(openpyxl.load_workbook(saved_path)["未匹配"].iter_rows(values_only=True))
+    assert [row[2] for row in unmatched] == ["患者姓名", "陌生人"]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import openpyxl
+import pytest
+
+from conftest import A_HEADER
+from excel_processor import resolve_column, find_header_row, process_excel_files
+
+HEADER = ["序号", "ID", "Age", "SEX", "患者姓名"]
+
+@pytest.mark.parametrize("col, expected", [
+    ("ID", 2), ("Age", 3), (" SEX ", 4), ("患者姓名", 5),
+    ("C", 3), ("e", 5), (3, 3), ("3", 3),
+])
+def test_resolve_column(col, expected):
+    assert resolve_column(col, HEADER) == expected
+
+def test_letters_without_matching_header_are_column_letters():
+    assert resolve_column("ID", ["序号", "姓名"]) == 238
+    assert resolve_column("ID") == 238
+
+def test_unknown_header_name_raises():
+    with pytest.raises(ValueError):
+        resolve_column("电话", HEADER)
+
+def test_header_named_like_column_letters_selects_header_column(make_a, make_b, run_match):
+    header = ["序号", "ID", "备注"]
+    a_path = make_a(header=header, rows=[[1, "张三", "x"], [2, "陌生人", "y"], [3, "李四", "z"]])
+    count, _, _ = run_match([a_path], make_b(), col_x="ID")
+    assert count == 2
+
+def make_titled_a(make_a):
+    """第一行为标题、第二行为表头的日报表"""
+    rows = [A_HEADER, [1, "2025-05-03", "张三", 100, "复诊"], [2, "2025-05-03", "李四", 0, "初诊"],
+            [3, "2025-05-03", "王五", 20, "复诊"], [4, "2025-05-03", "陌生人", 50, ""]]
+    return make_a("titled.xlsx", header=["5月3日门诊日报表"], rows=rows)
+
+def test_find_header_row_skips_title_row(make_a):
+    ws = openpyxl.load_workbook(make_titled_a(make_a)).active
+    max_row = ws.max_row
+    assert find_header_row(ws) == (2, tuple(A_HEADER))
+    assert ws.max_row == max_row
+    ws = openpyxl.load_workbook(make_a()).active
+    assert find_header_row(ws) == (1, tuple(A_HEADER))
+
+@pytest.mark.parametrize("preview", [False, True])
+def test_header_names_resolve_below_title_row(tmp_path, make_a, make_b, preview):
+    options = dict(output_columns=["患者姓名", "金额"], row_filters=[("金额", ">", 0)], dedup=True,
+                   dedup_columns=["患者姓名"], summary_columns=["金额"], outputs=["matched", "summary"], preview=preview, run_history=False)
+    stats = {}
+    result = process_excel_files([make_titled_a(make_a)], make_b(), None if preview else str(tmp_path / "out.xlsx"),
+                                 "患者姓名", "A", stats=stats, **options)
+    assert not stats["file_errors"]
+    if preview:
+        assert result["total_matches"] == 2
+        assert [row["values"] for row in result["rows"]] == [["张三", 100], ["王五", 20]]
+    else:
+        count, saved_path = result
+        assert count == 2
+        rows = list(openpyxl.load_workbook(saved_path)["匹配结果"].iter_rows(values_only=True))
+        assert [row[:2] for row in rows[-2:]] == [("张三", 100), ("王五", 20)]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import openpyxl
+import pytest
+
+from library_store import LibraryStore
+
+def coverage_rows(path):
+    ws = openpyxl.load_workbook(path)["患者库覆盖"]
+    return {row[0]: row[1:3] for row in ws.iter_rows(min_row=2, values_only=True)}
+
+@pytest.mark.parametrize("library", ["xlsx", "store", "multi"])
+def test_coverage_leaves_out_b_header(tmp_path, make_a, make_b, run_match, library):
+    b_path = make_b()
+    if library == "store":
+        store_path = str(tmp_path / "b.sqlite3")
+        LibraryStore(store_path).import_workbook(b_path)
+        b_path = store_path
+    elif library == "multi":
+        b_path = [b_path, make_b("b2.xlsx", rows=[("孙七", "555", "吴")], header=("患者", "电话", "医生"))]
+    _, saved_path, _ = run_match([make_a()], b_path, outputs=["matched", "coverage"])
+    rows = coverage_rows(saved_path)
+    assert "姓名" not in rows and "患者" not in rows
+    assert rows["李四"][0] == 1
+    if library == "multi":
+        assert rows["孙七"][0] == 0
+
+@pytest.mark.parametrize("dedup_keep", ["first", "last"])
+def test_coverage_counts_rows_kept_after_dedup(tmp_path, make_a, make_b, run_match, dedup_keep):
+    a1, a2 = make_a("a1.xlsx"), make_a("a2.xlsx")
+    _, saved_path, stats = run_match([a1, a2], make_b(), outputs=["matched", "coverage"],
+                                     dedup=True, dedup_keep=dedup_keep)
+    assert stats["duplicates_dropped"] == 4
+    # 去重删除的行不计入命中次数和出现文件
+    kept = "a1.xlsx" if dedup_keep == "first" else "a2.xlsx"
+    assert coverage_rows(saved_path) == {name: (1, kept) for name in ("张三", "李四", "王五", "赵六")}
+
+def test_coverage_after_resume_matches_plain_run(tmp_path, make_a, make_b, run_match):
+    a1, a2 = make_a("a1.xlsx"), make_a("a2.xlsx")
+    b_path = make_b()
+    options = dict(outputs=["matched", "coverage"], dedup=True)
+    job_dir = str(tmp_path / "job")
+    run_match([a1, a2], b_path, job_dir=job_dir, **options)
+    _, resumed_path, _ = run_match([a1, a2], b_path, job_dir=job_dir, output_name="resumed.xlsx", **options)
+    _, plain_path, _ = run_match([a1, a2], b_path, output_name="plain.xlsx", **options)
+    assert coverage_rows(resumed_path) == coverage_rows(plain_path)
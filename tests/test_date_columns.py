@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+import openpyxl
+
+from excel_processor import DateColumnConverter, find_date_columns, DATE_SAMPLE_ROWS
+
+def test_find_date_columns_does_not_grow_sheet(make_a):
+    ws = openpyxl.load_workbook(make_a()).active
+    assert ws.max_row == 6
+    date_columns = find_date_columns(ws)
+    assert list(date_columns) == [2]
+    assert ws.max_row == 6
+
+def test_rows_scanned_counts_only_real_rows(make_a, make_b, run_match):
+    files = [make_a("a1.xlsx"), make_a("a2.xlsx")]
+    count, saved_path, stats = run_match(files, make_b())
+    # 每个文件6行（含表头）
+    assert stats["rows_scanned"] == 12
+    assert count == 8
+    assert openpyxl.load_workbook(saved_path).active.max_row == 9
+
+def test_sample_rows_are_still_limited(make_a):
+    rows = [[index, "2025-05-01", "张三", 1, ""] for index in range(DATE_SAMPLE_ROWS * 2)]
+    ws = openpyxl.load_workbook(make_a(rows=rows)).active
+    find_date_columns(ws)
+    assert ws.max_row == DATE_SAMPLE_ROWS * 2 + 1
+
+def test_month_day_text_uses_current_year():
+    this_year = datetime.date.today().year
+    converter = DateColumnConverter()
+    assert converter.convert("5月3日").year == this_year
+
+    # 模拟去年建立的转换器（长时间运行的服务跨年），缓存中上一年的结果不再使用
+    converter._cache_year = this_year - 1
+    converter._cache["5月3日"] = datetime.datetime(this_year - 1, 5, 3)
+    assert converter.convert("5月3日") == datetime.datetime(this_year, 5, 3)
+
+def test_explicit_year_is_kept():
+    assert DateColumnConverter(year=2020).convert("5月3日") == datetime.datetime(2020, 5, 3)
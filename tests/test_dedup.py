@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import openpyxl
+import pytest
+
+from conftest import A_HEADER
+
+def make_pair(make_a):
+    """两个日报表：患者相同，备注不同"""
+    first = make_a("a1.xlsx")
+    rows = list(openpyxl.load_workbook(first).active.iter_rows(min_row=2, values_only=True))
+    second = make_a("a2.xlsx", rows=[list(row[:4]) + ["第二份"] for row in rows])
+    return first, second
+
+def matched_rows(path):
+    return list(openpyxl.load_workbook(path).active.iter_rows(min_row=2, values_only=True))
+
+@pytest.mark.parametrize("dedup_keep, remark", [("first", "复诊"), ("last", "第二份")])
+def test_dedup_columns_keep_first_or_last_across_files(make_a, make_b, run_match, dedup_keep, remark):
+    first, second = make_pair(make_a)
+    count, saved_path, stats = run_match([first, second], make_b(), dedup=True, dedup_columns=["患者姓名"],
+                                         dedup_keep=dedup_keep)
+    assert count == 4
+    assert stats["duplicates_dropped"] == 4
+    rows = matched_rows(saved_path)
+    assert [row[2] for row in rows] == ["张三", "李四", "王五", "赵六"]
+    assert rows[0][4] == remark
+
+def test_whole_row_dedup_keeps_rows_that_differ_in_any_column(make_a, make_b, run_match):
+    first, second = make_pair(make_a)
+    count, _, stats = run_match([first, second], make_b(), dedup=True)
+    assert count == 8
+    assert stats["duplicates_dropped"] == 0
+
+    count, saved_path, stats = run_match([first, make_a("a3.xlsx")], make_b(), dedup=True, output_name="same.xlsx")
+    assert count == 4
+    assert stats["duplicates_dropped"] == 4
+
+def test_dedup_within_one_file_uses_column_letters(make_a, make_b, run_match):
+    rows = [[1, "2025-05-03", "张三", 100, "上午"], [2, "2025-05-03", "张三", 100, "下午"], [3, "2025-05-04", "张三", 100, ""]]
+    count, saved_path, stats = run_match([make_a(rows=rows)], make_b(), dedup=True, dedup_columns=["B", "C"],
+                                         dedup_keep="last")
+    assert count == 2
+    assert stats["duplicates_dropped"] == 1
+    assert [row[0] for row in matched_rows(saved_path)] == [2, 3]
+
+def test_resume_re_dedups_restored_files(tmp_path, make_a, make_b, run_match):
+    first, second = make_pair(make_a)
+    with open(first, "wb") as f:
+        f.write(b"not a workbook")
+    job_dir = str(tmp_path / "job")
+    options = dict(dedup=True, dedup_columns=["患者姓名"])
+    count, _, _ = run_match([first, second], make_b(), job_dir=job_dir, **options)
+    assert count == 4
+
+    # 第一个文件修复后重新处理，已完成的第二个文件中的行按第一个文件重新去重
+    make_a("a1.xlsx")
+    count, resumed_path, stats = run_match([first, second], make_b(), job_dir=job_dir, output_name="resumed.xlsx",
+                                           **options)
+    assert count == 4
+    assert stats["duplicates_dropped"] == 4
+    assert [row[4] for row in matched_rows(resumed_path)] == ["复诊", "初诊", "复诊", "初诊"]
+    assert openpyxl.load_workbook(resumed_path).active[1][2].value == A_HEADER[2]
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import openpyxl
+
+import excel_processor
+from excel_processor import FuzzyKeyIndex
+
+# 测试用的拼音表，代替pypinyin
+PINYIN = {"张": "zhang", "章": "zhang", "三": "san", "珊": "shan", "山": "san", "李": "li", "四": "si"}
+
+def fake_pinyin(text):
+    return [PINYIN.get(char, char) for char in text]
+
+def test_lookup_finds_key_within_distance(monkeypatch):
+    monkeypatch.setattr(excel_processor, "lazy_pinyin", None)
+    index = FuzzyKeyIndex(["张三丰", "李四", "王五"], max_distance=1)
+    assert index.lookup("张三峰") == ("张三丰", 0.667)
+    assert index.lookup("李四") == ("李四", 1.0)
+    # 编辑距离超过上限时不匹配
+    assert index.lookup("张四峰") is None
+    assert FuzzyKeyIndex(["张三丰"], max_distance=2).lookup("张四峰") == ("张三丰", 0.333)
+
+def test_lookup_only_scores_ngram_candidates(monkeypatch):
+    monkeypatch.setattr(excel_processor, "lazy_pinyin", None)
+    compared = []
+    original = excel_processor.edit_distance
+
+    def counting_edit_distance(a, b, max_distance=None):
+        compared.append(b)
+        return original(a, b, max_distance)
+
+    monkeypatch.setattr(excel_processor, "edit_distance", counting_edit_distance)
+    keys = [f"患者{i:04d}" for i in range(1000)] + ["欧阳修远"]
+    index = FuzzyKeyIndex(keys, max_distance=1)
+    assert index.lookup("欧阳修原") == ("欧阳修远", 0.75)
+    assert compared == ["欧阳修远"]
+    # 同一个值只查找一次
+    index.lookup("欧阳修原")
+    assert compared == ["欧阳修远"]
+
+def test_homophones_need_pinyin(monkeypatch):
+    monkeypatch.setattr(excel_processor, "lazy_pinyin", fake_pinyin)
+    index = FuzzyKeyIndex(["张三", "李四"], max_distance=0)
+    assert index.use_pinyin
+    # 同音字超过编辑距离上限也作为候选，得分按编辑距离计算
+    assert index.lookup("章山") == ("张三", 0.0)
+    assert index.lookup("章珊") is None
+
+    monkeypatch.setattr(excel_processor, "lazy_pinyin", None)
+    index = FuzzyKeyIndex(["张三", "李四"], max_distance=0)
+    assert not index.use_pinyin and not index.pinyin_index
+    assert index.lookup("章山") is None
+
+def test_fuzzy_match_adds_score_and_matched_key_columns(make_a, make_b, run_match):
+    rows = [[1, "2025-05-03", "张三丰", 100, ""], [2, "2025-05-03", "李四", 50, ""], [3, "2025-05-03", "陌生人", 0, ""]]
+    count, saved_path, _ = run_match([make_a(rows=rows)], make_b(), fuzzy_match=True, fuzzy_threshold=1)
+    assert count == 2
+    rows = list(openpyxl.load_workbook(saved_path).active.iter_rows(values_only=True))
+    assert rows[0][-2:] == ("匹配得分", "匹配患者")
+    assert [row[-2:] for row in rows[1:]] == [(0.667, "张三"), (1, "李四")]
+
+def test_fuzzy_match_with_hashed_libraries(make_a, make_b, run_match):
+    rows = [[1, "2025-05-03", "张三丰", 100, ""], [2, "2025-05-03", "李四四", 50, ""]]
+    libraries = [make_b("b1.xlsx", rows=[("张三", "111", "刘")]), make_b("b2.xlsx", rows=[("李四", "222", "陈")])]
+    count, saved_path, _ = run_match([make_a(rows=rows)], libraries, fuzzy_match=True, b_index_backend="hashed")
+    assert count == 2
+    rows = list(openpyxl.load_workbook(saved_path).active.iter_rows(values_only=True))
+    assert rows[0][-3:] == ("匹配得分", "匹配患者", "匹配患者库")
+    assert [row[-3:] for row in rows[1:]] == [(0.667, "张三", "b1"), (0.667, "李四", "b2")]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from job_queue import SharedBIndexPool
+
+def test_shared_index_pool_reuses_and_evicts_unused(make_b):
+    pool = SharedBIndexPool(max_entries=1)
+    loads = []
+
+    def load(file_b_path, sheet_b, col_y, read_only):
+        loads.append(file_b_path)
+        return {"张三": None, "李四": None}
+
+    first = {"file_b_path": make_b("b1.xlsx"), "col_y": "A"}
+    second = {"file_b_path": make_b("b2.xlsx"), "col_y": "A"}
+    assert SharedBIndexPool.shareable(first)
+    assert not SharedBIndexPool.shareable(dict(first, b_columns=["B"]))
+    assert not SharedBIndexPool.shareable(dict(first, file_b_path=[first["file_b_path"]]))
+
+    index = pool.acquire(first, load)
+    assert pool.acquire(first, load) is index
+    assert "张三" in index and "王五" not in index
+    assert len(loads) == 1
+
+    # 正在使用的索引超过上限也不关闭
+    other = pool.acquire(second, load)
+    assert len(pool._entries) == 2
+    pool.release(index)
+    pool.release(index)
+    assert len(pool._entries) == 1
+    assert pool.acquire(second, load) is other
+    pool.close()
+
+def test_shared_index_pool_honours_per_library_maps(make_b):
+    pool = SharedBIndexPool()
+    loads = []
+
+    def load(file_b_path, sheet_b, col_y, read_only):
+        loads.append((sheet_b, col_y))
+        return {col_y: None}
+
+    plain = {"file_b_path": make_b(), "sheet_b": "Sheet", "col_y": "A"}
+    mapped = dict(plain, sheet_b_map={plain["file_b_path"]: "其他"}, col_y_map={plain["file_b_path"]: "电话"})
+    try:
+        first = pool.acquire(plain, load)
+        second = pool.acquire(mapped, load)
+        # 单独设置了工作表和比较列时不能共用按默认设置建立的索引
+        assert second is not first
+        assert loads == [("Sheet", "A"), ("其他", "电话")]
+        assert pool.acquire(mapped, load) is second
+    finally:
+        pool.close()
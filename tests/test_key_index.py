@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import openpyxl
+
+import key_index
+from key_index import HashedKeyIndex, SharedKeyIndex, key_hash
+
+def names(count):
+    return [f"患者{i}" for i in range(count)]
+
+def test_iteration_keeps_original_order_without_duplicates():
+    keys = ["王五", "张三", "李四", "张三", "赵六"]
+    index = HashedKeyIndex(keys)
+    assert list(index) == ["王五", "张三", "李四", "赵六"]
+    assert len(index) == 4
+
+def test_lookups_compare_original_keys_on_hash_collisions(monkeypatch):
+    # 按长度计算哈希，长度相同的键全部碰撞
+    def length_hash(data):
+        return np.array([len(item) for item in data], dtype=np.uint64)
+
+    monkeypatch.setattr(key_index, "_hash_encoded", length_hash)
+    monkeypatch.setattr(key_index, "key_hash", lambda key: len(key.encode("utf-8")))
+    index = HashedKeyIndex(["张三", "李四", "欧阳修远", "王五"])
+    assert "王五" in index and "赵六" not in index
+    assert index.find("欧阳修远") >= 0 and index.find("欧阳修近") == -1
+    assert index.contains_batch(["赵六", "王五", "李四", "欧阳修近", "欧阳修远"]).tolist() == [False, True, True, False, True]
+    assert list(index) == ["张三", "李四", "欧阳修远", "王五"]
+
+def test_single_and_batch_lookups_agree_for_hashes_above_int64():
+    keys = names(200)
+    assert any(key_hash(key) >= 2 ** 63 for key in keys)
+    probes = keys + ["不存在", ""]
+    index = HashedKeyIndex(keys)
+    expected = [key in set(keys) for key in probes]
+    assert [key in index for key in probes] == expected
+    assert index.contains_batch(probes).tolist() == expected
+    assert index.contains_batch([]).tolist() == []
+    assert HashedKeyIndex([]).contains_batch(["张三"]).tolist() == [False]
+
+    shared = SharedKeyIndex.create(keys)
+    try:
+        assert [key in shared for key in probes] == expected
+        assert shared.contains_batch(probes).tolist() == expected
+        positions = shared.find_batch(probes)
+        assert [int(position) for position in positions] == [shared.find(key) for key in probes]
+    finally:
+        shared.close()
+
+def test_values_hold_full_uint64_bitmasks():
+    masks = {"张三": 1, "李四": 1 << 63 | 1, "王五": (1 << 64) - 1}
+    index = HashedKeyIndex.from_mapping(masks)
+    assert {key: index.get(key) for key in index} == masks
+    assert index.get("赵六", 0) == 0
+    assert list(index) == ["张三", "李四", "王五"]
+
+def test_hashed_backend_matches_set_backend(make_a, make_b, run_match):
+    libraries = [
+        make_b("b1.xlsx", rows=[("张三", "111", "刘"), ("李四", "222", "陈")]),
+        make_b("b2.xlsx", rows=[("李四", "222", "陈"), ("王五", "333", "刘")]),
+        make_b("b3.xlsx", rows=[("赵六", "444", "周"), ("张三", "111", "刘")]),
+    ]
+    files = [make_a("a1.xlsx"), make_a("a2.xlsx")]
+    results = {}
+    for backend in ("set", "hashed"):
+        count, saved_path, _ = run_match(files, libraries, b_index_backend=backend, output_name=f"{backend}.xlsx")
+        results[backend] = (count, list(openpyxl.load_workbook(saved_path).active.iter_rows(values_only=True)))
+    assert results["hashed"] == results["set"]
+    count, rows = results["hashed"]
+    assert count == 8
+    assert [row[-1] for row in rows[1:5]] == ["b1、b3", "b1、b2", "b2", "b3"]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import openpyxl
+import pytest
+
+from excel_processor import process_excel_files
+
+def make_libraries(make_b):
+    return [
+        make_b("门诊.xlsx", rows=[("张三", "111", "刘"), ("李四", "222", "陈")]),
+        make_b("住院.xlsx", rows=[("李四", "222", "陈"), ("王五", "333", "刘")]),
+    ]
+
+@pytest.mark.parametrize("backend", ["set", "hashed"])
+def test_matched_rows_are_labelled_with_their_libraries(make_a, make_b, run_match, backend):
+    count, saved_path, _ = run_match([make_a()], make_libraries(make_b), b_index_backend=backend,
+                                     outputs=["matched", "coverage"])
+    # 赵六不在任何患者库中
+    assert count == 3
+    wb = openpyxl.load_workbook(saved_path)
+    rows = list(wb["匹配结果"].iter_rows(values_only=True))
+    assert rows[0][-1] == "匹配患者库"
+    assert [(row[2], row[-1]) for row in rows[1:]] == [("张三", "门诊"), ("李四", "门诊、住院"), ("王五", "住院")]
+    coverage = {row[0]: row[3] for row in wb["患者库覆盖"].iter_rows(min_row=2, values_only=True)}
+    assert coverage == {"张三": "门诊", "李四": "门诊、住院", "王五": "住院"}
+
+def test_single_library_adds_no_library_column(make_a, make_b, run_match):
+    _, saved_path, _ = run_match([make_a()], make_b())
+    header = next(openpyxl.load_workbook(saved_path).active.iter_rows(values_only=True))
+    assert "匹配患者库" not in header
+
+def test_preview_reports_libraries(make_a, make_b):
+    result = process_excel_files([make_a()], make_libraries(make_b), None, "C", "A", preview=True)
+    assert [(row["values"][2], row["libraries"]) for row in result["rows"]] == [
+        ("张三", "门诊"), ("李四", "门诊、住院"), ("王五", "住院")]
+
+def test_prebuilt_index_only_for_one_library(make_a, make_b):
+    with pytest.raises(ValueError):
+        process_excel_files([make_a()], make_libraries(make_b), None, "C", "A", preview=True, b_index={"张三": None})
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import sqlite3
+import zipfile
+
+import pytest
+import openpyxl
+
+from excel_processor import load_b_values, load_b_rows
+from library_store import LibraryStore
+
+def make_formula_library(path):
+    """患者库中姓名由公式算出（带有Excel保存的结果值）"""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["姓名", "电话"])
+    ws.append(['="张"&"三"', "111"])
+    ws.append(["李四", "222"])
+    wb.save(path)
+    # openpyxl不保存公式结果，按Excel保存后的样子补上结果值
+    temp_path = f"{path}.tmp"
+    with zipfile.ZipFile(path) as source, zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED) as target:
+        for info in source.infolist():
+            data = source.read(info)
+            if info.filename == "xl/worksheets/sheet1.xml":
+                data = data.replace(b'<c r="A2">', b'<c r="A2" t="str">').replace(b"<v />", "<v>张三</v>".encode("utf-8"), 1)
+            target.writestr(info, data)
+    shutil.move(temp_path, path)
+    return str(path)
+
+def test_formula_keys_agree_between_excel_and_store(tmp_path):
+    library = make_formula_library(tmp_path / "b.xlsx")
+    store = LibraryStore(str(tmp_path / "b.sqlite3"))
+    store.import_workbook(library, col="姓名")
+
+    excel_keys = list(load_b_values(library, col_y="姓名"))
+    assert "张三" in excel_keys
+    assert list(load_b_values(library, col_y="姓名", read_only=True)) == excel_keys
+    assert sorted(store.load_keys()) == sorted(excel_keys)
+    assert load_b_rows(library, col_y="A", columns=["B"])["张三"] == store.load_rows(["B"])["张三"]
+
+def test_store_connections_are_closed(tmp_path, monkeypatch):
+    connections = []
+    connect = sqlite3.connect
+
+    def tracking_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        connections.append(conn)
+        return conn
+
+    monkeypatch.setattr(sqlite3, "connect", tracking_connect)
+    store = LibraryStore(str(tmp_path / "b.sqlite3"))
+    store.import_workbook(make_formula_library(tmp_path / "b.xlsx"))
+    store.meta()
+    store.load_keys()
+    assert connections
+    for conn in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import openpyxl
+import pytest
+
+from pipeline import project_merged_ranges
+
+def make_merged_a(make_a):
+    """日期列B2:B3纵向合并，王五一行的金额和备注D4:E4横向合并"""
+    rows = [[1, "2025-05-03", "张三", 100, "复诊"], [2, None, "李四", 50, "初诊"], [3, "2025-05-04", "王五", 20, None]]
+    path = make_a("merged.xlsx", rows=rows)
+    wb = openpyxl.load_workbook(path)
+    wb.active.merge_cells("B2:B3")
+    wb.active.merge_cells("D4:E4")
+    wb.save(path)
+    return path
+
+def test_project_merged_ranges_clips_to_output_columns():
+    # 输出A表的第4、2、3列
+    ranges = {(2, 2, 3, 2), (4, 4, 4, 5), (5, 1, 5, 3)}
+    projected = project_merged_ranges(ranges, [4, 2, 3])
+    assert projected[(2, 2)] == projected[(3, 2)] == (2, 2, 3, 2)
+    # A5:C5的左上角A列没有输出，不再合并；D4:E4只输出了D列
+    assert projected[(4, 1)] == (4, 1, 4, 1)
+    assert (5, 2) not in projected and (5, 3) not in projected
+    # 左上角所在列之后相邻且仍在区域内的输出列一起合并
+    assert project_merged_ranges({(2, 2, 2, 4)}, [2, 3, 1])[(2, 2)] == (2, 1, 2, 2)
+
+@pytest.mark.parametrize("output_columns", [["患者姓名", "日期", "金额"], ["C", "B", "D"]])
+def test_output_columns_select_and_reorder(make_a, make_b, run_match, output_columns):
+    count, saved_path, _ = run_match([make_merged_a(make_a)], make_b(), output_columns=output_columns)
+    assert count == 3
+    ws = openpyxl.load_workbook(saved_path).active
+    rows = list(ws.iter_rows(values_only=True))
+    assert rows[0] == ("患者姓名", "日期", "金额")
+    assert [row[0] for row in rows[1:]] == ["张三", "李四", "王五"]
+    assert [row[2] for row in rows[1:]] == [100, 50, 20]
+    # 日期列的纵向合并保留在输出中的第2列，只输出一列的横向合并不再合并
+    assert {str(merged) for merged in ws.merged_cells.ranges} == {"B2:B3"}
+
+def test_output_columns_keep_horizontal_merge_when_both_columns_output(make_a, make_b, run_match):
+    _, saved_path, _ = run_match([make_merged_a(make_a)], make_b(), output_columns=["患者姓名", "金额", "备注"])
+    ws = openpyxl.load_workbook(saved_path).active
+    assert [row for row in ws.iter_rows(values_only=True)][0] == ("患者姓名", "金额", "备注")
+    assert {str(merged) for merged in ws.merged_cells.ranges} == {"B4:C4"}
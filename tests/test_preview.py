@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import pipeline
+from excel_processor import process_excel_files
+
+def preview(file_a_paths, file_b_path, col_x="C", stats=None, **kwargs):
+    return process_excel_files(file_a_paths, file_b_path, None, col_x, "A", preview=True, stats=stats, **kwargs)
+
+@pytest.mark.parametrize("parser_available", [True, False])
+def test_preview_counts_matches(monkeypatch, make_a, make_b, parser_available):
+    if not parser_available:
+        monkeypatch.setattr(pipeline, "WorkSheetParser", None)
+    result = preview([make_a("a1.xlsx"), make_a("a2.xlsx")], make_b())
+    assert result["total_matches"] == 8
+    assert [item["matches"] for item in result["files"]] == [4, 4]
+    assert result["header"][2] == "患者姓名"
+    assert [row["values"][2] for row in result["rows"][:4]] == ["张三", "李四", "王五", "赵六"]
+
+def test_preview_falls_back_when_parser_interface_changes(monkeypatch, make_a, make_b):
+    class ChangedParser:
+        def __init__(self, *args, **kwargs):
+            raise TypeError("unexpected keyword argument")
+
+    monkeypatch.setattr(pipeline, "WorkSheetParser", ChangedParser)
+    result = preview([make_a()], make_b(), row_filters=[("金额", ">", 0)])
+    assert result["total_matches"] == 3
+
+def test_preview_records_file_errors(tmp_path, make_a, make_b):
+    bad = tmp_path / "bad.xlsx"
+    bad.write_bytes(b"not a workbook")
+    stats = {}
+    result = preview([str(bad), make_a()], make_b(), stats=stats)
+    assert result["files"][0]["error"] == stats["file_errors"][0]["error"]
+    assert stats["file_errors"][0]["stage"] == "加载"
+
+    # 表头中没有该列
+    stats = {}
+    preview([make_a()], make_b(), stats=stats, col_x="电话")
+    assert [error["stage"] for error in stats["file_errors"]] == ["表头"]
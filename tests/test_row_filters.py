@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+import pytest
+
+from excel_processor import RowFilter
+
+@pytest.mark.parametrize("cell", [
+    datetime.datetime(2025, 5, 1), datetime.date(2025, 5, 1), "2025-05-01", "2025/5/1", "2025年5月1日", 45778,
+])
+def test_date_text_equality_matches_any_date_form(cell):
+    assert RowFilter("日期", "==", "2025-05-01").test(cell)
+    assert not RowFilter("日期", "!=", "2025-05-01").test(cell)
+
+def test_date_equality_rejects_other_dates():
+    row_filter = RowFilter("日期", "==", "2025-05-01")
+    assert row_filter.kind == "date"
+    assert not row_filter.test(datetime.datetime(2025, 5, 2))
+    assert not row_filter.test("无")
+
+def test_plain_text_equality():
+    row_filter = RowFilter("医生", "==", "刘")
+    assert row_filter.kind == "text"
+    assert row_filter.test(" 刘 ")
+    assert not row_filter.test("陈")
+
+def test_number_comparison():
+    assert RowFilter("金额", ">", 0).test("1,200")
+    assert not RowFilter("金额", ">", 0).test(0)
+
+def test_date_between_and_regex():
+    between = RowFilter("日期", "between", ("2025-05-01", None))
+    assert between.test("2025-05-03") and not between.test("2025-04-30")
+    assert RowFilter("备注", "regex", "复诊|初诊").test("复诊")
+
+def test_filters_run_in_pipeline(make_a, make_b, run_match):
+    count, _, stats = run_match([make_a()], make_b(), row_filters=[("日期", "==", "2025-05-01")])
+    assert count == 1
+    assert stats["rows_filtered"] == 3
+
+def test_filter_column_missing_from_one_file_skips_only_that_file(make_a, make_b, run_match):
+    other = make_a("other.xlsx", header=["序号", "日期", "患者姓名", "费用", "备注"])
+    good = make_a("good.xlsx")
+    count, _, stats = run_match([other, good], make_b(), row_filters=[("金额", ">", 0)])
+    assert count == 3
+    assert [(error["file"], error["stage"]) for error in stats["file_errors"]] == [(other, "表头")]
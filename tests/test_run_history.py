@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import auto_tune
+from run_history import RunHistory
+
+def test_auto_mode_keeps_one_job_key_across_input_sizes(tmp_path, monkeypatch, make_a, make_b, run_match):
+    history = RunHistory(str(tmp_path / "history.db"))
+    files = [make_a("a1.xlsx"), make_a("a2.xlsx")]
+    b_path = make_b()
+
+    _, _, small = run_match(files, b_path, auto=True, run_history=history)
+    # 模拟大文件：自动选择快速压缩、只读读取B表和hashed索引
+    monkeypatch.setattr(auto_tune, "FAST_COMPRESSION_MIN_CELLS", 0)
+    monkeypatch.setattr(auto_tune, "B_READ_ONLY_MIN_CELLS", 0)
+    monkeypatch.setattr(auto_tune, "B_HASHED_MIN_ROWS", 0)
+    _, _, large = run_match(files, b_path, auto=True, run_history=history)
+    assert small["auto_settings"]["compression"] != large["auto_settings"]["compression"]
+    assert small["auto_settings"]["b_index_backend"] != large["auto_settings"]["b_index_backend"]
+
+    runs = history.runs()
+    assert len(runs) == 2
+    assert runs[0]["job_key"] == runs[1]["job_key"]
+
+def test_specified_compression_is_part_of_auto_job_key(tmp_path, make_a, make_b, run_match):
+    history = RunHistory(str(tmp_path / "history.db"))
+    files = [make_a()]
+    b_path = make_b()
+    run_match(files, b_path, auto=True, run_history=history)
+    run_match(files, b_path, auto=True, run_history=history, save_options={"compression": 0})
+    runs = history.runs()
+    assert runs[0]["job_key"] != runs[1]["job_key"]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import openpyxl
+
+from conftest import A_HEADER
+
+def summary_tables(path):
+    """汇总工作表中按患者和按文件的两个表"""
+    rows = [tuple(value for value in row if value is not None)
+            for row in openpyxl.load_workbook(path)["汇总统计"].iter_rows(values_only=True)]
+    split = rows.index(())
+    return rows[:split], rows[split + 1:]
+
+def test_summary_accumulates_by_patient_and_by_file(make_a, make_b, run_match):
+    first = make_a("a1.xlsx")
+    second = make_a("a2.xlsx", rows=[[1, "2025-05-04", "张三", 100, ""], [2, "2025-05-04", "张三", "未收", ""]])
+    count, saved_path, _ = run_match([first, second], make_b(), outputs=["matched", "summary"], summary_columns=["金额"])
+    assert count == 6
+    by_key, by_source = summary_tables(saved_path)
+    assert by_key == [
+        ("患者", "匹配行数", "金额合计", "金额最小", "金额最大"),
+        # 非数值的金额不参与合计、最小和最大
+        ("张三", 3, 200, 100, 100),
+        ("李四", 1, 0, 0, 0),
+        ("王五", 1, 20, 20, 20),
+        ("赵六", 1, 30, 30, 30),
+    ]
+    assert by_source == [
+        ("文件", "工作表", "匹配行数", "金额合计", "金额最小", "金额最大"),
+        ("a1.xlsx", "5.3", 4, 150, 0, 100),
+        ("a2.xlsx", "5.3", 2, 100, 100, 100),
+    ]
+
+def test_summary_counts_only_rows_kept_after_dedup(make_a, make_b, run_match):
+    _, saved_path, _ = run_match([make_a("a1.xlsx"), make_a("a2.xlsx")], make_b(), outputs=["summary"],
+                                 summary_columns=["D"], dedup=True, dedup_keep="last")
+    by_key, by_source = summary_tables(saved_path)
+    assert by_key[0] == ("患者", "匹配行数", "金额合计", "金额最小", "金额最大")
+    assert by_key[1] == ("张三", 1, 100, 100, 100)
+    assert [row[:3] for row in by_source[1:]] == [("a2.xlsx", "5.3", 4)]
+
+def test_summary_titles_come_from_header_below_title_row(make_a, make_b, run_match):
+    rows = [A_HEADER, [1, "2025-05-03", "张三", 100, ""], [2, "2025-05-03", "李四", 50, ""]]
+    titled = make_a("titled.xlsx", header=["5月3日门诊日报表"], rows=rows)
+    _, saved_path, _ = run_match([titled], make_b(), col_x="患者姓名", outputs=["matched", "summary"],
+                                 output_columns=["序号", "患者姓名"], summary_columns=["序号"])
+    by_key, _ = summary_tables(saved_path)
+    # 标题在第一行的A列，统计列的标题取自第二行
+    assert by_key[0] == ("患者", "匹配行数", "序号合计", "序号最小", "序号最大")
+    assert by_key[1:] == [("张三", 1, 1, 1, 1), ("李四", 1, 2, 2, 2)]
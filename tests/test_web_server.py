@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import quote
+
+import pytest
+
+from job_queue import JOB_DONE, JOB_FAILED
+from web_server import create_server
+
+@pytest.fixture
+def server(tmp_path):
+    server = create_server(port=0, data_dir=str(tmp_path / "web"), max_workers=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.service.shutdown()
+    server.server_close()
+
+def request(server, method, path, body=None):
+    """发送请求，返回(状态码, JSON)"""
+    url = f"http://127.0.0.1:{server.server_address[1]}{path}"
+    data = body if isinstance(body, bytes) or body is None else json.dumps(body).encode("utf-8")
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data, method=method)) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+def upload(server, path):
+    with open(path, "rb") as f:
+        status, data = request(server, "POST", f"/api/uploads?filename={quote(os.path.basename(path))}", f.read())
+    assert status == 200
+    return data["upload_id"]
+
+def wait_for(server, job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        _, info = request(server, "GET", f"/api/jobs/{job_id}")
+        if info["status"] in (JOB_DONE, JOB_FAILED):
+            return info
+        time.sleep(0.1)
+    raise AssertionError("任务超时")
+
+@pytest.mark.parametrize("body", [
+    [],
+    {"report_files": "a.xlsx", "patient_file": {"upload_id": "x"}},
+    {"report_files": [["x"]], "patient_file": {"upload_id": "x"}},
+    {"report_files": [{"upload_id": 1}], "patient_file": {"upload_id": "x"}},
+    {"report_files": [{"upload_id": "x"}], "patient_file": "x"},
+])
+def test_wrong_payload_types_are_rejected(server, body):
+    status, data = request(server, "POST", "/api/jobs", body)
+    assert status == 400
+    assert data["error"]
+
+def test_wrong_option_and_field_types_are_rejected(server, make_a, make_b):
+    a_id = upload(server, make_a())
+    b_id = upload(server, make_b())
+    base = {"report_files": [{"upload_id": a_id, "column": "C"}], "patient_file": {"upload_id": b_id}}
+    for body in (dict(base, options={"dedup": "yes"}), dict(base, options={"fuzzy_threshold": True}),
+                 dict(base, output_name=["x"]), dict(base, patient_file={"upload_id": b_id, "sheet": {}})):
+        status, _ = request(server, "POST", "/api/jobs", body)
+        assert status == 400
+
+def test_job_runs_in_worker_process(server, make_a, make_b):
+    a_id = upload(server, make_a())
+    b_id = upload(server, make_b())
+    status, info = request(server, "POST", "/api/jobs", {
+        "report_files": [{"upload_id": a_id, "column": "C"}],
+        "patient_file": {"upload_id": b_id, "column": "A"},
+        "options": {"dedup": True},
+    })
+    assert status == 202
+    info = wait_for(server, info["id"])
+    assert info["status"] == JOB_DONE, info["error"]
+    assert info["count"] == 4
+    assert info["stats"]["rows_scanned"] == 6
+    status, data = request(server, "GET", "/api/jobs")
+    assert [job["id"] for job in data["jobs"]] == [info["id"]]
+
+def test_cleanup_removes_expired_jobs_and_uploads(server, make_a, make_b):
+    service = server.service
+    a_id = upload(server, make_a())
+    b_id = upload(server, make_b())
+    _, info = request(server, "POST", "/api/jobs", {
+        "report_files": [{"upload_id": a_id, "column": "C"}], "patient_file": {"upload_id": b_id},
+    })
+    wait_for(server, info["id"])
+    job = service.job_queue.get(info["id"])
+    result_dir = os.path.dirname(job.params["output_path"])
+    assert os.listdir(result_dir)
+
+    # 未过期时保留
+    service.cleanup()
+    assert os.path.isdir(result_dir)
+    assert service.job_queue.get(info["id"]) is job
+
+    service.cleanup(now=time.time() + service.retention + 1)
+    assert not os.path.exists(result_dir)
+    assert service.job_queue.get(info["id"]) is None
+    assert os.listdir(service.uploads.upload_dir) == []
+    with pytest.raises(KeyError):
+        service.uploads.path(a_id)
+
+def test_jobs_share_one_b_index(server, make_a, make_b):
+    service = server.service
+    b_id = upload(server, make_b())
+    job_ids = []
+    for name in ("a1.xlsx", "a2.xlsx"):
+        a_id = upload(server, make_a(name))
+        _, info = request(server, "POST", "/api/jobs", {
+            "report_files": [{"upload_id": a_id, "column": "C"}], "patient_file": {"upload_id": b_id},
+            "options": {"fuzzy_match": True},
+        })
+        job_ids.append(info["id"])
+    for job_id in job_ids:
+        info = wait_for(server, job_id)
+        assert info["status"] == JOB_DONE, info["error"]
+        # 模糊匹配时"陌生人"以外的行都能匹配
+        assert info["count"] == 4
+    entries = service.job_queue.shared_indexes._entries
+    assert len(entries) == 1
+    index, users = next(iter(entries.values()))
+    assert users == 0
+    assert set(index) == {"姓名", "张三", "李四", "王五", "赵六"}
@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+本地HTTP服务
+为prototype_web.html提供后端，多名工作人员可以通过浏览器共用一台机器处理数据
+
+接口:
+    GET  /                         网页前端
+    POST /api/uploads?filename=xx  上传文件（请求体为文件内容），返回上传编号
+    POST /api/jobs                 提交处理任务（JSON），返回任务编号
+    GET  /api/jobs                 任务列表
+    GET  /api/jobs/<编号>          查询任务状态
+    GET  /api/jobs/<编号>/result   下载结果文件
+
+每个任务在单独的工作进程中运行，多个任务可以同时使用多个CPU核心。
+上传文件和结果文件保存在数据目录中，超过保留时间（默认24小时）未使用的文件定期删除。
+
+使用方法:
+    python web_server.py --port 8765 --workers 2 --keep-hours 24
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, quote
+
+from excel_processor import process_excel_files
+from job_queue import JobQueue, JOB_DONE, JOB_QUEUED, JOB_RUNNING, JOB_SAVING
+
+# 上传和下载时每次读写的块大小
+CHUNK_SIZE = 64 * 1024
+
+# 单个上传文件的大小上限
+MAX_UPLOAD_SIZE = 500 * 1024 * 1024
+
+# 前端可以传给process_excel_files的可选参数及其类型
+ALLOWED_OPTIONS = {
+    "fuzzy_match": bool,
+    "fuzzy_threshold": int,
+    "outputs": list,
+    "dedup": bool,
+    "dedup_columns": list,
+    "dedup_keep": str,
+}
+
+# 上传文件和结果文件默认的保留时间（秒），以及检查过期文件的间隔
+DEFAULT_RETENTION = 24 * 3600
+CLEANUP_INTERVAL = 600
+
+def require_type(value, expected, name):
+    """检查请求中字段的类型，类型不对时抛出ValueError（返回400）"""
+    # bool是int的子类，整数字段不接受true/false
+    if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+        raise ValueError(f"参数{name}的类型不正确")
+    return value
+
+def optional_text(value, name):
+    """可选的文本字段（工作表名、列名等），列号也可以是数字"""
+    if value is None:
+        return None
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value)
+    return require_type(value, str, name)
+
+def resource_path(relative_path):
+    """获取资源的绝对路径，处理PyInstaller打包后的路径问题"""
+    base_path = getattr(sys, "_MEIPASS", os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base_path, relative_path)
+
+class UploadStore:
+    """保存上传文件的目录，按上传编号管理文件"""
+
+    def __init__(self, data_dir):
+        self.upload_dir = os.path.join(data_dir, "uploads")
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def save_stream(self, filename, stream, length):
+        """将请求体分块写入磁盘，不在内存中保存整个文件"""
+        filename = os.path.basename(filename) or "upload.xlsx"
+        upload_id = uuid.uuid4().hex
+        target_dir = os.path.join(self.upload_dir, upload_id)
+        os.makedirs(target_dir)
+        target_path = os.path.join(target_dir, filename)
+
+        remaining = length
+        with open(target_path, "wb") as f:
+            while remaining > 0:
+                chunk = stream.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                f.write(chunk)
+                remaining -= len(chunk)
+
+        if remaining > 0:
+            shutil.rmtree(target_dir, ignore_errors=True)
+            raise ValueError("上传数据不完整")
+
+        with self._lock:
+            self._uploads[upload_id] = [target_path, time.time()]
+        return upload_id, filename
+
+    def path(self, upload_id):
+        """根据上传编号获取文件路径"""
+        require_type(upload_id, str, "upload_id")
+        with self._lock:
+            if upload_id not in self._uploads:
+                raise KeyError(f"找不到上传文件: {upload_id}")
+            entry = self._uploads[upload_id]
+            # 患者库常被多个任务重复使用，保留时间从最后一次使用算起
+            entry[1] = time.time()
+            return entry[0]
+
+    def remove_unused(self, used_before, in_use):
+        """
+        删除最后一次使用早于used_before、且不在in_use（正在使用的文件路径集合）中的上传文件
+
+        服务重启前留下的上传目录按目录的修改时间判断。
+        """
+        with self._lock:
+            known = {}
+            for upload_id, (path, last_used) in list(self._uploads.items()):
+                if last_used < used_before and path not in in_use:
+                    del self._uploads[upload_id]
+                else:
+                    known[upload_id] = path
+        for upload_id in os.listdir(self.upload_dir):
+            if upload_id in known:
+                continue
+            upload_path = os.path.join(self.upload_dir, upload_id)
+            try:
+                if os.path.getmtime(upload_path) < used_before:
+                    shutil.rmtree(upload_path, ignore_errors=True)
+            except OSError:
+                pass
+
+class ExcelService:
+    """
+    常驻的处理服务：任务队列在多次请求间保持
+
+    openpyxl解析时持有GIL，因此任务在进程池中运行，max_workers个任务可以同时使用多个CPU核心。
+    已结束的任务在保留时间后从列表中移除并删除结果文件，长时间未使用的上传文件同样删除。
+    """
+
+    def __init__(self, data_dir, max_workers=2, retention=DEFAULT_RETENTION):
+        self.data_dir = data_dir
+        self.retention = retention
+        self.result_dir = os.path.join(data_dir, "results")
+        os.makedirs(self.result_dir, exist_ok=True)
+        self.uploads = UploadStore(data_dir)
+        self.job_queue = JobQueue(process_excel_files, max_workers=max_workers, use_processes=True)
+        self._stop_cleanup = threading.Event()
+        self._cleanup_thread = threading.Thread(target=self._cleanup_loop, name="excel-cleanup", daemon=True)
+        self._cleanup_thread.start()
+
+    def _cleanup_loop(self):
+        while not self._stop_cleanup.wait(CLEANUP_INTERVAL):
+            try:
+                self.cleanup()
+            except Exception as e:
+                print(f"清理过期文件时出错: {str(e)}")
+
+    def cleanup(self, now=None):
+        """删除超过保留时间的任务结果和上传文件"""
+        expire_before = (now or time.time()) - self.retention
+        for job in self.job_queue.clear_finished(finished_before=expire_before):
+            shutil.rmtree(os.path.dirname(job.params["output_path"]), ignore_errors=True)
+
+        # 排队和运行中的任务正在使用的文件不删除
+        in_use = set()
+        live_result_dirs = set()
+        for job in self.job_queue.list_jobs():
+            live_result_dirs.add(os.path.basename(os.path.dirname(job.params["output_path"])))
+            if job.status in (JOB_QUEUED, JOB_RUNNING, JOB_SAVING):
+                in_use.update(job.params["file_a_paths"])
+                in_use.add(job.params["file_b_path"])
+        self.uploads.remove_unused(expire_before, in_use)
+
+        # 服务重启前留下的结果目录
+        for name in os.listdir(self.result_dir):
+            result_path = os.path.join(self.result_dir, name)
+            try:
+                if name not in live_result_dirs and os.path.getmtime(result_path) < expire_before:
+                    shutil.rmtree(result_path, ignore_errors=True)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        """停止清理线程并关闭任务队列"""
+        self._stop_cleanup.set()
+        self.job_queue.shutdown()
+
+    def submit(self, request):
+        """
+        根据前端提交的设置创建任务
+
+        request格式:
+            {
+                "report_files": [{"upload_id": "...", "sheet": "Sheet1", "column": "C"}, ...],
+                "patient_file": {"upload_id": "...", "sheet": "Sheet1", "column": "A"},
+                "output_name": "匹配结果.xlsx",
+                "output_sheet": "匹配结果",
+                "options": {"fuzzy_match": true, ...}
+            }
+        """
+        require_type(request, dict, "请求")
+        report_files = require_type(request.get("report_files") or [], list, "report_files")
+        patient_file = require_type(request.get("patient_file") or {}, dict, "patient_file")
+        if not report_files:
+            raise ValueError("请上传至少一个报表文件")
+        if not patient_file.get("upload_id"):
+            raise ValueError("请上传患者库文件")
+
+        file_a_paths = []
+        sheet_a_map = {}
+        col_x_map = {}
+        for report in report_files:
+            require_type(report, dict, "report_files")
+        default_col_x = optional_text(report_files[0].get("column"), "column") or "A"
+        for report in report_files:
+            path = self.uploads.path(report.get("upload_id"))
+            file_a_paths.append(path)
+            sheet = optional_text(report.get("sheet"), "sheet")
+            column = optional_text(report.get("column"), "column")
+            if sheet:
+                sheet_a_map[path] = sheet
+            if column and column != default_col_x:
+                col_x_map[path] = column
+
+        options = require_type(request.get("options") or {}, dict, "options")
+        unknown_options = set(options) - set(ALLOWED_OPTIONS)
+        if unknown_options:
+            raise ValueError(f"不支持的参数: {', '.join(sorted(unknown_options))}")
+        for name, value in options.items():
+            require_type(value, ALLOWED_OPTIONS[name], name)
+
+        output_name = os.path.basename(optional_text(request.get("output_name"), "output_name") or "匹配结果.xlsx")
+        if not output_name.lower().endswith(".xlsx"):
+            output_name += ".xlsx"
+        job_dir = os.path.join(self.result_dir, uuid.uuid4().hex)
+        os.makedirs(job_dir)
+
+        params = dict(
+            file_a_paths=file_a_paths,
+            file_b_path=self.uploads.path(patient_file["upload_id"]),
+            output_path=os.path.join(job_dir, output_name),
+            col_x=default_col_x,
+            col_y=optional_text(patient_file.get("column"), "column") or "A",
+            sheet_b=optional_text(patient_file.get("sheet"), "sheet") or None,
+            output_sheet=optional_text(request.get("output_sheet"), "output_sheet") or "匹配结果",
+            sheet_a_map=sheet_a_map,
+            **options
+        )
+        if col_x_map:
+            params["col_x_map"] = col_x_map
+
+        job_name = f"{len(file_a_paths)}个报表 → {output_name}"
+        return self.job_queue.submit(job_name, params)
+
+    def job_info(self, job):
+        """任务状态的JSON表示"""
+        return {
+            "id": job.id,
+            "name": job.name,
+            "status": job.status,
+            "status_label": job.status_label,
+            "count": job.count,
+            "error": job.error,
+            "duration": job.duration,
+            "stats": job.stats,
+            "result_ready": job.status == JOB_DONE and bool(job.saved_path),
+        }
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """处理前端请求"""
+
+    server_version = "ExcelProcessor/1.0"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path in ("/", "/index.html"):
+            self.send_file(resource_path("prototype_web.html"), "text/html; charset=utf-8")
+        elif path == "/api/jobs":
+            jobs = [self.service.job_info(job) for job in self.service.job_queue.list_jobs()]
+            self.send_json({"jobs": jobs})
+        elif path.startswith("/api/jobs/"):
+            parts = path.strip("/").split("/")
+            job = self.get_job(parts[2])
+            if job is None:
+                return
+            if len(parts) == 3:
+                self.send_json(self.service.job_info(job))
+            elif len(parts) == 4 and parts[3] == "result":
+                if job.status != JOB_DONE or not job.saved_path:
+                    self.send_json({"error": "结果尚未生成"}, status=409)
+                    return
+                self.send_file(
+                    job.saved_path,
+                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    download_name=os.path.basename(job.saved_path)
+                )
+            else:
+                self.send_json({"error": "接口不存在"}, status=404)
+        else:
+            self.send_json({"error": "接口不存在"}, status=404)
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if parsed.path == "/api/uploads":
+                if length <= 0 or length > MAX_UPLOAD_SIZE:
+                    self.send_json({"error": "上传文件为空或过大"}, status=413)
+                    return
+                filename = parse_qs(parsed.query).get("filename", ["upload.xlsx"])[0]
+                upload_id, filename = self.service.uploads.save_stream(filename, self.rfile, length)
+                self.send_json({"upload_id": upload_id, "filename": filename})
+            elif parsed.path == "/api/jobs":
+                request = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+                job = self.service.submit(request)
+                self.send_json(self.service.job_info(job), status=202)
+            else:
+                self.send_json({"error": "接口不存在"}, status=404)
+        except (ValueError, KeyError) as e:
+            self.send_json({"error": str(e)}, status=400)
+
+    def get_job(self, job_id):
+        try:
+            job = self.service.job_queue.get(int(job_id))
+        except ValueError:
+            job = None
+        if job is None:
+            self.send_json({"error": f"任务不存在: {job_id}"}, status=404)
+        return job
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_file(self, file_path, content_type, download_name=None):
+        """分块发送文件内容"""
+        if not os.path.exists(file_path):
+            self.send_json({"error": "文件不存在"}, status=404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(os.path.getsize(file_path)))
+        if download_name:
+            self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(download_name)}")
+        self.end_headers()
+        with open(file_path, "rb") as f:
+            shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+
+    def log_message(self, format, *args):
+        print(f"[{self.log_date_time_string()}] {self.address_string()} {format % args}")
+
+def create_server(host="127.0.0.1", port=8765, data_dir=None, max_workers=2, retention=DEFAULT_RETENTION):
+    """创建HTTP服务对象"""
+    if data_dir is None:
+        data_dir = os.path.join(tempfile.gettempdir(), "excel_processor_web")
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.service = ExcelService(data_dir, max_workers=max_workers, retention=retention)
+    return server
+
+def main():
+    # 打包后的程序启动工作进程时需要
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description="Excel数据处理工具 - 本地HTTP服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址，局域网共享时使用0.0.0.0")
+    parser.add_argument("--port", type=int, default=8765, help="监听端口")
+    parser.add_argument("--workers", type=int, default=2, help="同时运行的最大任务数（工作进程数）")
+    parser.add_argument("--data-dir", default=None, help="上传文件和结果文件的保存目录")
+    parser.add_argument("--keep-hours", type=float, default=DEFAULT_RETENTION / 3600,
+                        help="上传文件和结果文件的保留时间（小时）")
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.data_dir, args.workers, retention=args.keep_hours * 3600)
+    print(f"服务已启动: http://{args.host}:{args.port}/")
+    print(f"数据目录: {server.service.data_dir}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("正在关闭服务...")
+    finally:
+        server.service.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+向已有的结果工作簿追加行
+不用openpyxl加载整个工作簿再逐个单元格重写，而是直接复制xlsx压缩包：
+    目标工作表的XML按块流式复制，在</sheetData>之前插入新行，新的合并区域按行偏移后加入<mergeCells>；
+    styles.xml中追加新行用到的单元格格式；文本以内联字符串写入，不修改sharedStrings.xml；
+    其余部件原样复制。
+"""
+
+import os
+import re
+import datetime
+import tempfile
+import zipfile
+import posixpath
+from copy import copy
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.cell import range_boundaries
+from openpyxl.utils.datetime import to_excel
+from openpyxl.styles import Alignment, Border
+from openpyxl.styles.numbers import BUILTIN_FORMATS_REVERSE
+
+SHEET_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+# 流式复制工作表XML时每次读取的字节数
+CHUNK_SIZE = 1 << 20
+
+# 自定义数字格式的编号从164开始
+FIRST_CUSTOM_NUM_FMT_ID = 164
+
+# 不需要写出<alignment>的默认对齐方式
+DEFAULT_ALIGNMENT = Alignment()
+
+ROW_NUMBER_PATTERN = re.compile(rb'<row\b[^>]*?\br="(\d+)"')
+DIMENSION_PATTERN = re.compile(rb'<dimension\s+ref="([^"]*)"\s*/>')
+
+# 工作表中位于<mergeCells>之后的元素，没有<mergeCells>时插入到其中第一个出现的元素之前
+ELEMENTS_AFTER_MERGE_CELLS = (
+    b"<phoneticPr", b"<conditionalFormatting", b"<dataValidations", b"<hyperlinks", b"<printOptions",
+    b"<pageMargins", b"<pageSetup", b"<headerFooter", b"<rowBreaks", b"<colBreaks", b"<customProperties",
+    b"<cellWatches", b"<ignoredErrors", b"<smartTags", b"<drawing", b"<legacyDrawing", b"<legacyDrawingHF",
+    b"<picture", b"<oleObjects", b"<controls", b"<webPublishItems", b"<tableParts", b"<extLst",
+)
+
+def quoteattr_value(text):
+    """转义XML属性值（不含两侧引号）"""
+    return escape(text, {'"': "&quot;"})
+
+def find_sheet_part(archive, sheet_name):
+    """
+    在压缩包中查找工作表对应的XML部件路径
+
+    参数:
+        archive: 打开的xlsx压缩包
+        sheet_name: 工作表名称，None表示活动表
+
+    返回:
+        部件路径（如"xl/worksheets/sheet1.xml"），找不到工作表时返回None
+    """
+    workbook = ET.fromstring(archive.read("xl/workbook.xml"))
+    sheets = list(workbook.iter(f"{{{SHEET_MAIN_NS}}}sheet"))
+    if sheet_name is None:
+        view = workbook.find(f"{{{SHEET_MAIN_NS}}}bookViews/{{{SHEET_MAIN_NS}}}workbookView")
+        active_tab = int(view.get("activeTab", 0)) if view is not None else 0
+        sheet_name = sheets[active_tab].get("name") if active_tab < len(sheets) else None
+    rel_id = None
+    for sheet in sheets:
+        if sheet.get("name") == sheet_name:
+            rel_id = sheet.get(f"{{{REL_NS}}}id")
+            break
+    if rel_id is None:
+        return None
+
+    rels = ET.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    for rel in rels.iter(f"{{{PACKAGE_REL_NS}}}Relationship"):
+        if rel.get("Id") == rel_id:
+            target = rel.get("Target")
+            if target.startswith("/"):
+                return target.lstrip("/")
+            return posixpath.normpath(posixpath.join("xl", target))
+    return None
+
+def has_sheet(path, sheet_name):
+    """xlsx文件中是否有该名称的工作表"""
+    with zipfile.ZipFile(path) as archive:
+        return find_sheet_part(archive, sheet_name) is not None
+
+def scan_last_row(archive, part):
+    """流式扫描工作表XML，返回最后一个<row>的行号（没有行时为0）"""
+    last_row = 0
+    tail = b""
+    with archive.open(part) as source:
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            data = tail + chunk
+            for match in ROW_NUMBER_PATTERN.finditer(data):
+                last_row = max(last_row, int(match.group(1)))
+            # 保留末尾一段，避免<row ... r="...">被块边界截断
+            tail = data[-256:]
+    return last_row
+
+class StyleAppender:
+    """
+    为追加的单元格在已有的styles.xml中登记格式
+
+    相同的(数字格式, 对齐方式, 边框)只对应一个cellXfs条目，字体和填充使用工作簿的默认值（编号0）。
+    样式表中已有相同的数字格式、边框或单元格格式时直接使用已有的编号，每天追加不会让styles.xml变大。
+    """
+
+    def __init__(self, styles_xml):
+        self.styles_xml = styles_xml.decode("utf-8")
+        self.xf_count = self._count("cellXfs")
+        self.border_count = self._count("borders")
+        # 已有的自定义数字格式直接复用
+        self.custom_num_fmts = {}
+        for num_fmt in self._existing("numFmts"):
+            self.custom_num_fmts.setdefault(num_fmt.get("formatCode"), int(num_fmt.get("numFmtId")))
+        self.next_num_fmt_id = max([FIRST_CUSTOM_NUM_FMT_ID - 1] + list(self.custom_num_fmts.values())) + 1
+        self.new_num_fmts = []
+        # 已有的边框和单元格格式也直接复用，相同的条目取编号最小的一个
+        self.borders = {}
+        for border_id, border in enumerate(self._existing("borders")):
+            self.borders.setdefault(Border.from_tree(border), border_id)
+        self.new_borders = []
+        self.xfs = {}
+        for xf_id, xf in enumerate(self._existing("cellXfs")):
+            key = self._existing_xf_key(xf)
+            if key is not None:
+                self.xfs.setdefault(key, xf_id)
+        self.new_xfs = []
+        self.cell_styles = {}
+
+    def _existing(self, element):
+        """样式表中element的子元素列表，没有该元素或无法解析时为空列表"""
+        match = re.search(rf'<{element}\b[^>]*?(?:/>|>.*?</{element}>)', self.styles_xml, re.S)
+        if match is None:
+            return []
+        try:
+            return list(ET.fromstring(match.group(0)))
+        except ET.ParseError:
+            # 带命名空间前缀的扩展内容无法单独解析，此时只是不复用已有条目
+            return []
+
+    @staticmethod
+    def _existing_xf_key(xf):
+        """已有cellXfs条目对应的(数字格式编号, 边框编号, 对齐方式)，使用了其他字体、填充或保护时为None"""
+        if xf.get("fontId", "0") != "0" or xf.get("fillId", "0") != "0" or xf.get("xfId", "0") != "0":
+            return None
+        alignment = DEFAULT_ALIGNMENT
+        for child in xf:
+            if child.tag.rsplit("}", 1)[-1] != "alignment":
+                return None
+            alignment = Alignment.from_tree(child)
+        return (int(xf.get("numFmtId", 0)), int(xf.get("borderId", 0)), alignment)
+
+    def _count(self, element):
+        match = re.search(rf'<{element}\b[^>]*\bcount="(\d+)"', self.styles_xml)
+        if match is None:
+            raise ValueError(f"结果文件的样式表中没有{element}，无法追加")
+        return int(match.group(1))
+
+    def _num_fmt_id(self, number_format):
+        if number_format in BUILTIN_FORMATS_REVERSE:
+            return BUILTIN_FORMATS_REVERSE[number_format]
+        if number_format not in self.custom_num_fmts:
+            self.custom_num_fmts[number_format] = self.next_num_fmt_id
+            self.new_num_fmts.append(
+                f'<numFmt numFmtId="{self.next_num_fmt_id}" formatCode="{quoteattr_value(number_format)}"/>'
+            )
+            self.next_num_fmt_id += 1
+        return self.custom_num_fmts[number_format]
+
+    def _border_id(self, border):
+        if border not in self.borders:
+            self.borders[border] = self.border_count + len(self.new_borders)
+            self.new_borders.append(ET.tostring(border.to_tree(), encoding="unicode"))
+        return self.borders[border]
+
+    def xf_id(self, cell):
+        """单元格对应的cellXfs编号"""
+        # 按单元格在所属工作簿中的样式编号缓存，相同样式的单元格不再比较格式对象
+        xf_id = self.cell_styles.get(cell.style_id)
+        if xf_id is not None:
+            return xf_id
+
+        num_fmt_id = self._num_fmt_id(cell.number_format)
+        border_id = self._border_id(copy(cell.border))
+        alignment = copy(cell.alignment)
+        key = (num_fmt_id, border_id, alignment)
+        xf_id = self.xfs.get(key)
+        if xf_id is None:
+            if alignment != DEFAULT_ALIGNMENT:
+                alignment_attr = ' applyAlignment="1"'
+                alignment_xml = ET.tostring(alignment.to_tree(), encoding="unicode")
+            else:
+                alignment_attr = alignment_xml = ""
+            self.new_xfs.append(
+                f'<xf numFmtId="{num_fmt_id}" fontId="0" fillId="0" borderId="{border_id}" xfId="0"'
+                f' applyNumberFormat="1" applyBorder="1"{alignment_attr}>{alignment_xml}</xf>'
+            )
+            xf_id = self.xf_count + len(self.new_xfs) - 1
+            self.xfs[key] = xf_id
+        self.cell_styles[cell.style_id] = xf_id
+        return xf_id
+
+    def _append_to(self, text, element, items):
+        """在<element count="n">...</element>的末尾加入items并更新count"""
+        match = re.search(rf'<{element}\b[^>]*\bcount="(\d+)"[^>]*?(/?)>', text)
+        count = int(match.group(1)) + len(items)
+        if match.group(2):
+            # 空元素为<element count="0"/>
+            return text[:match.start()] + f'<{element} count="{count}">{"".join(items)}</{element}>' + text[match.end():]
+        close_index = text.index(f"</{element}>", match.end())
+        opening = re.sub(r'\bcount="\d+"', f'count="{count}"', match.group(0), count=1)
+        return text[:match.start()] + opening + text[match.end():close_index] + "".join(items) + text[close_index:]
+
+    def updated_xml(self):
+        """加入新格式后的styles.xml"""
+        text = self.styles_xml
+        if self.new_xfs:
+            text = self._append_to(text, "cellXfs", self.new_xfs)
+        if self.new_borders:
+            text = self._append_to(text, "borders", self.new_borders)
+        if self.new_num_fmts:
+            if re.search(r'<numFmts\b', text):
+                text = self._append_to(text, "numFmts", self.new_num_fmts)
+            else:
+                # numFmts是styleSheet的第一个子元素
+                match = re.search(r'<styleSheet\b[^>]*>', text)
+                num_fmts = f'<numFmts count="{len(self.new_num_fmts)}">{"".join(self.new_num_fmts)}</numFmts>'
+                text = text[:match.end()] + num_fmts + text[match.end():]
+        return text.encode("utf-8")
+
+def cell_xml(cell, row_idx, styles):
+    """一个单元格的<c>元素"""
+    ref = f"{get_column_letter(cell.column)}{row_idx}"
+    style = f' s="{styles.xf_id(cell)}"'
+    value = cell.value
+    if value is None:
+        return f'<c r="{ref}"{style}/>'
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{style} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{ref}"{style}><v>{value!r}</v></c>'
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return f'<c r="{ref}"{style}><v>{to_excel(value)!r}</v></c>'
+    text = escape(str(value))
+    return f'<c r="{ref}"{style} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+def rows_xml(ws, min_row, first_row_idx, styles):
+    """将ws中从min_row开始的行编码为<row>元素，第一行的行号为first_row_idx"""
+    parts = []
+    for offset, row in enumerate(ws.iter_rows(min_row=min_row, max_row=ws.max_row)):
+        row_idx = first_row_idx + offset
+        parts.append(f'<row r="{row_idx}">')
+        parts.extend(cell_xml(cell, row_idx, styles) for cell in row)
+        parts.append("</row>")
+    return "".join(parts).encode("utf-8")
+
+def copy_sheet_with_rows(source, target, new_rows, new_dimension, merge_refs):
+    """
+    流式复制工作表XML：替换<dimension>，在</sheetData>前插入新行，把新的合并区域加入<mergeCells>
+    """
+    head = b""
+    # 第一段：<sheetData>之前的部分（工作表属性、列宽等，通常很小）
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        head += chunk
+        sheet_data_index = head.find(b"<sheetData")
+        if sheet_data_index >= 0 or not chunk:
+            break
+    if sheet_data_index < 0:
+        raise ValueError("结果工作表的XML中没有sheetData，无法追加")
+    if new_dimension:
+        head = DIMENSION_PATTERN.sub(b'<dimension ref="' + new_dimension.encode("ascii") + b'"/>', head, count=1)
+
+    # 空工作表为<sheetData/>
+    empty_match = re.compile(rb"<sheetData\s*/>").match(head, sheet_data_index)
+    if empty_match:
+        target.write(head[:sheet_data_index] + b"<sheetData>" + new_rows + b"</sheetData>")
+        rest = head[empty_match.end():] + source.read()
+    else:
+        # 第二段：原有的行，按块复制，直到</sheetData>
+        close_tag = b"</sheetData>"
+        data = head
+        while True:
+            close_index = data.find(close_tag)
+            if close_index >= 0:
+                break
+            keep = len(close_tag) - 1
+            target.write(data[:-keep])
+            data = data[-keep:]
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                raise ValueError("结果工作表的XML不完整，无法追加")
+            data += chunk
+        target.write(data[:close_index] + new_rows + close_tag)
+        rest = data[close_index + len(close_tag):] + source.read()
+
+    # 第三段：</sheetData>之后的部分（合并单元格、页面设置等）
+    if merge_refs:
+        merge_xml = "".join(f'<mergeCell ref="{ref}"/>' for ref in merge_refs).encode("ascii")
+        match = re.search(rb'<mergeCells\b[^>]*\bcount="(\d+)"[^>]*>', rest)
+        if match:
+            count = int(match.group(1)) + len(merge_refs)
+            opening = re.sub(rb'\bcount="\d+"', b'count="%d"' % count, match.group(0), count=1)
+            close_index = rest.index(b"</mergeCells>", match.end())
+            rest = rest[:match.start()] + opening + rest[match.end():close_index] + merge_xml + rest[close_index:]
+        else:
+            positions = [rest.find(tag) for tag in ELEMENTS_AFTER_MERGE_CELLS]
+            positions = [position for position in positions if position >= 0]
+            insert_at = min(positions) if positions else rest.rindex(b"</worksheet>")
+            merge_cells = b'<mergeCells count="%d">' % len(merge_refs) + merge_xml + b"</mergeCells>"
+            rest = rest[:insert_at] + merge_cells + rest[insert_at:]
+    target.write(rest)
+
+def append_sheet_rows(path, sheet_name, ws, skip_header=True, compression=None):
+    """
+    将ws的行（及其合并区域）追加到已有xlsx文件中同名工作表的末尾
+
+    参数:
+        path: 已有的结果文件
+        sheet_name: 追加到的工作表名称
+        ws: 包含新行的openpyxl工作表，第一行为表头
+        skip_header: 目标工作表已有数据时是否跳过ws的表头行
+        compression: 重新写入压缩包时的压缩级别，None为deflate默认级别，0为不压缩
+
+    返回:
+        追加的行数
+    """
+    with zipfile.ZipFile(path) as archive:
+        part = find_sheet_part(archive, sheet_name)
+        if part is None:
+            raise ValueError(f"结果文件中没有工作表: {sheet_name}")
+
+        last_row = scan_last_row(archive, part)
+        min_row = 2 if skip_header and last_row > 0 else 1
+        if ws.max_row < min_row:
+            return 0
+        first_row_idx = last_row + 1
+        row_offset = first_row_idx - min_row
+        appended_rows = ws.max_row - min_row + 1
+
+        styles = StyleAppender(archive.read("xl/styles.xml"))
+        new_rows = rows_xml(ws, min_row, first_row_idx, styles)
+
+        # 新的合并区域按行偏移（跳过的表头行中的合并区域不追加）
+        merge_refs = []
+        for merged_range in ws.merged_cells.ranges:
+            if merged_range.min_row < min_row:
+                continue
+            merge_refs.append(f"{get_column_letter(merged_range.min_col)}{merged_range.min_row + row_offset}:"
+                              f"{get_column_letter(merged_range.max_col)}{merged_range.max_row + row_offset}")
+
+        # 已有的dimension与新行合并
+        new_dimension = None
+        with archive.open(part) as source:
+            match = DIMENSION_PATTERN.search(source.read(CHUNK_SIZE))
+        if match:
+            # 只有一个单元格时ref没有冒号，如"A1"
+            corners = match.group(1).decode("ascii").split(":")
+            min_col, dim_min_row, max_col, _ = range_boundaries(f"{corners[0]}:{corners[-1]}")
+            max_col = max(max_col or 1, ws.max_column)
+            new_dimension = f"{get_column_letter(min_col or 1)}{dim_min_row or 1}:{get_column_letter(max_col)}{last_row + appended_rows}"
+
+        if compression == 0:
+            compress_type, compresslevel = zipfile.ZIP_STORED, None
+        else:
+            compress_type, compresslevel = zipfile.ZIP_DEFLATED, compression
+
+        # 写入同目录的临时文件，完成后替换原文件
+        fd, temp_path = tempfile.mkstemp(suffix=".xlsx", dir=os.path.dirname(os.path.abspath(path)))
+        os.close(fd)
+        try:
+            with zipfile.ZipFile(temp_path, "w", compress_type, compresslevel=compresslevel, allowZip64=True) as output:
+                for info in archive.infolist():
+                    if info.filename == part:
+                        # 按文件名打开时使用压缩包的压缩方式和级别（裸ZipInfo默认为不压缩）
+                        with archive.open(info) as source, output.open(info.filename, "w", force_zip64=True) as target:
+                            copy_sheet_with_rows(source, target, new_rows, new_dimension, merge_refs)
+                    elif info.filename == "xl/styles.xml":
+                        output.writestr(info.filename, styles.updated_xml())
+                    else:
+                        # 其余部件保持原来的压缩方式，直接复制
+                        with archive.open(info) as source, output.open(info, "w", force_zip64=True) as target:
+                            while True:
+                                chunk = source.read(CHUNK_SIZE)
+                                if not chunk:
+                                    break
+                                target.write(chunk)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    os.replace(temp_path, path)
+    return appended_rows